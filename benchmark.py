@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import timeit
+from temporal_ml import *
+from feature_matrix import *
+from moment_stream import *
+from tree_learning import *
+from logreg_learning import *
+
+# reproducible timings of feature extraction, tree building and LogReg
+# training on synthetic data; results are saved as JSON so that runs from
+# different commits can be compared with compare_results
+
+DEFAULT_CONFIG = {
+	"entities": 200,
+	"events_per_entity": 100,
+	"event_types": 5,
+	"moments_per_entity": 20,
+	"features": 30,
+	"time_span": 1000.0,
+	"tree_sizes": [1000,4000],
+	"tree_depths": [3,6,-1],
+	"logreg_epochs": 10,
+	"repeats": 3,
+	"random_seed": 7355608,
+}
+
+# num_entities Examples with events_per_entity occurrences each (on average)
+# of event_types events, spread uniformly over [0,time_span); about a third of
+# occurrences last a while rather than being instantaneous, and every example
+# has an "Age" static value
+def generate_examples(num_entities,events_per_entity,event_types,time_span,random_seed):
+	generator = random.Random(random_seed)
+	event_names = ["E{0}".format(i) for i in range(event_types)]
+	examples = []
+	for i in range(num_entities):
+		example = Example("entity_{0}".format(i))
+		example.static_values["Age"] = float(generator.randint(18,90))
+		for j in range(generator.randint(events_per_entity/2,events_per_entity*3/2)):
+			start_time = generator.uniform(0.0,time_span)
+			end_time = start_time
+			if generator.random() < 1/3.0:
+				end_time += generator.expovariate(10.0/time_span)
+			example.add_event(generator.choice(event_names),start_time,end_time)
+		example.finalize()
+		examples.append(example)
+	return (examples,event_names)
+
+# num_features features cycling through every event-based Feature type (and
+# the wrappers), with random event sets and time scales
+def generate_features(num_features,event_names,time_span,random_seed):
+	generator = random.Random(random_seed)
+	features = []
+	for i in range(num_features):
+		names = generator.sample(event_names,generator.randint(1,min(3,len(event_names))))
+		scale = generator.uniform(time_span/100.0,time_span/5.0)
+		kind = i % 14
+		name = "F{0}".format(i)
+		if kind == 0:
+			feature = Feature_LastOccurrence(name,*names)
+		elif kind == 1:
+			feature = Feature_NextOccurrence(name,*names)
+		elif kind == 2:
+			feature = Feature_2ndLastOccurrence(name,*names)
+		elif kind == 3:
+			feature = Feature_KthLastOccurrence(name,generator.randint(1,5),*names)
+		elif kind == 4:
+			names_and_weights = []
+			for event_name in names:
+				names_and_weights += [event_name,generator.uniform(0.5,2.0)]
+			feature = Feature_Intensity(name,1.0/scale,*names_and_weights)
+		elif kind == 5:
+			feature = Feature_Frequency(name,-1.0,*names)
+		elif kind == 6:
+			feature = Feature_Recent_Frequency(name,scale,*names)
+		elif kind == 7:
+			feature = Feature_Count(name,*names)
+		elif kind == 8:
+			feature = Feature_TemporalWindow(name,scale,*names)
+		elif kind == 9:
+			feature = Feature_TwoSidedTemporalWindow(name,scale/2.0,scale,*names)
+		elif kind == 10:
+			feature = FeatureWrapper_Normalize_MaxSignalZero(Feature_LastOccurrence(name,*names),scale)
+		elif kind == 11:
+			feature = FeatureWrapper_Normalize_MaxSignalInf(Feature_Count(name,*names),scale)
+		elif kind == 12:
+			feature = FeatureWrapper_Inverse(Feature_TemporalWindow(name,scale,*names),name + " (inverted)")
+		else:
+			feature = Feature_Static(name,"Age")
+		features.append(feature)
+	return features
+
+# best wall-clock time of repeats calls
+def time_call(function,repeats):
+	best = float("Inf")
+	for i in range(repeats):
+		start = timeit.default_timer()
+		function()
+		best = min(best,timeit.default_timer()-start)
+	return best
+
+def run_benchmarks(config=None,verbosity=0):
+	settings = dict(DEFAULT_CONFIG)
+	if config != None:
+		settings.update(config)
+	seed = settings["random_seed"]
+	repeats = settings["repeats"]
+	records = []
+
+	def record(name,seconds,**details):
+		entry = dict(details)
+		entry["name"] = name
+		entry["seconds"] = seconds
+		records.append(entry)
+		if verbosity >= 1:
+			print "{0}\t{1:.6f}".format(name,seconds)
+
+	(examples,event_names) = generate_examples(settings["entities"],settings["events_per_entity"],settings["event_types"],settings["time_span"],seed)
+	features = generate_features(settings["features"],event_names,settings["time_span"],seed)
+	classlabel_feature = Feature_ClassLabel_ImpendingEvent("Impending E0",settings["time_span"]/20.0,event_names[0])
+	sampler = Random_Sampler(settings["moments_per_entity"],0.0,settings["time_span"],random_seed=seed)
+	moments = list(stream_moments(examples,sampler,classlabel_feature))
+
+	# per-cell queries, grouped by feature class
+	features_by_type = dict()
+	for feature in features:
+		features_by_type.setdefault(feature.__class__.__name__,[]).append(feature)
+	for type_name in sorted(features_by_type):
+		type_features = features_by_type[type_name]
+		seconds = time_call(lambda: [x.query(y) for y in moments for x in type_features],repeats)
+		record("query/" + type_name,seconds,queries=len(moments)*len(type_features),microseconds_per_query=1e6*seconds/(len(moments)*len(type_features)))
+
+	record("feature_matrix",time_call(lambda: build_feature_matrix(moments,features),repeats),rows=len(moments),features=len(features))
+
+	# tree sizes beyond the number of moments repeat rows
+	feature_matrix = build_feature_matrix(moments,features)
+	for tree_size in settings["tree_sizes"]:
+		size_matrix = feature_matrix.select_rows([x % len(feature_matrix) for x in range(tree_size)])
+		for max_depth in settings["tree_depths"]:
+			seconds = time_call(lambda: build_classification_tree(features,None,max_depth=max_depth,random_seed=seed,feature_matrix=size_matrix),repeats)
+			record("tree/{0}/{1}".format(tree_size,max_depth),seconds,rows=tree_size,max_depth=max_depth)
+
+	half = len(feature_matrix)/2
+	training_matrix = feature_matrix.select_rows(range(half))
+	tuning_matrix = feature_matrix.select_rows(range(half,len(feature_matrix)))
+	epochs = settings["logreg_epochs"]
+	def train_batch_epochs():
+		model = LogReg_Model(features)
+		model.train_batch(training_matrix,tuning_matrix,max_iterations=epochs,patience=epochs+1)
+	seconds = time_call(train_batch_epochs,repeats)
+	record("logreg/train_batch_epoch",seconds/epochs,rows=half,epochs=epochs)
+	def sgd_epoch():
+		model = LogReg_Model(features)
+		random.seed(seed)
+		model.training_iteration(training_matrix,0.1,verbosity=0)
+	record("logreg/train_epoch",time_call(sgd_epoch,repeats),rows=half)
+
+	return {"config":settings,"environment":environment(),"results":records}
+
+def environment():
+	try:
+		commit = subprocess.check_output(["git","rev-parse","HEAD"],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=open(os.devnull,"w")).strip()
+	except (OSError,subprocess.CalledProcessError):
+		commit = None
+	return {"python":platform.python_version(),"platform":platform.platform(),"commit":commit}
+
+def save_results(results,path):
+	with open(path,"w") as results_file:
+		json.dump(results,results_file,indent=1,sort_keys=True)
+
+def load_results(path):
+	with open(path) as results_file:
+		return json.load(results_file)
+
+# (name,old seconds,new seconds,ratio) for benchmarks present in both runs
+# whose time grew by more than threshold (0.1 = 10% slower), largest
+# slowdown first
+def compare_results(old_results,new_results,threshold=0.1):
+	old_seconds = dict((x["name"],x["seconds"]) for x in old_results["results"])
+	regressions = []
+	for entry in new_results["results"]:
+		if entry["name"] in old_seconds and old_seconds[entry["name"]] > 0.0:
+			ratio = entry["seconds"]/old_seconds[entry["name"]]
+			if ratio > 1.0+threshold:
+				regressions.append((entry["name"],old_seconds[entry["name"]],entry["seconds"],ratio))
+	regressions.sort(key=lambda x: x[3],reverse=True)
+	return regressions
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Time feature extraction, tree building and LogReg training on synthetic data.")
+	for (key,value) in sorted(DEFAULT_CONFIG.items()):
+		option = "--" + key.replace("_","-")
+		if isinstance(value,list):
+			parser.add_argument(option,type=int,nargs="+",default=value)
+		else:
+			parser.add_argument(option,type=type(value),default=value)
+	parser.add_argument("--output",help="write results to this JSON file")
+	parser.add_argument("--compare",help="report regressions against this earlier JSON results file")
+	parser.add_argument("--threshold",type=float,default=0.1)
+	arguments = parser.parse_args()
+
+	config = dict((key,getattr(arguments,key)) for key in DEFAULT_CONFIG)
+	results = run_benchmarks(config,verbosity=1)
+	if arguments.output != None:
+		save_results(results,arguments.output)
+	if arguments.compare != None:
+		regressions = compare_results(load_results(arguments.compare),results,arguments.threshold)
+		for (name,old_seconds,new_seconds,ratio) in regressions:
+			print "REGRESSION\t{0}\t{1:.6f} -> {2:.6f} ({3:.2f}x)".format(name,old_seconds,new_seconds,ratio)
+		if len(regressions) > 0:
+			sys.exit(1)
@@ -0,0 +1,456 @@
+import array
+import bisect
+import cPickle
+import csv
+import ctypes
+import itertools
+import mmap
+import operator
+import struct
+from temporal_ml import *
+
+# columnar store of the events of many examples ("entities"): one row per
+# occurrence, held in flat arrays rather than per-example Python objects
+# rows are grouped by entity, and within an entity by event code, with each
+# (entity,event) group sorted by start time; entity_offsets[i] is the first
+# row of the i-th entity, so an entity's events are one contiguous slice
+# events may be added in any order; they are sorted once by finalize, which
+# is called when the first example is made
+class Event_Store(object):
+
+	def __init__(self):
+		self.entity_ids = []
+		self.entity_positions = dict()
+		self.event_names = []
+		self.event_codes = dict()
+		self.static_values = dict() # entity id -> {static name: value}, only for entities that have any
+		# columns, one entry per occurrence
+		self.entities = array.array("l") # entity positions, only kept until finalize
+		self.codes = array.array("i")
+		self.starts = array.array("d")
+		self.ends = array.array("d") # aligned with starts
+		self.sorted_ends = array.array("d") # sorted independently of starts within each (entity,event) group
+		self.entity_offsets = array.array("l",[0])
+		self.is_finalized = True
+
+	def __len__(self):
+		return len(self.entity_ids)
+
+	def num_events(self):
+		return len(self.starts)
+
+	# entities first seen while the store is finalized (say, with only static
+	# values) get an empty range of rows, so the offsets still cover them
+	def entity_position(self,entity_id):
+		if entity_id not in self.entity_positions:
+			self.entity_positions[entity_id] = len(self.entity_ids)
+			self.entity_ids.append(entity_id)
+			if self.is_finalized:
+				self.entity_offsets.append(self.entity_offsets[-1])
+		return self.entity_positions[entity_id]
+
+	def event_code(self,event_name):
+		if event_name not in self.event_codes:
+			self.event_codes[event_name] = len(self.event_names)
+			self.event_names.append(event_name)
+		return self.event_codes[event_name]
+
+	def add_event(self,entity_id,event_name,event_start_time,event_end_time=None):
+		if self.is_finalized:
+			self.unfinalize()
+		if event_end_time == None:
+			event_end_time = event_start_time
+		self.entities.append(self.entity_position(entity_id))
+		self.codes.append(self.event_code(event_name))
+		self.starts.append(numeric_time(event_start_time))
+		self.ends.append(numeric_time(event_end_time))
+
+	# adds many events at once, given as parallel sequences (end_times may be
+	# None for instantaneous events); ids and names are coded with one dict
+	# lookup each, and the columns are extended without per-event calls
+	def add_events(self,entity_ids,event_names,start_times,end_times=None):
+		if self.is_finalized:
+			self.unfinalize()
+		for entity_id in set(entity_ids).difference(self.entity_positions):
+			self.entity_position(entity_id)
+		for event_name in set(event_names).difference(self.event_codes):
+			self.event_code(event_name)
+		if end_times == None:
+			end_times = start_times
+		self.entities.extend(array.array("l",map(self.entity_positions.__getitem__,entity_ids)))
+		self.codes.extend(array.array("i",map(self.event_codes.__getitem__,event_names)))
+		self.starts.extend(time_column(start_times))
+		self.ends.extend(time_column(end_times))
+
+	def add_static_value(self,entity_id,static_name,value):
+		self.entity_position(entity_id)
+		if entity_id not in self.static_values:
+			self.static_values[entity_id] = dict()
+		self.static_values[entity_id][static_name] = value
+
+	# puts the rows into (entity,event,start) order and computes the entity
+	# offsets and per-group sorted ends
+	# rows are first counting-sorted by entity, which needs only an array of
+	# row positions, and then each entity's (usually few) rows are sorted on
+	# their own; the entity column is dropped afterwards, since the offsets
+	# hold the same information
+	def finalize(self):
+		if self.is_finalized:
+			return
+		num_entities = len(self.entity_ids)
+		self.entity_offsets = array.array("l",[0])*(num_entities+1)
+		for entity in self.entities:
+			self.entity_offsets[entity+1] += 1
+		for i in range(num_entities):
+			self.entity_offsets[i+1] += self.entity_offsets[i]
+
+		next_rows = self.entity_offsets[:-1]
+		order = array.array("l",[0])*len(self.entities)
+		for (row,entity) in enumerate(self.entities):
+			order[next_rows[entity]] = row
+			next_rows[entity] += 1
+		next_rows = None
+		self.entities = array.array("l")
+		self.codes = array.array("i",map(self.codes.__getitem__,order))
+		self.starts = array.array("d",map(self.starts.__getitem__,order))
+		self.ends = array.array("d",map(self.ends.__getitem__,order))
+		order = None
+
+		self.sorted_ends = array.array("d",self.ends)
+		for i in range(num_entities):
+			(first_row,last_row) = (self.entity_offsets[i],self.entity_offsets[i+1])
+			if last_row - first_row < 2:
+				continue
+			rows = zip(self.codes[first_row:last_row],self.starts[first_row:last_row],self.ends[first_row:last_row])
+			rows.sort()
+			self.codes[first_row:last_row] = array.array("i",[x[0] for x in rows])
+			self.starts[first_row:last_row] = array.array("d",[x[1] for x in rows])
+			self.ends[first_row:last_row] = array.array("d",[x[2] for x in rows])
+			for (group_start,group_end) in event_groups(self.codes,first_row,last_row):
+				self.sorted_ends[group_start:group_end] = array.array("d",sorted(self.ends[group_start:group_end]))
+
+		self.is_finalized = True
+
+	# back to accepting events: the entity column is rebuilt from the offsets,
+	# and views handed out so far point into the current columns, so events
+	# are appended to copies rather than resizing those in place
+	def unfinalize(self):
+		self.entities = array.array("l")
+		for i in range(len(self.entity_offsets)-1):
+			self.entities.extend(array.array("l",[i])*(self.entity_offsets[i+1]-self.entity_offsets[i]))
+		self.codes = array.array("i",self.codes)
+		self.starts = array.array("d",self.starts)
+		self.ends = array.array("d",self.ends)
+		self.is_finalized = False
+
+	def find_entity(self,entity_id):
+		return self.entity_positions[entity_id]
+
+	def entity_id(self,entity_position):
+		return self.entity_ids[entity_position]
+
+	def entity_static_values(self,entity_position):
+		return self.static_values.get(self.entity_ids[entity_position],dict())
+
+	def example(self,entity_id):
+		return Stored_Example(self,self.find_entity(entity_id))
+
+	def examples(self):
+		for i in range(len(self)):
+			yield Stored_Example(self,i)
+
+	# Event_Timelines over one entity's events, keyed by event name; the
+	# timelines share memory with the store's columns
+	def entity_timelines(self,entity_position):
+		self.finalize()
+		timelines = dict()
+		first_row = self.entity_offsets[entity_position]
+		last_row = self.entity_offsets[entity_position+1]
+		for (group_start,group_end) in event_groups(self.codes,first_row,last_row):
+			event_name = self.event_names[self.codes[group_start]]
+			timelines[event_name] = Event_Timeline(column_view(self.starts,group_start,group_end),column_view(self.ends,group_start,group_end),column_view(self.sorted_ends,group_start,group_end))
+		return timelines
+
+# an Example whose events are read-only views into an Event_Store; it is
+# cheap to create, so examples can be made as needed and dropped afterwards
+class Stored_Example(Example):
+
+	def __init__(self,store,entity_position):
+		self.id = store.entity_id(entity_position)
+		self.static_values = store.entity_static_values(entity_position)
+		self.events = store.entity_timelines(entity_position)
+		self.indexes = dict()
+		self.store = store
+
+	def add_event(self,event_name,event_start_time,event_end_time=None):
+		raise ValueError("events of a Stored_Example are read-only; add them to its Event_Store")
+
+# an Event_Store read from a file written by save_event_store, with its
+# columns mapped straight from the file instead of being loaded; opening one
+# reads only the header and the event names, an entity's static values are
+# unpickled when its example is made, and processes that open the same file
+# share its pages through the OS page cache
+# the mapping is copy-on-write (ctypes can only view writable buffers), but
+# nothing ever writes to it; mapped stores are read-only
+class Mapped_Event_Store(Event_Store):
+
+	def __init__(self,path):
+		self.path = path
+		with open(path,"rb") as event_file:
+			self.mapping = mmap.mmap(event_file.fileno(),0,access=mmap.ACCESS_COPY)
+		header = struct.unpack_from(EVENT_FILE_HEADER,self.mapping,0)
+		(magic,version,self.num_entities,id_kind) = header[:4]
+		if magic != EVENT_FILE_MAGIC or version != EVENT_FILE_VERSION:
+			raise ValueError("{0} is not a version {1} event file".format(path,EVENT_FILE_VERSION))
+		sections = dict()
+		for i in range(len(EVENT_FILE_SECTIONS)):
+			sections[EVENT_FILE_SECTIONS[i]] = header[4+2*i:6+2*i]
+		self.entity_offsets = self.section_view(sections["entity_offsets"],ctypes.c_int64)
+		self.codes = self.section_view(sections["codes"],ctypes.c_int32)
+		self.starts = self.section_view(sections["starts"],ctypes.c_double)
+		self.ends = self.section_view(sections["ends"],ctypes.c_double)
+		self.sorted_ends = self.section_view(sections["sorted_ends"],ctypes.c_double)
+		self.static_offsets = self.section_view(sections["static_offsets"],ctypes.c_int64)
+		self.statics_start = sections["statics"][0]
+		self.unicode_ids = id_kind == UNICODE_IDS
+		if id_kind == INTEGER_IDS:
+			self.ids = self.section_view(sections["ids"],ctypes.c_int64)
+		else:
+			self.ids = Mapped_Strings(self.mapping,sections["ids"][0],self.section_view(sections["id_offsets"],ctypes.c_int64))
+		(names_start,names_length) = sections["event_names"]
+		self.event_names = cPickle.loads(self.mapping[names_start:names_start+names_length])
+		self.event_codes = dict()
+		for i in range(len(self.event_names)):
+			self.event_codes[self.event_names[i]] = i
+		self.is_finalized = True
+
+	# reopened by path when sent to another process
+	def __reduce__(self):
+		return (Mapped_Event_Store,(self.path,))
+
+	def section_view(self,section,item_type):
+		(start,length) = section
+		view_type = item_type*(length/ctypes.sizeof(item_type))
+		return view_type.from_buffer(self.mapping,start)
+
+	def __len__(self):
+		return self.num_entities
+
+	# entities are stored in id order (of their UTF-8 bytes, for unicode ids),
+	# so ids are found by binary search
+	def find_entity(self,entity_id):
+		if isinstance(entity_id,unicode):
+			entity_id = entity_id.encode("utf-8")
+		position = bisect.bisect_left(self.ids,entity_id)
+		if position == len(self.ids) or self.ids[position] != entity_id:
+			raise KeyError(entity_id)
+		return position
+
+	def entity_id(self,entity_position):
+		if self.unicode_ids:
+			return self.ids[entity_position].decode("utf-8")
+		return self.ids[entity_position]
+
+	def entity_static_values(self,entity_position):
+		start = self.statics_start+self.static_offsets[entity_position]
+		end = self.statics_start+self.static_offsets[entity_position+1]
+		if start == end:
+			return dict()
+		return cPickle.loads(self.mapping[start:end])
+
+	def entity_position(self,entity_id):
+		raise ValueError("a Mapped_Event_Store is read-only")
+
+	def add_event(self,entity_id,event_name,event_start_time,event_end_time=None):
+		raise ValueError("a Mapped_Event_Store is read-only")
+
+	def add_events(self,entity_ids,event_names,start_times,end_times=None):
+		raise ValueError("a Mapped_Event_Store is read-only")
+
+	def add_static_value(self,entity_id,static_name,value):
+		raise ValueError("a Mapped_Event_Store is read-only")
+
+# read-only sequence of the strings packed into mapping from start, with
+# string i running from offsets[i] to offsets[i+1]
+class Mapped_Strings(object):
+
+	def __init__(self,mapping,start,offsets):
+		self.mapping = mapping
+		self.start = start
+		self.offsets = offsets
+
+	def __len__(self):
+		return len(self.offsets)-1
+
+	def __getitem__(self,i):
+		return self.mapping[self.start+self.offsets[i]:self.start+self.offsets[i+1]]
+
+# event file layout: the header, then each section in EVENT_FILE_SECTIONS
+# order, each starting on an 8-byte boundary; the header holds the magic,
+# version, entity count and id kind, then an (offset,length) pair in bytes
+# for every section
+# numbers are in the machine's native byte order, so files move between
+# machines of the same endianness only
+EVENT_FILE_MAGIC = "TMLEVENT"
+EVENT_FILE_VERSION = 1
+EVENT_FILE_SECTIONS = ["entity_offsets","codes","starts","ends","sorted_ends","ids","id_offsets","static_offsets","statics","event_names"]
+EVENT_FILE_HEADER = "=8s3q" + "2q"*len(EVENT_FILE_SECTIONS)
+INTEGER_IDS = 0
+STRING_IDS = 1
+UNICODE_IDS = 2 # stored as UTF-8 and decoded again when read
+
+# writes store to path in the format Mapped_Event_Store opens
+# entity ids must be all integers or all strings; if any are unicode, they
+# are stored as UTF-8 and all ids are read back as unicode (so byte strings
+# must then be ASCII or UTF-8); entities are written in id order so that the
+# file needs no separate index
+def save_event_store(store,path):
+	store.finalize()
+	ids = [store.entity_id(i) for i in range(len(store))]
+	if all(isinstance(x,(int,long)) and not isinstance(x,bool) for x in ids):
+		id_kind = INTEGER_IDS
+	elif all(isinstance(x,basestring) for x in ids):
+		id_kind = STRING_IDS
+		if any(isinstance(x,unicode) for x in ids):
+			id_kind = UNICODE_IDS
+		ids = [x.encode("utf-8") if isinstance(x,unicode) else x for x in ids]
+	else:
+		raise ValueError("entity ids must be all integers or all strings to be saved")
+	order = sorted(range(len(ids)),key=ids.__getitem__)
+
+	entity_offsets = [0]
+	codes = array.array("i")
+	starts = array.array("d")
+	ends = array.array("d")
+	sorted_ends = array.array("d")
+	static_offsets = [0]
+	statics = []
+	for position in order:
+		(first_row,last_row) = (store.entity_offsets[position],store.entity_offsets[position+1])
+		codes.extend(store.codes[first_row:last_row])
+		starts.extend(store.starts[first_row:last_row])
+		ends.extend(store.ends[first_row:last_row])
+		sorted_ends.extend(store.sorted_ends[first_row:last_row])
+		entity_offsets.append(len(codes))
+		static_values = store.entity_static_values(position)
+		if len(static_values) > 0:
+			statics.append(cPickle.dumps(static_values,cPickle.HIGHEST_PROTOCOL))
+		else:
+			statics.append("")
+		static_offsets.append(static_offsets[-1]+len(statics[-1]))
+
+	if id_kind == INTEGER_IDS:
+		ids_section = int64_array([ids[x] for x in order])
+		id_offsets = int64_array([])
+	else:
+		ids_section = "".join(ids[x] for x in order)
+		id_offsets = [0]
+		for position in order:
+			id_offsets.append(id_offsets[-1]+len(ids[position]))
+		id_offsets = int64_array(id_offsets)
+	sections = [int64_array(entity_offsets),codes,starts,ends,sorted_ends,ids_section,id_offsets,int64_array(static_offsets),"".join(statics),cPickle.dumps(list(store.event_names),cPickle.HIGHEST_PROTOCOL)]
+
+	section_table = []
+	offset = padded_length(struct.calcsize(EVENT_FILE_HEADER))
+	for section in sections:
+		length = len(buffer(section))
+		section_table += [offset,length]
+		offset = padded_length(offset+length)
+	with open(path,"wb") as event_file:
+		event_file.write(struct.pack(EVENT_FILE_HEADER,EVENT_FILE_MAGIC,EVENT_FILE_VERSION,len(ids),id_kind,*section_table))
+		for i in range(len(sections)):
+			event_file.write("\0"*(section_table[2*i]-event_file.tell()))
+			event_file.write(buffer(sections[i]))
+
+def padded_length(length):
+	return (length+7)//8*8
+
+# 64-bit integers in an array where the platform's long is 64 bits, and in a
+# ctypes array otherwise
+def int64_array(values):
+	if array.array("l").itemsize == 8:
+		return array.array("l",values)
+	return (ctypes.c_int64*len(values))(*values)
+
+# (first row,end row) of each run of equal codes in codes[first_row:last_row],
+# which must be one entity's rows (codes only ascend within an entity)
+def event_groups(codes,first_row,last_row):
+	groups = []
+	group_start = first_row
+	while group_start < last_row:
+		group_end = bisect.bisect_right(codes,codes[group_start],group_start,last_row)
+		groups.append((group_start,group_end))
+		group_start = group_end
+	return groups
+
+# times as a float array; numbers go in directly, and only columns holding
+# something else (dates) are converted one value at a time
+def time_column(times):
+	try:
+		return array.array("d",times)
+	except TypeError:
+		return array.array("d",map(numeric_time,times))
+
+# column[first_row:last_row] without copying; the view keeps column alive, and
+# column must not be resized while views exist
+def column_view(column,first_row,last_row):
+	view_type = ctypes.c_double*(last_row-first_row)
+	return view_type.from_buffer(column,first_row*ctypes.sizeof(ctypes.c_double))
+
+# an Event_Store holding the events and static values of existing Examples
+def store_examples(examples):
+	store = Event_Store()
+	for example in examples:
+		store.entity_position(example.id)
+		for (event_name,timeline) in example.events.items():
+			for (start_time,end_time) in timeline:
+				store.add_event(example.id,event_name,start_time,end_time)
+		for (static_name,value) in example.static_values.items():
+			store.add_static_value(example.id,static_name,value)
+	store.finalize()
+	return store
+
+# bulk loads events from a CSV file with a header row, one occurrence per
+# line; times are converted with parse_time (float by default), and a missing
+# or empty end column means instantaneous events
+# rows are read chunk_size at a time and added column by column, so no
+# per-example objects are created; pass store to load several files into one
+def load_event_csv(path,entity_column="id",event_column="event",start_column="start",end_column="end",parse_time=float,store=None,chunk_size=10000):
+	if store == None:
+		store = Event_Store()
+	with open(path,"rb") as event_file:
+		reader = csv.reader(event_file)
+		header = reader.next()
+		column_indexes = [header.index(entity_column),header.index(event_column),header.index(start_column)]
+		if end_column in header:
+			column_indexes.append(header.index(end_column))
+		while True:
+			rows = list(itertools.islice(reader,chunk_size))
+			if len(rows) == 0:
+				break
+			columns = [map(operator.itemgetter(i),rows) for i in column_indexes]
+			rows = None
+			start_times = map(parse_time,columns[2])
+			end_times = None
+			if len(columns) > 3 and "" not in columns[3]:
+				end_times = map(parse_time,columns[3])
+			elif len(columns) > 3:
+				end_times = [start_time if end_time == "" else parse_time(end_time) for (start_time,end_time) in zip(start_times,columns[3])]
+			store.add_events(columns[0],columns[1],start_times,end_times)
+	return store
+
+# loads static values from a CSV file with a header row, one entity per line;
+# every column other than entity_column becomes a static value, converted with
+# parse_value
+def load_static_csv(path,entity_column="id",parse_value=float,store=None):
+	if store == None:
+		store = Event_Store()
+	with open(path,"rb") as static_file:
+		reader = csv.reader(static_file)
+		header = reader.next()
+		entity_index = header.index(entity_column)
+		for row in reader:
+			for i in range(len(header)):
+				if i != entity_index:
+					store.add_static_value(row[entity_index],header[i],parse_value(row[i]))
+	return store
@@ -0,0 +1,358 @@
+import array
+import csv
+import itertools
+import instrumentation
+
+# labels are stored compactly: 1 for "+", 0 for anything else
+POSITIVE = 1
+NEGATIVE = 0
+
+def encode_label(label):
+	if label == "+":
+		return POSITIVE
+	return NEGATIVE
+
+# dense feature values for a list of instances (usually Example_Moments),
+# stored column by column so that each feature's values sit in one array
+# columns are found by feature identity, since features that differ only in
+# parameters (a wrapper's median, say) can share a name and type and so be
+# equal; a feature that is not one of self.features (one loaded from a model
+# file, say) falls back to the last equal one
+class Feature_Matrix(object):
+
+	def __init__(self,features,columns,labels=None,weights=None):
+		self.features = list(features)
+		self.columns = columns
+		self.labels = labels
+		self.weights = weights
+		self.index_features()
+
+	def index_features(self):
+		self.feature_index = dict()
+		self.equal_feature_index = dict()
+		for i in range(len(self.features)):
+			self.feature_index[id(self.features[i])] = i
+			self.equal_feature_index[self.features[i]] = i
+
+	# the identity index is rebuilt, as the features' ids change when unpickled
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		del state["feature_index"]
+		del state["equal_feature_index"]
+		return state
+
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		self.index_features()
+
+	def __len__(self):
+		if len(self.columns) > 0:
+			return len(self.columns[0])
+		if self.labels != None:
+			return len(self.labels)
+		return 0
+
+	def num_features(self):
+		return len(self.features)
+
+	def column(self,feature):
+		if id(feature) in self.feature_index:
+			return self.columns[self.feature_index[id(feature)]]
+		return self.columns[self.equal_feature_index[feature]]
+
+	def value(self,row_index,feature_index):
+		return self.columns[feature_index][row_index]
+
+	def row(self,row_index):
+		return [column[row_index] for column in self.columns]
+
+	def is_positive(self,row_index):
+		return self.labels[row_index] == POSITIVE
+
+	# a new matrix holding the given rows in the given order; rows may repeat
+	def select_rows(self,row_indexes):
+		columns = [compact_column([column[x] for x in row_indexes]) for column in self.columns]
+		labels = None
+		weights = None
+		if self.labels != None:
+			labels = array.array("b",[self.labels[x] for x in row_indexes])
+			weights = array.array("d",[self.weights[x] for x in row_indexes])
+		return Feature_Matrix(self.features,columns,labels,weights)
+
+# evaluates every feature for every instance; wrappers whose inner feature is
+# also being evaluated reuse the inner feature's values instead of querying it
+# again, and features with a grid sweep are evaluated once per example over all
+# of that example's moments, following a Feature_Plan so that features over
+# the same events share their sweeps
+# labels and weights come from classlabel_feature if given, otherwise from the
+# instances' own label/weight attributes if they have them
+def build_feature_matrix(instances,features,classlabel_feature=None):
+
+	moment_groups = group_by_example(instances)
+
+	value_cache = dict()
+	if moment_groups != None:
+		Feature_Plan(features).evaluate(instances,moment_groups,value_cache)
+	columns = [compact_column(feature_values(feature,instances,moment_groups,value_cache)) for feature in features]
+
+	labels = None
+	weights = None
+	if classlabel_feature != None:
+		label_weight_pairs = [classlabel_feature.query(x) for x in instances]
+	else:
+		try:
+			label_weight_pairs = [(x.label,x.weight) for x in instances]
+		except AttributeError:
+			label_weight_pairs = None
+	if label_weight_pairs != None:
+		labels = array.array("b",[encode_label(x[0]) for x in label_weight_pairs])
+		weights = array.array("d",[x[1] for x in label_weight_pairs])
+
+	return Feature_Matrix(features,columns,labels,weights)
+
+# value_cache is keyed on feature identity, not equality, since distinct
+# features may share a name and type
+# with instrumentation enabled, each column's time is recorded under
+# "matrix_column/" and the feature's class
+def feature_values(feature,instances,moment_groups,value_cache):
+	key = id(feature)
+	if key not in value_cache:
+		if instrumentation.recorder != None:
+			start = instrumentation.clock()
+		if hasattr(feature,"inner_feature") and hasattr(feature,"transform"):
+			inner_values = feature_values(feature.inner_feature,instances,moment_groups,value_cache)
+			value_cache[key] = [feature.transform(x) for x in inner_values]
+		elif moment_groups != None and hasattr(feature,"grid_values"):
+			values = [None]*len(instances)
+			for (example,indexes) in moment_groups:
+				grid = feature.query_grid(example,[instances[i].moment for i in indexes])
+				for (i,value) in zip(indexes,grid):
+					values[i] = value
+			value_cache[key] = values
+		else:
+			value_cache[key] = [feature.query(x) for x in instances]
+		if instrumentation.recorder != None:
+			instrumentation.recorder.add_time("matrix_column/" + feature.__class__.__name__,instrumentation.clock()-start)
+	return value_cache[key]
+
+# an execution plan for evaluating a feature set over each example's moments,
+# grouping features (wrapped ones by their inner feature) by the primitive
+# they derive from and its events:
+# "counts": features with count_values read one Grid_Counts per example and
+# event set, so each count (started, ended, ended by an offset) and distance
+# is swept once however many features (window sizes, k values, ...) use it
+# "decayed sums": intensities over the same events and weights, whose
+# indexes share one ordered history (see Intensity_Index) across decay rates
+# features of any other kind are not planned; wrappers transform their inner
+# feature's values afterwards (see feature_values)
+class Feature_Plan(object):
+
+	def __init__(self,features):
+		self.groups = [] # (primitive,event names,features)
+		group_positions = dict()
+		planned = set()
+		for feature in features:
+			while hasattr(feature,"inner_feature") and hasattr(feature,"transform"):
+				feature = feature.inner_feature
+			if id(feature) in planned:
+				continue
+			if hasattr(feature,"count_values"):
+				key = ("counts",tuple(sorted(feature.event_names)))
+			elif hasattr(feature,"intensity_index"):
+				key = ("decayed sums",tuple(feature.event_names),tuple(feature.event_weights))
+			else:
+				continue
+			planned.add(id(feature))
+			if key not in group_positions:
+				group_positions[key] = len(self.groups)
+				self.groups.append((key[0],key[1],[]))
+			self.groups[group_positions[key]][2].append(feature)
+		self.sweeps = [set() for x in self.groups] # the counts each group used
+
+	# fills value_cache (see feature_values) with every planned feature's values
+	# with instrumentation enabled, each group's time is recorded under
+	# "matrix_plan/" and its primitive
+	def evaluate(self,instances,moment_groups,value_cache):
+		for (primitive,event_names,group_features) in self.groups:
+			for feature in group_features:
+				value_cache[id(feature)] = [None]*len(instances)
+		for (example,indexes) in moment_groups:
+			times = [instances[i].time for i in indexes]
+			order = sorted(range(len(times)),key=times.__getitem__)
+			sorted_times = [times[i] for i in order]
+			positions = [indexes[i] for i in order]
+			for i in range(len(self.groups)):
+				(primitive,event_names,group_features) = self.groups[i]
+				if instrumentation.recorder != None:
+					start = instrumentation.clock()
+				if primitive == "counts":
+					grid_counts = example.grid_counts(group_features[0].event_names,sorted_times)
+					group_values = [x.count_values(grid_counts) for x in group_features]
+					self.sweeps[i].update(grid_counts.counts)
+				else:
+					group_values = [x.grid_values(example,sorted_times) for x in group_features]
+				for (feature,values) in zip(group_features,group_values):
+					column = value_cache[id(feature)]
+					for (position,value) in zip(positions,values):
+						column[position] = value
+				if instrumentation.recorder != None:
+					instrumentation.recorder.add_time("matrix_plan/" + primitive,instrumentation.clock()-start)
+
+	# one line per group: its primitive and events, the counts it swept (once
+	# evaluated) and the features derived from it
+	def describe(self):
+		lines = []
+		for i in range(len(self.groups)):
+			(primitive,event_names,group_features) = self.groups[i]
+			line = "{0} of {1}".format(primitive,",".join(event_names))
+			if len(self.sweeps[i]) > 0:
+				line += " [{0}]".format(", ".join(sorted(sweep_name(x) for x in self.sweeps[i])))
+			lines.append(line + ": " + ", ".join(x.feature_name for x in group_features))
+		return lines
+
+# a Grid_Counts sweep's key as text, parameters in parentheses
+def sweep_name(key):
+	if isinstance(key,tuple):
+		return "{0}({1})".format(key[0],repr(key[1]))
+	return key
+
+# (example,instance indexes) pairs, one per distinct example, with each
+# example's timelines sorted; None unless every instance is an Example_Moment
+def group_by_example(instances):
+	groups = dict()
+	for i in range(len(instances)):
+		example = getattr(instances[i],"example",None)
+		if example == None or not hasattr(example,"events"):
+			return None
+		if id(example) not in groups:
+			example.finalize()
+			groups[id(example)] = (example,[])
+		groups[id(example)][1].append(i)
+	return groups.values()
+
+# numeric columns become float arrays; anything else (dates from
+# Feature_Moment, strings from Feature_Static) stays a plain list
+def compact_column(values):
+	try:
+		return array.array("d",values)
+	except TypeError:
+		return values
+
+# the labels and weights of the same instances under several class label
+# features (typically one kind of label at many prediction horizons), each
+# held as a compact array pair like a Feature_Matrix's labels and weights
+# labels are found by feature identity, as a Feature_Matrix's columns are, since
+# labels at different horizons can share a name and type
+class Label_Matrix(object):
+
+	def __init__(self,classlabel_features,labels,weights):
+		self.classlabel_features = list(classlabel_features)
+		self.labels = labels
+		self.weights = weights
+		self.index_classlabels()
+
+	def index_classlabels(self):
+		self.classlabel_index = dict()
+		self.equal_classlabel_index = dict()
+		for i in range(len(self.classlabel_features)):
+			self.classlabel_index[id(self.classlabel_features[i])] = i
+			self.equal_classlabel_index[self.classlabel_features[i]] = i
+
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		del state["classlabel_index"]
+		del state["equal_classlabel_index"]
+		return state
+
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		self.index_classlabels()
+
+	def __len__(self):
+		if len(self.labels) > 0:
+			return len(self.labels[0])
+		return 0
+
+	def classlabel_position(self,classlabel_feature):
+		if id(classlabel_feature) in self.classlabel_index:
+			return self.classlabel_index[id(classlabel_feature)]
+		return self.equal_classlabel_index[classlabel_feature]
+
+	def labels_for(self,classlabel_feature):
+		return self.labels[self.classlabel_position(classlabel_feature)]
+
+	def weights_for(self,classlabel_feature):
+		return self.weights[self.classlabel_position(classlabel_feature)]
+
+	# feature_matrix (over the same instances, in the same order) relabeled
+	# with classlabel_feature; columns are shared, not copied
+	def labeled_matrix(self,feature_matrix,classlabel_feature):
+		return Feature_Matrix(feature_matrix.features,feature_matrix.columns,self.labels_for(classlabel_feature),self.weights_for(classlabel_feature))
+
+# labels every instance with every class label feature; features with
+# label_arrays (the event-based ClassLabels) are labeled from their
+# distance_feature's values, which are computed once for all the labels
+# sharing them (by grid sweep when the instances are Example_Moments), and
+# the rest are queried instance by instance
+def build_label_matrix(instances,classlabel_features):
+
+	moment_groups = group_by_example(instances)
+
+	value_cache = dict()
+	distance_columns = dict()
+	labels = []
+	weights = []
+	for classlabel_feature in classlabel_features:
+		if hasattr(classlabel_feature,"label_arrays"):
+			distance_feature = classlabel_feature.distance_feature()
+			if distance_feature not in distance_columns:
+				distance_columns[distance_feature] = feature_values(distance_feature,instances,moment_groups,value_cache)
+			(feature_labels,feature_weights) = classlabel_feature.label_arrays(distance_columns[distance_feature])
+		else:
+			label_weight_pairs = [classlabel_feature.query(x) for x in instances]
+			feature_labels = array.array("b",[encode_label(x[0]) for x in label_weight_pairs])
+			feature_weights = array.array("d",[x[1] for x in label_weight_pairs])
+		labels.append(feature_labels)
+		weights.append(feature_weights)
+
+	return Label_Matrix(classlabel_features,labels,weights)
+
+# writes a sequence of Feature_Matrix chunks over the same features to one CSV
+# file, a row per instance: label (1/0, blank if unlabeled), weight, then the
+# feature values; chunks are written as they arrive, so the sequence can be a
+# generator producing more rows than fit in memory
+def write_feature_matrices(feature_matrices,path):
+	with open(path,"wb") as matrix_file:
+		writer = csv.writer(matrix_file)
+		header_written = False
+		for feature_matrix in feature_matrices:
+			if not header_written:
+				writer.writerow(["label","weight"] + [x.feature_name for x in feature_matrix.features])
+				header_written = True
+			for row_index in range(len(feature_matrix)):
+				if feature_matrix.labels != None:
+					label_and_weight = [feature_matrix.labels[row_index],repr(feature_matrix.weights[row_index])]
+				else:
+					label_and_weight = ["",""]
+				writer.writerow(label_and_weight + [repr(x) for x in feature_matrix.row(row_index)])
+
+# reads a file written by write_feature_matrices back as Feature_Matrix chunks
+# of up to chunk_size rows over features (given in the file's column order);
+# feature values must be numeric
+def read_feature_matrices(path,features,chunk_size=10000):
+	with open(path,"rb") as matrix_file:
+		reader = csv.reader(matrix_file)
+		header = reader.next()
+		if header[2:] != [x.feature_name for x in features]:
+			raise ValueError("{0} does not hold the given features".format(path))
+		while True:
+			rows = list(itertools.islice(reader,chunk_size))
+			if len(rows) == 0:
+				return
+			columns = [array.array("d",[float(x[j]) for x in rows]) for j in range(2,len(header))]
+			labels = None
+			weights = None
+			if rows[0][0] != "":
+				labels = array.array("b",[int(x[0]) for x in rows])
+				weights = array.array("d",[float(x[1]) for x in rows])
+			yield Feature_Matrix(features,columns,labels,weights)
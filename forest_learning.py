@@ -0,0 +1,152 @@
+import multiprocessing
+import multiprocessing.sharedctypes
+import random
+from tree_learning import *
+
+# bagged ensemble of classification trees: each tree is grown on a bootstrap
+# sample of the training instances, with build_classification_tree's
+# candidate_feature_proportion supplying the random feature subspaces
+# predictions are the average of the trees' predictions
+class Random_Forest(object):
+
+	def __init__(self,features,num_trees=100,max_depth=-1,candidate_feature_proportion=.2,minimum_node_weight=0.0,random_seed=None):
+		self.features = features
+		self.num_trees = num_trees
+		self.max_depth = max_depth
+		self.candidate_feature_proportion = candidate_feature_proportion
+		self.minimum_node_weight = minimum_node_weight
+		self.random_seed = random_seed
+		self.trees = []
+		self.compiled_trees = []
+		self.tree_seeds = []
+		self.out_of_bag_error = None
+
+	# each tree's bootstrap sample and split choices come from its own seed,
+	# drawn up front from random_seed, so the forest is the same whatever
+	# n_jobs is; with n_jobs > 1 the trees are grown in worker processes that
+	# share the training feature matrix through shared memory
+	def train(self,instances,n_jobs=1,feature_matrix=None,verbosity=0):
+
+		if feature_matrix == None:
+			feature_matrix = build_feature_matrix(instances,self.features)
+
+		seed_generator = random.Random(self.random_seed)
+		self.tree_seeds = [seed_generator.randint(0,2**31-1) for i in range(self.num_trees)]
+		tree_parameters = (self.max_depth,self.candidate_feature_proportion,self.minimum_node_weight)
+
+		if n_jobs <= 1:
+			self.trees = []
+			for i in range(self.num_trees):
+				if verbosity >= 1:
+					print "Building tree {0}/{1}...".format(i+1,self.num_trees)
+				self.trees.append(build_forest_tree(self.features,feature_matrix,self.tree_seeds[i],tree_parameters))
+		else:
+			columns = [multiprocessing.sharedctypes.RawArray("d",feature_matrix.column(x)) for x in self.features]
+			labels = multiprocessing.sharedctypes.RawArray("b",feature_matrix.labels)
+			weights = multiprocessing.sharedctypes.RawArray("d",feature_matrix.weights)
+			shared_feature_matrix = Feature_Matrix(self.features,columns,labels,weights)
+			pool = multiprocessing.Pool(n_jobs,init_forest_worker,(self.features,shared_feature_matrix,tree_parameters))
+			try:
+				encoded_trees = pool.map(build_shared_forest_tree,self.tree_seeds,1)
+			finally:
+				pool.terminate()
+				pool.join()
+			self.trees = [decode_split_features(x,self.features) for x in encoded_trees]
+		self.compiled_trees = [x.compile() for x in self.trees]
+
+		self.out_of_bag_error = self.compute_out_of_bag_error(feature_matrix)
+		if verbosity >= 1:
+			print "Out-of-bag error: {0}".format(self.out_of_bag_error)
+
+	def query(self,query_instance):
+		return mean([x.query(query_instance) for x in self.compiled_trees])
+
+	def query_row(self,feature_matrix,row_index):
+		return mean([x.query_row(feature_matrix,row_index) for x in self.compiled_trees])
+
+	# predictions for every row of feature_matrix, each tree predicting the
+	# whole matrix at once
+	def predict(self,feature_matrix):
+		prediction_sums = [0.0]*len(feature_matrix)
+		for compiled_tree in self.compiled_trees:
+			prediction_sums = [x+y for (x,y) in zip(prediction_sums,compiled_tree.predict(feature_matrix))]
+		return [x/len(self.compiled_trees) for x in prediction_sums]
+
+	# average prediction for each training row over only the trees whose
+	# bootstrap sample left it out; None for rows every tree saw
+	def out_of_bag_predictions(self,feature_matrix):
+		prediction_sums = [0.0]*len(feature_matrix)
+		prediction_counts = [0]*len(feature_matrix)
+		for i in range(len(self.trees)):
+			in_bag = set(bootstrap_sample(len(feature_matrix),self.tree_seeds[i]))
+			for row_index in range(len(feature_matrix)):
+				if row_index not in in_bag:
+					prediction_sums[row_index] += self.compiled_trees[i].query_row(feature_matrix,row_index)
+					prediction_counts[row_index] += 1
+		predictions = []
+		for row_index in range(len(feature_matrix)):
+			if prediction_counts[row_index] == 0:
+				predictions.append(None)
+			else:
+				predictions.append(prediction_sums[row_index]/prediction_counts[row_index])
+		return predictions
+
+	# weighted mean absolute difference between out-of-bag predictions and
+	# labels (1 for "+", 0 for "-"), over rows left out by at least one tree
+	def compute_out_of_bag_error(self,feature_matrix):
+		sum_error = 0.0
+		sum_weight = 0.0
+		predictions = self.out_of_bag_predictions(feature_matrix)
+		for row_index in range(len(feature_matrix)):
+			if predictions[row_index] != None:
+				label = float(feature_matrix.is_positive(row_index))
+				sum_error += feature_matrix.weights[row_index] * abs(label - predictions[row_index])
+				sum_weight += feature_matrix.weights[row_index]
+		if sum_weight <= 0.0:
+			return None
+		return sum_error/sum_weight
+
+# row indexes of a bootstrap sample (num_rows draws with replacement)
+def bootstrap_sample(num_rows,seed):
+	sample_random = random.Random(seed)
+	return [sample_random.randrange(num_rows) for i in range(num_rows)]
+
+def build_forest_tree(features,feature_matrix,seed,tree_parameters):
+	(max_depth,candidate_feature_proportion,minimum_node_weight) = tree_parameters
+	sample_matrix = feature_matrix.select_rows(bootstrap_sample(len(feature_matrix),seed))
+	return build_classification_tree(features,None,max_depth,candidate_feature_proportion,minimum_node_weight,random_seed=seed,feature_matrix=sample_matrix)
+
+# shared data for Random_Forest's worker processes, set when each worker starts
+forest_worker_data = None
+
+def init_forest_worker(features,feature_matrix,tree_parameters):
+	global forest_worker_data
+	forest_worker_data = (features,feature_matrix,tree_parameters)
+
+# trees travel back from workers with split features replaced by their
+# positions in the feature list, rather than pickled feature objects
+def build_shared_forest_tree(seed):
+	(features,feature_matrix,tree_parameters) = forest_worker_data
+	tree = build_forest_tree(features,feature_matrix,seed,tree_parameters)
+	return encode_split_features(tree,features)
+
+def encode_split_features(tree,features):
+	feature_positions = dict()
+	for i in range(len(features)):
+		feature_positions[id(features[i])] = i
+	worklist = [tree]
+	while worklist:
+		node = worklist.pop()
+		if not node.leaf:
+			node.split_feature = feature_positions[id(node.split_feature)]
+			worklist += [node.left_child,node.right_child]
+	return tree
+
+def decode_split_features(tree,features):
+	worklist = [tree]
+	while worklist:
+		node = worklist.pop()
+		if not node.leaf:
+			node.split_feature = features[node.split_feature]
+			worklist += [node.left_child,node.right_child]
+	return tree
@@ -0,0 +1,73 @@
+import collections
+import json
+import timeit
+
+# opt-in counts and timings for feature queries, caches, tree building and
+# LogReg training, kept as structured data instead of printed
+# totals are (calls,seconds) per name, e.g. "query/Feature_Count",
+# "query_cache/hits" or "tree/sort"; records are one dict per event of
+# interest (a tree node built, a LogReg epoch run), with a "kind" field
+# nested work is counted in full at every level (a wrapper's query time
+# includes its inner feature's), and worker processes do not report back
+class Recorder(object):
+
+	def __init__(self):
+		self.calls = collections.defaultdict(int)
+		self.seconds = collections.defaultdict(float)
+		self.records = []
+
+	def add_time(self,name,seconds,calls=1):
+		self.calls[name] += calls
+		self.seconds[name] += seconds
+
+	def count(self,name,calls=1):
+		self.calls[name] += calls
+
+	def add_record(self,kind,**fields):
+		fields["kind"] = kind
+		self.records.append(fields)
+
+	# one dict per name, most time first
+	def totals(self):
+		totals = [{"name":x,"calls":self.calls[x],"seconds":self.seconds.get(x,0.0)} for x in self.calls]
+		totals.sort(key=lambda x: (-x["seconds"],x["name"]))
+		return totals
+
+	# hits/(hits+misses) for cache ("query_cache" or "index_cache"), None if
+	# it has not been consulted
+	def hit_rate(self,cache):
+		hits = self.calls.get(cache + "/hits",0)
+		misses = self.calls.get(cache + "/misses",0)
+		if hits + misses == 0:
+			return None
+		return float(hits)/(hits+misses)
+
+	# totals then records, one JSON object per line
+	def write(self,path):
+		with open(path,"w") as output_file:
+			for total in self.totals():
+				total = dict(total)
+				total["kind"] = "total"
+				output_file.write(json.dumps(total,sort_keys=True) + "\n")
+			for record in self.records:
+				output_file.write(json.dumps(record,sort_keys=True) + "\n")
+
+	def clear(self):
+		self.calls.clear()
+		self.seconds.clear()
+		self.records = []
+
+# the recorder every hook reports to; None (the default) turns instrumentation
+# off, leaving one global lookup per hook
+recorder = None
+
+clock = timeit.default_timer
+
+def enable_instrumentation():
+	global recorder
+	recorder = Recorder()
+	return recorder
+
+def disable_instrumentation():
+	global recorder
+	recorder = None
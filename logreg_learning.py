@@ -1,7 +1,10 @@
 
 import math
+import operator
 import random
+import instrumentation
 from temporal_ml import *
+from feature_matrix import *
 
 class LogReg_Model:
 
@@ -13,10 +16,13 @@ class LogReg_Model:
 			self.feature_weights[name] = [0.0]
 		self.chosen_iteration = None
 	
-	def train(self,training_examples,tuning_examples,learning_rate = 0.1,learning_rate_decay_rate = 0.01):
+	def train(self,training_examples,tuning_examples,learning_rate = 0.1,learning_rate_decay_rate = 0.01,verbosity = 1):
 	
 		random.seed(7355608)
 		
+		training_examples = self.feature_matrix(training_examples)
+		tuning_examples = self.feature_matrix(tuning_examples)
+		
 		tuning_error_rates = [float("inf")]
 		tuning_error_rates.append(self.compute_average_error(tuning_examples))
 		training_error_rates = []
@@ -24,22 +30,30 @@ class LogReg_Model:
 		
 		current_learning_rate = learning_rate
 		
-		print "Iter\tTrainErr\tTuneErr"
-		print "0\t{0}\t{1}".format(training_error_rates[-1],tuning_error_rates[-1])
+		if verbosity >= 1:
+			print "Iter\tTrainErr\tTuneErr"
+			print "0\t{0}\t{1}".format(training_error_rates[-1],tuning_error_rates[-1])
 		
 		iteration_count = 0
 		
 		#while tuning_error_rates[-1] < tuning_error_rates[-2]:
 		while iteration_count < 100:
-			self.training_iteration(training_examples,current_learning_rate)
-			current_learning_rate = current_learning_rate * (1.0-learning_rate_decay_rate)
+			epoch_start = instrumentation.clock()
+			self.training_iteration(training_examples,current_learning_rate,verbosity)
+			evaluation_start = instrumentation.clock()
 			tuning_error_rates.append(self.compute_average_error(tuning_examples))
 			training_error_rates.append(self.compute_average_error(training_examples))
 			iteration_count += 1
-			print "{0}\t{1}\t{2}\t{3}".format(iteration_count,training_error_rates[-1],tuning_error_rates[-1],self.compute_average_prediction(training_examples))
+			if instrumentation.recorder != None:
+				record_epoch("train",iteration_count,current_learning_rate,evaluation_start-epoch_start,instrumentation.clock()-evaluation_start,training_error_rates[-1],tuning_error_rates[-1])
+			current_learning_rate = current_learning_rate * (1.0-learning_rate_decay_rate)
+			if verbosity >= 1:
+				print "{0}\t{1}\t{2}\t{3}".format(iteration_count,training_error_rates[-1],tuning_error_rates[-1],self.compute_average_prediction(training_examples))
 		
 		selected_iteration = tuning_error_rates.index(min(tuning_error_rates))
 		selected_iteration = 100
+		if verbosity < 1:
+			return
 		print "Selected iteration: {0}".format(selected_iteration)
 		
 		final_features = [(x,self.feature_weights[x]) for x in self.feature_weights.keys()]
@@ -50,7 +64,118 @@ class LogReg_Model:
 		for i in range(3):
 			print "{0}: {1}".format(final_features[i][0],",".join(map(str,final_features[i][1])))
 		
-	def training_iteration(self,training_examples,iteration_learning_rate):
+	# full-batch or mini-batch gradient descent on the same loss train uses
+	# (squared error between the sigmoid output and the example's target), run
+	# column by column over a precomputed feature matrix; each step averages
+	# the gradient over its batch, and batch_size=None uses every example
+	# l1_penalty and l2_penalty apply to feature weights, not the intercept;
+	# the L1 step soft-thresholds, so unhelpful features end at exactly zero
+	# training stops once the tuning error has not improved for patience
+	# iterations, and only the best iteration's weights are kept
+	def train_batch(self,training_examples,tuning_examples,learning_rate=0.1,learning_rate_decay_rate=0.01,batch_size=None,l1_penalty=0.0,l2_penalty=0.0,max_iterations=100,patience=5,random_seed=7355608,verbosity=0):
+		
+		training_examples = self.feature_matrix(training_examples)
+		tuning_examples = self.feature_matrix(tuning_examples)
+		num_examples = len(training_examples)
+		if batch_size == None:
+			batch_size = num_examples
+		
+		intercept = self.intercept_weight[-1]
+		weights = [self.feature_weights[x.feature_name][-1] for x in self.features]
+		targets = [row_target(training_examples,i) for i in range(num_examples)]
+		tuning_targets = [row_target(tuning_examples,i) for i in range(len(tuning_examples))]
+		
+		self.training_error_rates = [average_error(training_examples.columns,targets,intercept,weights)]
+		self.tuning_error_rates = [average_error(tuning_examples.columns,tuning_targets,intercept,weights)]
+		best_iteration = 0
+		best_weights = (intercept,list(weights))
+		
+		if verbosity >= 1:
+			print "Iter\tTrainErr\tTuneErr"
+			print "0\t{0}\t{1}".format(self.training_error_rates[-1],self.tuning_error_rates[-1])
+		
+		batch_random = random.Random(random_seed)
+		current_learning_rate = learning_rate
+		for iteration_count in range(1,max_iterations+1):
+			
+			epoch_start = instrumentation.clock()
+			example_indexes = range(num_examples)
+			if batch_size < num_examples:
+				batch_random.shuffle(example_indexes)
+			for batch_start in range(0,num_examples,batch_size):
+				batch = example_indexes[batch_start:batch_start+batch_size]
+				(intercept,weights) = gradient_step(training_examples.columns,targets,batch,intercept,weights,current_learning_rate,l1_penalty,l2_penalty)
+			
+			evaluation_start = instrumentation.clock()
+			self.training_error_rates.append(average_error(training_examples.columns,targets,intercept,weights))
+			self.tuning_error_rates.append(average_error(tuning_examples.columns,tuning_targets,intercept,weights))
+			if instrumentation.recorder != None:
+				record_epoch("train_batch",iteration_count,current_learning_rate,evaluation_start-epoch_start,instrumentation.clock()-evaluation_start,self.training_error_rates[-1],self.tuning_error_rates[-1])
+			current_learning_rate = current_learning_rate * (1.0-learning_rate_decay_rate)
+			if verbosity >= 1:
+				print "{0}\t{1}\t{2}".format(iteration_count,self.training_error_rates[-1],self.tuning_error_rates[-1])
+			
+			if self.tuning_error_rates[-1] < self.tuning_error_rates[best_iteration]:
+				best_iteration = iteration_count
+				best_weights = (intercept,list(weights))
+			elif iteration_count - best_iteration >= patience:
+				break
+		
+		if verbosity >= 1:
+			print "Selected iteration: {0}".format(best_iteration)
+		
+		self.intercept_weight = [best_weights[0]]
+		for i in range(len(self.features)):
+			self.feature_weights[self.features[i].feature_name] = [best_weights[1][i]]
+		self.chosen_iteration = None
+	
+	# one pass of gradient steps over a sequence of Feature_Matrix chunks (for
+	# example from stream_feature_matrices or read_feature_matrices), taking
+	# each chunk in mini-batches of batch_size rows (the whole chunk if None)
+	# and keeping only the current chunk in memory; call it again, with a
+	# fresh sequence and a lower learning_rate, for further passes
+	def train_stream(self,feature_matrices,learning_rate=0.1,batch_size=None,l1_penalty=0.0,l2_penalty=0.0,random_seed=7355608):
+		intercept = self.intercept_weight[-1]
+		weights = [self.feature_weights[x.feature_name][-1] for x in self.features]
+		batch_random = random.Random(random_seed)
+		for training_examples in feature_matrices:
+			num_examples = len(training_examples)
+			if num_examples == 0:
+				continue
+			targets = [row_target(training_examples,i) for i in range(num_examples)]
+			example_indexes = range(num_examples)
+			chunk_batch_size = num_examples
+			if batch_size != None and batch_size < num_examples:
+				chunk_batch_size = batch_size
+				batch_random.shuffle(example_indexes)
+			for batch_start in range(0,num_examples,chunk_batch_size):
+				batch = example_indexes[batch_start:batch_start+chunk_batch_size]
+				(intercept,weights) = gradient_step(training_examples.columns,targets,batch,intercept,weights,learning_rate,l1_penalty,l2_penalty)
+		self.intercept_weight = [intercept]
+		for i in range(len(self.features)):
+			self.feature_weights[self.features[i].feature_name] = [weights[i]]
+		self.chosen_iteration = None
+	
+	# predictions for every example, computed a feature column at a time
+	def predict(self,examples):
+		examples = self.feature_matrix(examples)
+		if self.chosen_iteration == None:
+			i = -1
+		else:
+			i = self.chosen_iteration
+		weights = [self.feature_weights[x.feature_name][i] for x in self.features]
+		return map(sigmoid,linear_outputs(examples.columns,self.intercept_weight[i],weights))
+	
+	# examples may be given as a list of labeled instances or as a
+	# Feature_Matrix built over self.features
+	def feature_matrix(self,examples):
+		if isinstance(examples,Feature_Matrix):
+			return examples
+		return build_feature_matrix(examples,self.features)
+	
+	def training_iteration(self,training_examples,iteration_learning_rate,verbosity=1):
+		
+		training_examples = self.feature_matrix(training_examples)
 		
 		example_indexes = range(len(training_examples))
 		random.shuffle(example_indexes)
@@ -63,53 +188,125 @@ class LogReg_Model:
 		
 		for example_index in example_indexes:
 		
-			if i % 1000 == 0:
+			if verbosity >= 1 and i % 1000 == 0:
 				print "Example {0}/{1}...".format(i+1,len(training_examples))
 			
-			example = training_examples[example_index]
+			row = training_examples.row(example_index)
 			
-			prediction = self.query(example)
-			error = target(example) - prediction
+			prediction = self.query_row(row)
+			error = row_target(training_examples,example_index) - prediction
 			
 			# update weights based on example error
 			self.intercept_weight[-1] = self.intercept_weight[-1] + (iteration_learning_rate * error * prediction * (1.0-prediction))
 			for feature_index in range(len(self.feature_weights)):
 				feature_name = self.features[feature_index].feature_name
-				self.feature_weights[feature_name][-1] = self.feature_weights[feature_name][-1] + (iteration_learning_rate * error * prediction * (1.0-prediction) * self.features[feature_index].query(example))
+				self.feature_weights[feature_name][-1] = self.feature_weights[feature_name][-1] + (iteration_learning_rate * error * prediction * (1.0-prediction) * row[feature_index])
 			
 			i += 1
 	
 	def compute_average_prediction(self,examples):
+		examples = self.feature_matrix(examples)
 		sum_prediction = 0.0
-		for example in examples:
-			sum_prediction += self.query(example)
+		for example_index in range(len(examples)):
+			sum_prediction += self.query_row(examples.row(example_index))
 		return sum_prediction/len(examples)
 	
 	def compute_average_error(self,tuning_examples):
+		tuning_examples = self.feature_matrix(tuning_examples)
 		sum_tuning_error = 0.0
-		for example in tuning_examples:
-			prediction = self.query(example)
-			error = abs(target(example) - prediction)
+		for example_index in range(len(tuning_examples)):
+			prediction = self.query_row(tuning_examples.row(example_index))
+			error = abs(row_target(tuning_examples,example_index) - prediction)
 			sum_tuning_error += error
 		return sum_tuning_error/len(tuning_examples)
 	
 	def query(self,query_instance):
+		return self.query_row([feature.query(query_instance) for feature in self.features])
+	
+	# row holds the values of self.features, in order
+	def query_row(self,row):
 		if self.chosen_iteration == None:
 			i = -1
 		else:
 			i = self.chosen_iteration
 		output = self.intercept_weight[i]
-		for feature in self.features:
-			x = feature.query(query_instance)
-			w = self.feature_weights[feature.feature_name][i]
+		for feature_index in range(len(self.features)):
+			x = row[feature_index]
+			w = self.feature_weights[self.features[feature_index].feature_name][i]
 			
 			output += x*w
-		prediction = 1.0 / (1.0 + math.exp(-output))
-		return prediction
+		return sigmoid(output)
 	
+# one "logreg_epoch" record per training iteration, with the time spent
+# updating weights and the time spent computing the error rates afterwards
+def record_epoch(method,iteration,learning_rate,seconds,evaluation_seconds,training_error,tuning_error):
+	recorder = instrumentation.recorder
+	recorder.add_time("logreg/epoch",seconds)
+	recorder.add_time("logreg/evaluation",evaluation_seconds)
+	recorder.add_record("logreg_epoch",method=method,iteration=iteration,learning_rate=learning_rate,seconds=seconds,evaluation_seconds=evaluation_seconds,training_error=training_error,tuning_error=tuning_error)
+
 def target(example):
 	if example.label == "+":
 		target = 0.5 + (example.weight*0.5)
 	elif example.label == "-":
 		target = 0.5 - (example.weight*0.5)
-	return target
\ No newline at end of file
+	return target
+
+def row_target(feature_matrix,row_index):
+	weight = feature_matrix.weights[row_index]
+	if feature_matrix.is_positive(row_index):
+		return 0.5 + (weight*0.5)
+	return 0.5 - (weight*0.5)
+
+# outputs beyond +-700 would overflow math.exp; the sigmoid is already 0.0
+# or 1.0 to double precision well before then
+def sigmoid(output):
+	if output < -700.0:
+		return 0.0
+	if output > 700.0:
+		return 1.0
+	return 1.0 / (1.0 + math.exp(-output))
+
+# intercept plus weighted feature values for each row of columns, adding the
+# features in order as query_row does
+def linear_outputs(columns,intercept,weights):
+	outputs = [intercept]*len(columns[0])
+	for (column,weight) in zip(columns,weights):
+		outputs = map(operator.add,outputs,[x*weight for x in column])
+	return outputs
+
+def average_error(columns,targets,intercept,weights):
+	predictions = map(sigmoid,linear_outputs(columns,intercept,weights))
+	return sum(map(abs,map(operator.sub,targets,predictions)))/len(targets)
+
+# one gradient step over the examples in batch, returning the new
+# (intercept,weights); the batch's columns are gathered with itemgetter so
+# the per-example work stays inside map and sum
+def gradient_step(columns,targets,batch,intercept,weights,learning_rate,l1_penalty,l2_penalty):
+	if len(batch) == len(targets):
+		(batch_columns,batch_targets) = (columns,targets) # full batch, order is irrelevant
+	else:
+		if len(batch) == 1:
+			gather = lambda x: [x[batch[0]]]
+		else:
+			gather = operator.itemgetter(*batch)
+		batch_columns = [gather(x) for x in columns]
+		batch_targets = gather(targets)
+	predictions = map(sigmoid,linear_outputs(batch_columns,intercept,weights))
+	coefficients = [(t-p)*p*(1.0-p) for (t,p) in zip(batch_targets,predictions)]
+	
+	step = learning_rate/len(batch)
+	new_intercept = intercept + step*sum(coefficients)
+	new_weights = []
+	for (column,weight) in zip(batch_columns,weights):
+		new_weight = weight + step*sum(map(operator.mul,coefficients,column)) - learning_rate*l2_penalty*weight
+		if l1_penalty > 0.0:
+			shrinkage = learning_rate*l1_penalty
+			if new_weight > shrinkage:
+				new_weight -= shrinkage
+			elif new_weight < -shrinkage:
+				new_weight += shrinkage
+			else:
+				new_weight = 0.0
+		new_weights.append(new_weight)
+	return (new_intercept,new_weights)
@@ -0,0 +1,307 @@
+import array
+import cPickle
+import json
+import struct
+from temporal_ml import *
+from tree_learning import *
+from logreg_learning import *
+
+# compact files for trained models, holding only what inference needs: a
+# Tree_Node's nodes as flat arrays (split feature, split value, missing value
+# direction and whether +Inf counts as missing, children, leaf weights), a
+# Compiled_Tree's arrays, or a LogReg_Model's chosen weights without its
+# training history; features are stored once, in a table of specs from which
+# load_model rebuilds them
+# model file layout: the header, then each section in MODEL_FILE_SECTIONS
+# order, each starting on an 8-byte boundary; the header holds the magic,
+# version and model kind, then an (offset,length) pair in bytes for every
+# section; arrays are in the platform's byte order, and feature_specs is JSON
+# holding the time unit and the feature specs, which refer to the feature
+# tables (see feature_tables) for anything bulky
+MODEL_FILE_MAGIC = "TMLMODEL"
+MODEL_FILE_VERSION = 3
+FEATURE_TABLE_SECTIONS = ["arbitrary_ids","arbitrary_id_offsets","arbitrary_id_indexes","arbitrary_moments","arbitrary_values","pickled_features"]
+MODEL_FILE_SECTIONS = ["feature_specs","split_features","split_values","missing_left","inf_missing","left_children","right_children","pos_weights","neg_weights","leaf_values","weights"] + FEATURE_TABLE_SECTIONS
+MODEL_FILE_HEADER = "=8s2q" + "2q"*len(MODEL_FILE_SECTIONS)
+TREE_MODEL = 0
+COMPILED_TREE_MODEL = 1
+LOGREG_MODEL = 2
+
+# nodes are numbered depth-first from the root at 0, as in Compiled_Tree;
+# split_features holds each node's position in the feature table (-1 at
+# leaves); a LogReg_Model's weights are its intercept then one per feature
+def save_model(model,path):
+	sections = dict()
+	if isinstance(model,Tree_Node):
+		model_kind = TREE_MODEL
+		features = []
+		feature_positions = dict()
+		nodes = []
+		worklist = [model]
+		while worklist:
+			node = worklist.pop()
+			nodes.append(node)
+			if not node.leaf:
+				worklist.append(node.right_child)
+				worklist.append(node.left_child)
+		node_indexes = dict((id(nodes[i]),i) for i in range(len(nodes)))
+		split_features = array.array("i")
+		split_values = array.array("d")
+		missing_left = array.array("b")
+		inf_missing = array.array("b")
+		left_children = array.array("i")
+		right_children = array.array("i")
+		pos_weights = array.array("d")
+		neg_weights = array.array("d")
+		for node in nodes:
+			if node.leaf:
+				split_features.append(-1)
+				split_values.append(0.0)
+				missing_left.append(0)
+				inf_missing.append(0)
+				left_children.append(-1)
+				right_children.append(-1)
+				pos_weights.append(node.pos_weight)
+				neg_weights.append(node.neg_weight)
+			else:
+				if id(node.split_feature) not in feature_positions:
+					feature_positions[id(node.split_feature)] = len(features)
+					features.append(node.split_feature)
+				split_features.append(feature_positions[id(node.split_feature)])
+				split_values.append(node.split_value)
+				missing_left.append(int(node.missing_left))
+				inf_missing.append(int(node.inf_missing))
+				left_children.append(node_indexes[id(node.left_child)])
+				right_children.append(node_indexes[id(node.right_child)])
+				pos_weights.append(0.0)
+				neg_weights.append(0.0)
+		sections.update({"split_features":split_features,"split_values":split_values,"missing_left":missing_left,"inf_missing":inf_missing,"left_children":left_children,"right_children":right_children,"pos_weights":pos_weights,"neg_weights":neg_weights})
+	elif isinstance(model,Compiled_Tree):
+		model_kind = COMPILED_TREE_MODEL
+		features = model.features
+		sections.update({"split_features":model.split_features,"split_values":model.thresholds,"missing_left":model.missing_left,"inf_missing":model.inf_missing,"left_children":model.left_children,"right_children":model.right_children,"leaf_values":model.leaf_values})
+	elif isinstance(model,LogReg_Model):
+		model_kind = LOGREG_MODEL
+		features = model.features
+		if model.chosen_iteration == None:
+			i = -1
+		else:
+			i = model.chosen_iteration
+		sections["weights"] = array.array("d",[model.intercept_weight[i]] + [model.feature_weights[x.feature_name][i] for x in features])
+	else:
+		raise ValueError("cannot save a {0}".format(model.__class__.__name__))
+	tables = feature_tables()
+	sections["feature_specs"] = json.dumps({"time_unit":time_unit.name,"features":[feature_spec(x,tables) for x in features]})
+	sections.update(tables)
+
+	section_table = []
+	offset = padded_length(struct.calcsize(MODEL_FILE_HEADER))
+	for name in MODEL_FILE_SECTIONS:
+		length = len(buffer(sections.get(name,"")))
+		section_table += [offset,length]
+		offset = padded_length(offset+length)
+	with open(path,"wb") as model_file:
+		model_file.write(struct.pack(MODEL_FILE_HEADER,MODEL_FILE_MAGIC,MODEL_FILE_VERSION,model_kind,*section_table))
+		for i in range(len(MODEL_FILE_SECTIONS)):
+			model_file.write("\0"*(section_table[2*i]-model_file.tell()))
+			model_file.write(buffer(sections.get(MODEL_FILE_SECTIONS[i],"")))
+
+# the model as saved (a Tree_Node, Compiled_Tree or LogReg_Model); feature
+# values that depend on the time unit (durations, record start times) assume
+# the one the model was saved under, so that must be the current one
+def load_model(path):
+	with open(path,"rb") as model_file:
+		data = model_file.read()
+	if len(data) < struct.calcsize(MODEL_FILE_HEADER) or data[:8] != MODEL_FILE_MAGIC:
+		raise ValueError("{0} is not a version {1} model file".format(path,MODEL_FILE_VERSION))
+	header = struct.unpack_from(MODEL_FILE_HEADER,data,0)
+	(magic,version,model_kind) = header[:3]
+	if version != MODEL_FILE_VERSION:
+		raise ValueError("{0} is not a version {1} model file".format(path,MODEL_FILE_VERSION))
+	sections = dict()
+	for i in range(len(MODEL_FILE_SECTIONS)):
+		(offset,length) = header[3+2*i:5+2*i]
+		sections[MODEL_FILE_SECTIONS[i]] = data[offset:offset+length]
+	specs = json.loads(sections["feature_specs"])
+	if specs["time_unit"] != time_unit.name:
+		raise ValueError("{0} was saved with time unit {1}, not {2}".format(path,specs["time_unit"],time_unit.name))
+	tables = feature_tables(sections)
+	features = [spec_feature(x,tables) for x in specs["features"]]
+
+	if model_kind == LOGREG_MODEL:
+		weights = array.array("d",sections["weights"])
+		model = LogReg_Model(features)
+		model.intercept_weight = [weights[0]]
+		for i in range(len(features)):
+			model.feature_weights[features[i].feature_name] = [weights[i+1]]
+		return model
+
+	split_features = array.array("i",sections["split_features"])
+	split_values = array.array("d",sections["split_values"])
+	missing_left = array.array("b",sections["missing_left"])
+	inf_missing = array.array("b",sections["inf_missing"])
+	left_children = array.array("i",sections["left_children"])
+	right_children = array.array("i",sections["right_children"])
+	if model_kind == COMPILED_TREE_MODEL:
+		model = Compiled_Tree(None)
+		model.features = features
+		model.split_features = split_features
+		model.thresholds = split_values
+		model.missing_left = missing_left
+		model.inf_missing = inf_missing
+		model.left_children = left_children
+		model.right_children = right_children
+		model.leaf_values = array.array("d",sections["leaf_values"])
+		return model
+
+	pos_weights = array.array("d",sections["pos_weights"])
+	neg_weights = array.array("d",sections["neg_weights"])
+	root_node = Tree_Node()
+	worklist = [(root_node,0)]
+	while worklist:
+		(node,index) = worklist.pop()
+		if split_features[index] < 0:
+			node.process_leaf(pos_weights[index],neg_weights[index])
+		else:
+			(left_child,right_child) = node.process_nonleaf(features[split_features[index]],split_values[index],bool(missing_left[index]),bool(inf_missing[index]))
+			worklist.append((left_child,left_children[index]))
+			worklist.append((right_child,right_children[index]))
+	return root_node
+
+# the binary tables that feature specs refer to, empty or read from a model
+# file's sections; a Feature_Arbitrary's distinct ids are stored once, as
+# bytes between offsets, and its (id,moment) pairs and values as parallel
+# arrays of id index, moment and value; features that have no spec are
+# pickled into pickled_features
+def feature_tables(sections=None):
+	tables = {
+		"arbitrary_ids":array.array("c"),
+		"arbitrary_id_offsets":array.array("i",[0]),
+		"arbitrary_id_indexes":array.array("i"),
+		"arbitrary_moments":array.array("d"),
+		"arbitrary_values":array.array("d"),
+		"pickled_features":array.array("c"),
+	}
+	if sections != None:
+		for name in FEATURE_TABLE_SECTIONS:
+			tables[name] = array.array(tables[name].typecode,sections[name])
+	return tables
+
+# a feature as [class name,constructor arguments...], with wrapped features as
+# nested specs; a Feature_Arbitrary's arguments are its id kind and its ranges
+# in the feature tables, and features of other classes (ones defined
+# elsewhere, or a Feature_Arbitrary whose ids or values don't fit the tables)
+# are pickled into the tables instead, as ["pickle",start,end]
+# Feature_Frequency keeps its record start as a number in the time unit
+def feature_spec(feature,tables):
+	feature_class = feature.__class__
+	if feature_class in (Feature_LastOccurrence,Feature_NextOccurrence,Feature_Count):
+		arguments = [feature.feature_name] + list(feature.event_names)
+	elif feature_class == Feature_2ndLastOccurrence:
+		arguments = [feature.feature_name] + list(feature.event_names)
+	elif feature_class == Feature_KthLastOccurrence:
+		arguments = [feature.feature_name,feature.k] + list(feature.event_names)
+	elif feature_class == Feature_Intensity:
+		arguments = [feature.feature_name,feature.decay_rate]
+		for (event_name,event_weight) in zip(feature.event_names,feature.event_weights):
+			arguments += [event_name,event_weight]
+	elif feature_class == Feature_Frequency:
+		arguments = [feature.feature_name,feature.record_start] + list(feature.event_names)
+	elif feature_class in (Feature_Recent_Frequency,Feature_TemporalWindow):
+		arguments = [feature.feature_name,feature.window_size] + list(feature.event_names)
+	elif feature_class == Feature_TwoSidedTemporalWindow:
+		arguments = [feature.feature_name,feature.window_min,feature.window_max] + list(feature.event_names)
+	elif feature_class == Feature_Static:
+		arguments = [feature.feature_name,feature.static_name]
+	elif feature_class == Feature_Moment:
+		arguments = [feature.feature_name]
+	elif feature_class == Feature_MonthDay:
+		arguments = [feature.feature_name,[[x[0],x[1],y] for (x,y) in sorted(feature.monthday_to_value.items())]]
+	elif feature_class in (FeatureWrapper_Normalize_MaxSignalZero,FeatureWrapper_Normalize_MaxSignalInf):
+		arguments = [feature_spec(feature.inner_feature,tables),feature.median]
+	elif feature_class == FeatureWrapper_Inverse:
+		arguments = [feature_spec(feature.inner_feature,tables),feature.feature_name]
+	elif feature_class == Feature_Arbitrary and fits_feature_tables(feature):
+		arguments = [feature.feature_name] + add_arbitrary_values(feature,tables)
+	else:
+		start = len(tables["pickled_features"])
+		tables["pickled_features"].fromstring(cPickle.dumps(feature,2))
+		return ["pickle",start,len(tables["pickled_features"])]
+	return [feature_class.__name__] + arguments
+
+def spec_feature(spec,tables):
+	if spec[0] == "pickle":
+		return cPickle.loads(tables["pickled_features"][spec[1]:spec[2]].tostring())
+	feature_class = globals()[spec[0]]
+	arguments = spec[1:]
+	if feature_class == Feature_Arbitrary:
+		arguments = [arguments[0]] + arbitrary_values(tables,*arguments[1:])
+	elif feature_class == Feature_MonthDay:
+		arguments = [arguments[0],dict(((x[0],x[1]),x[2]) for x in arguments[1])]
+	elif feature_class in (FeatureWrapper_Normalize_MaxSignalZero,FeatureWrapper_Normalize_MaxSignalInf,FeatureWrapper_Inverse):
+		arguments = [spec_feature(arguments[0],tables)] + arguments[1:]
+	return feature_class(*arguments)
+
+# "int", "str" or "unicode" if a Feature_Arbitrary's ids are all of that kind
+# (byte strings are allowed among unicode ids if they decode as UTF-8), or
+# None if they can't be stored in the feature tables; bools are ints but
+# would not read back as such, so they are pickled
+def arbitrary_id_kind(feature):
+	ids = set(x[0] for x in feature.value_mapping)
+	if any(isinstance(x,bool) for x in ids):
+		return None
+	if all(isinstance(x,(int,long)) for x in ids):
+		return "int"
+	elif all(isinstance(x,str) for x in ids):
+		return "str"
+	elif all(isinstance(x,basestring) for x in ids):
+		try:
+			for x in ids:
+				if isinstance(x,str):
+					x.decode("utf-8")
+		except UnicodeDecodeError:
+			return None
+		return "unicode"
+	return None
+
+# whether a Feature_Arbitrary's ids, moments and values can go in the tables
+def fits_feature_tables(feature):
+	numbers = (int,long,float)
+	return arbitrary_id_kind(feature) != None and all(isinstance(x[1],numbers) for x in feature.value_mapping) and all(isinstance(x,numbers) for x in feature.value_mapping.values())
+
+# appends a Feature_Arbitrary's mapping to the tables, returning its spec
+# arguments: [id kind,first id,end of ids,first pair,end of pairs]
+def add_arbitrary_values(feature,tables):
+	id_kind = arbitrary_id_kind(feature)
+	id_start = len(tables["arbitrary_id_offsets"])-1
+	pair_start = len(tables["arbitrary_values"])
+	id_indexes = dict()
+	for ((example_id,moment),value) in sorted(feature.value_mapping.items()):
+		if example_id not in id_indexes:
+			id_indexes[example_id] = len(id_indexes)
+			if id_kind == "unicode":
+				tables["arbitrary_ids"].fromstring(unicode(example_id).encode("utf-8"))
+			else:
+				tables["arbitrary_ids"].fromstring(str(example_id))
+			tables["arbitrary_id_offsets"].append(len(tables["arbitrary_ids"]))
+		tables["arbitrary_id_indexes"].append(id_indexes[example_id])
+		tables["arbitrary_moments"].append(moment)
+		tables["arbitrary_values"].append(value)
+	return [id_kind,id_start,id_start+len(id_indexes),pair_start,len(tables["arbitrary_values"])]
+
+# the id_moment_pairs and values to rebuild a Feature_Arbitrary with
+def arbitrary_values(tables,id_kind,id_start,id_end,pair_start,pair_end):
+	id_offsets = tables["arbitrary_id_offsets"]
+	ids = []
+	for i in range(id_start,id_end):
+		example_id = tables["arbitrary_ids"][id_offsets[i]:id_offsets[i+1]].tostring()
+		if id_kind == "int":
+			example_id = int(example_id)
+		elif id_kind == "unicode":
+			example_id = example_id.decode("utf-8")
+		ids.append(example_id)
+	id_moment_pairs = [(ids[tables["arbitrary_id_indexes"][i]],tables["arbitrary_moments"][i]) for i in range(pair_start,pair_end)]
+	return [id_moment_pairs,tables["arbitrary_values"][pair_start:pair_end].tolist()]
+
+def padded_length(length):
+	return (length+7)//8*8
@@ -0,0 +1,107 @@
+import itertools
+import math
+import random
+from temporal_ml import *
+from feature_matrix import *
+
+# moment-sampling policies: each one's moments(example) gives the (numeric)
+# times at which to sample an example, in ascending order; times may be given
+# as dates or datetimes and steps or offsets as timedeltas, and are converted
+# to the current time unit
+
+# every step from start up to but not including stop; start and stop default
+# to the first event start and last event end of each example
+class Grid_Sampler(object):
+
+	def __init__(self,step,start=None,stop=None):
+		self.step = numeric_duration(step)
+		self.start = optional_time(start)
+		self.stop = optional_time(stop)
+
+	def moments(self,example):
+		(start,stop) = sampling_range(example,self.start,self.stop)
+		if start == None:
+			return []
+		num_moments = max(int(math.ceil((stop-start)/self.step)),0)
+		return [start + i*self.step for i in range(num_moments)]
+
+# num_moments uniformly random times between start and stop (defaulting as
+# for Grid_Sampler); draws come from one generator in example order, so a
+# stream is reproducible for a given random_seed and example order
+class Random_Sampler(object):
+
+	def __init__(self,num_moments,start=None,stop=None,random_seed=None):
+		self.num_moments = num_moments
+		self.start = optional_time(start)
+		self.stop = optional_time(stop)
+		self.random = random.Random(random_seed)
+
+	def moments(self,example):
+		(start,stop) = sampling_range(example,self.start,self.stop)
+		if start == None:
+			return []
+		return sorted(self.random.uniform(start,stop) for i in range(self.num_moments))
+
+# the start of every occurrence of the given events, shifted by each offset
+# (e.g. offsets=(-7,-1) samples a week and a day before each occurrence);
+# moments shared by several occurrences are sampled once
+class Event_Sampler(object):
+
+	def __init__(self,event_names,offsets=(0.0,)):
+		self.event_names = list(event_names)
+		self.offsets = [numeric_duration(x) for x in offsets]
+
+	def moments(self,example):
+		moments = set()
+		for timeline in example.event_timelines(self.event_names):
+			timeline.finalize()
+			for start_time in timeline.starts:
+				moments.update(start_time+x for x in self.offsets)
+		return sorted(moments)
+
+def optional_time(time):
+	if time == None:
+		return None
+	return numeric_time(time)
+
+# (start,stop) with missing ends taken from the example's events; (None,None)
+# if one is missing and the example has no events
+def sampling_range(example,start,stop):
+	if start == None or stop == None:
+		timelines = [x for x in example.events.values() if len(x) > 0]
+		if len(timelines) == 0:
+			return (None,None)
+		for timeline in timelines:
+			timeline.finalize()
+		if start == None:
+			start = min(x.starts[0] for x in timelines)
+		if stop == None:
+			stop = max(x.sorted_ends[-1] for x in timelines)
+	return (start,stop)
+
+# Example_Moments for every example at the moments sampler picks, labeled
+# with classlabel_feature if given; examples may be any iterable (such as
+# Event_Store.examples()), and nothing is kept once it has been yielded
+def stream_moments(examples,sampler,classlabel_feature=None):
+	for example in examples:
+		for moment in sampler.moments(example):
+			example_moment = example.create_example_moment(moment)
+			if classlabel_feature != None:
+				example_moment.compute_label_and_weight(classlabel_feature)
+			yield example_moment
+
+# lists of up to chunk_size consecutive items
+def stream_chunks(items,chunk_size):
+	items = iter(items)
+	while True:
+		chunk = list(itertools.islice(items,chunk_size))
+		if len(chunk) == 0:
+			return
+		yield chunk
+
+# Feature_Matrix chunks of up to chunk_size sampled moments, so only one chunk
+# of moments and feature values is in memory at a time; chunks can be written
+# out with write_feature_matrices or passed to LogReg_Model.train_stream
+def stream_feature_matrices(examples,sampler,features,classlabel_feature=None,chunk_size=10000):
+	for chunk in stream_chunks(stream_moments(examples,sampler,classlabel_feature),chunk_size):
+		yield build_feature_matrix(chunk,features)
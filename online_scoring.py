@@ -0,0 +1,165 @@
+from temporal_ml import *
+from tree_learning import *
+from logreg_learning import *
+
+# scores entities against a trained model as their events arrive: each entity
+# keeps one streaming accumulator (see Feature.observe) per feature the model
+# actually uses, updated as its events come in, so scoring reads a handful of
+# accumulators instead of building an Example and querying every feature
+# models: Tree_Node, Compiled_Tree, Random_Forest or LogReg_Model; trees use
+# their split features, LogReg_Models their features with nonzero weight (as
+# of construction, so build a new scorer after retraining)
+# an entity's events must arrive in start order and it can only be scored at
+# or after the latest time it has seen (event start or scoring time), so
+# nothing observed lies in its future
+# wrappers are evaluated on their inner feature's value, features that need no
+# events (static values, the moment) are queried on an event-less Example, and
+# any event-based feature without create_accumulator is queried on an Example
+# holding all of the entity's events, at the cost of a full query; keep the
+# query cache disabled while scoring, since entities' events keep changing
+# features are evaluated lazily, so a tree only computes the features on the
+# path it takes; score() does no I/O and never blocks, so it can be called
+# directly from an event loop's callbacks
+class Online_Scorer(object):
+
+	def __init__(self,model):
+		(self.features,self.predict) = model_predictor(model)
+		self.streamed_features = []
+		self.needs_events = False
+		self.event_features = dict() # event name -> streamed features observing it
+		for feature in self.features:
+			while hasattr(feature,"inner_feature") and hasattr(feature,"transform"):
+				feature = feature.inner_feature
+			if hasattr(feature,"create_accumulator"):
+				if id(feature) not in [id(x) for x in self.streamed_features]:
+					self.streamed_features.append(feature)
+					for event_name in set(feature.event_names):
+						self.event_features.setdefault(event_name,[]).append(feature)
+			elif hasattr(feature,"event_names"):
+				self.needs_events = True
+		self.entities = dict()
+
+	def entity(self,entity_id):
+		if entity_id not in self.entities:
+			self.entities[entity_id] = Online_Entity(entity_id,self.streamed_features)
+		return self.entities[entity_id]
+
+	def add_event(self,entity_id,event_name,event_start_time,event_end_time=None):
+		entity = self.entity(entity_id)
+		entity.advance(numeric_time(event_start_time))
+		for feature in self.event_features.get(event_name,()):
+			feature.observe(entity.accumulators[id(feature)],event_name,event_start_time,event_end_time)
+		if self.needs_events:
+			entity.example.add_event(event_name,event_start_time,event_end_time)
+
+	def add_static_value(self,entity_id,static_name,value):
+		self.entity(entity_id).example.static_values[static_name] = value
+
+	def remove_entity(self,entity_id):
+		self.entities.pop(entity_id,None)
+
+	# the values of self.features for the entity at moment, each computed when
+	# first indexed
+	def feature_values(self,entity_id,moment):
+		entity = self.entity(entity_id)
+		example_moment = entity.example.create_example_moment(moment)
+		entity.advance(example_moment.time)
+		return Moment_Values(entity,self.features,example_moment)
+
+	def score(self,entity_id,moment):
+		return self.predict(self.feature_values(entity_id,moment))
+
+# one entity's streaming state: an accumulator per streamed feature, and an
+# Example for its static values (and its events, when some feature needs them)
+class Online_Entity(object):
+
+	def __init__(self,entity_id,streamed_features):
+		self.example = Example(entity_id)
+		self.accumulators = dict()
+		for feature in streamed_features:
+			self.accumulators[id(feature)] = feature.create_accumulator()
+		self.latest_time = None
+
+	def advance(self,time):
+		if self.latest_time != None and time < self.latest_time:
+			raise ValueError("entity {0} has already seen time {1}; times must not go backwards ({2})".format(self.example.id,self.latest_time,time))
+		self.latest_time = time
+
+	# values holds the values computed so far at this moment, so that wrappers
+	# sharing an inner feature evaluate it once
+	def feature_value(self,feature,example_moment,values):
+		key = id(feature)
+		if key not in values:
+			if key in self.accumulators:
+				values[key] = self.accumulators[key].value(example_moment.time)
+			elif hasattr(feature,"inner_feature") and hasattr(feature,"transform"):
+				values[key] = feature.transform(self.feature_value(feature.inner_feature,example_moment,values))
+			else:
+				values[key] = feature.query(example_moment)
+		return values[key]
+
+# an entity's feature values at one moment, as a sequence evaluated on demand
+class Moment_Values(object):
+
+	def __init__(self,entity,features,example_moment):
+		self.entity = entity
+		self.features = features
+		self.example_moment = example_moment
+		self.values = dict()
+
+	def __len__(self):
+		return len(self.features)
+
+	def __getitem__(self,index):
+		return self.entity.feature_value(self.features[index],self.example_moment,self.values)
+
+	def __iter__(self):
+		for i in range(len(self.features)):
+			yield self[i]
+
+# (features the model uses,function giving the model's prediction from their
+# values, in order)
+def model_predictor(model):
+	if isinstance(model,Tree_Node):
+		model = model.compile()
+	if isinstance(model,Compiled_Tree):
+		return (list(model.features),model.query_values)
+	if hasattr(model,"compiled_trees"):
+		features = []
+		feature_positions = dict()
+		tree_positions = []
+		for compiled_tree in model.compiled_trees:
+			for feature in compiled_tree.features:
+				if id(feature) not in feature_positions:
+					feature_positions[id(feature)] = len(features)
+					features.append(feature)
+			tree_positions.append([feature_positions[id(x)] for x in compiled_tree.features])
+		def predict_forest(values):
+			return mean([x.query_values(Positioned_Values(values,y)) for (x,y) in zip(model.compiled_trees,tree_positions)])
+		return (features,predict_forest)
+	if isinstance(model,LogReg_Model):
+		if model.chosen_iteration == None:
+			i = -1
+		else:
+			i = model.chosen_iteration
+		features = [x for x in model.features if model.feature_weights[x.feature_name][i] != 0.0]
+		weights = [model.feature_weights[x.feature_name][i] for x in features]
+		intercept = model.intercept_weight[i]
+		def predict_logreg(values):
+			output = intercept
+			for (x,w) in zip(values,weights):
+				output += x*w
+			return sigmoid(output)
+		return (features,predict_logreg)
+	raise ValueError("cannot score a {0} online".format(model.__class__.__name__))
+
+# values[positions[i]] as item i, so each tree of a forest reads the shared
+# values (computed on demand) through its own feature order
+class Positioned_Values(object):
+
+	def __init__(self,values,positions):
+		self.values = values
+		self.positions = positions
+
+	def __getitem__(self,index):
+		return self.values[self.positions[index]]
@@ -1,6 +1,353 @@
 
+import array
+import bisect
+import collections
 import datetime
+import heapq
+import itertools
+import math
 import sys
+import instrumentation
+
+# how date and datetime values become the plain numbers that timelines,
+# moments and features work with: a count of units since the unit's origin
+# (given as a day ordinal); times that are already numbers are taken to be in
+# the current unit
+# timezone-aware datetimes are converted to UTC, naive ones are taken as UTC
+class Time_Unit(object):
+
+	def __init__(self,name,seconds_per_unit,origin_ordinal):
+		self.name = name
+		self.seconds_per_unit = float(seconds_per_unit)
+		self.origin_ordinal = origin_ordinal
+		self.units_per_day = 86400.0/self.seconds_per_unit
+
+	def __repr__(self):
+		return "Time_Unit({0})".format(self.name)
+
+	def to_number(self,time):
+		if isinstance(time,datetime.datetime):
+			if time.utcoffset() != None:
+				time = time.replace(tzinfo=None) - time.utcoffset()
+			seconds_into_day = time.hour*3600 + time.minute*60 + time.second + time.microsecond/1000000.0
+			return (time.toordinal()-self.origin_ordinal)*self.units_per_day + seconds_into_day/self.seconds_per_unit
+		if isinstance(time,datetime.date):
+			return (time.toordinal()-self.origin_ordinal)*self.units_per_day
+		return float(time)
+
+	# back to a (naive, UTC) datetime, for display; exact to within the
+	# precision of the float (microseconds for SECONDS, a few of them for DAYS)
+	def to_datetime(self,number):
+		days = number/self.units_per_day
+		whole_days = int(math.floor(days))
+		microseconds = round((days-whole_days)*86400000000.0)
+		return datetime.datetime.fromordinal(self.origin_ordinal+whole_days) + datetime.timedelta(microseconds=microseconds)
+
+# DAYS counts from day ordinal 0, so dates become their ordinals and
+# differences between them come out in days, as timedelta.days did before;
+# SECONDS counts from the Unix epoch
+DAYS = Time_Unit("days",86400,0)
+SECONDS = Time_Unit("seconds",1,datetime.date(1970,1,1).toordinal())
+
+# the unit dates and datetimes are converted with; change it (with
+# set_time_unit) before creating any examples or features, since values are
+# converted once, as they arrive
+time_unit = DAYS
+
+def set_time_unit(unit):
+	global time_unit
+	time_unit = unit
+
+def numeric_time(time):
+	if isinstance(time,datetime.date):
+		return time_unit.to_number(time)
+	return float(time)
+
+# durations given as timedeltas become a number of the current unit
+def numeric_duration(duration):
+	if isinstance(duration,datetime.timedelta):
+		return duration.total_seconds()/time_unit.seconds_per_unit
+	return float(duration)
+
+def display_time(number):
+	return time_unit.to_datetime(number)
+
+# sorted, array-backed record of every occurrence of one event for one example
+# occurrences are kept in arrival order until the first query (or an explicit
+# finalize), at which point the arrays are sorted once if anything arrived out
+# of order
+# a timeline can also be built over existing, already sorted sequences (such
+# as views into an Event_Store); those timelines are read-only
+class Event_Timeline(object):
+
+	def __init__(self,starts=None,ends=None,sorted_ends=None):
+		if starts != None:
+			self.starts = starts
+			self.ends = ends
+			self.sorted_ends = sorted_ends
+		else:
+			self.starts = array.array("d") # sorted
+			self.ends = array.array("d") # aligned with starts
+			self.sorted_ends = array.array("d") # sorted independently of starts
+		self.is_sorted = True
+	
+	def __len__(self):
+		return len(self.starts)
+	
+	def __iter__(self):
+		self.finalize()
+		return iter(zip(self.starts,self.ends))
+	
+	def add_occurrence(self,start_time,end_time):
+		if len(self.starts) > 0 and (start_time < self.starts[-1] or end_time < self.sorted_ends[-1]):
+			self.is_sorted = False
+		self.starts.append(start_time)
+		self.ends.append(end_time)
+		self.sorted_ends.append(end_time)
+	
+	def finalize(self):
+		if self.is_sorted:
+			return
+		occurrences = sorted(zip(self.starts,self.ends))
+		self.starts = array.array("d",[x[0] for x in occurrences])
+		self.ends = array.array("d",[x[1] for x in occurrences])
+		self.sorted_ends = array.array("d",sorted(self.ends))
+		self.is_sorted = True
+	
+	# occurrences that have started by time (past or present)
+	def count_started(self,time):
+		self.finalize()
+		return bisect.bisect_right(self.starts,time)
+	
+	# occurrences that ended strictly before time (past)
+	def count_ended(self,time):
+		self.finalize()
+		return bisect.bisect_left(self.sorted_ends,time)
+	
+	# occurrences that ended at or before time
+	def count_ended_by(self,time):
+		self.finalize()
+		return bisect.bisect_right(self.sorted_ends,time)
+	
+	def time_since_last(self,time):
+		num_ended = self.count_ended(time)
+		if self.count_started(time) > num_ended:
+			return 0.0 # an occurrence is present
+		if num_ended == 0:
+			return float("Inf")
+		return time - self.sorted_ends[num_ended-1]
+	
+	def time_until_next(self,time):
+		num_started = self.count_started(time)
+		if num_started > self.count_ended(time):
+			return 0.0 # an occurrence is present
+		if num_started == len(self.starts):
+			return float("Inf")
+		return self.starts[num_started] - time
+	
+	# time since the k-th most recent occurrence (k=1 being the last), read
+	# straight off the sorted ends; present occurrences count as zero, and
+	# there are Inf time units since occurrences that do not exist
+	def time_since_kth_last(self,time,k):
+		num_ended = self.count_ended(time)
+		return self.kth_last_value(time,k,self.count_started(time)-num_ended,num_ended)
+	
+	def kth_last_value(self,time,k,num_present,num_ended):
+		if k <= num_present:
+			return 0.0
+		if k > num_present + num_ended:
+			return float("Inf")
+		return time - self.sorted_ends[num_ended-(k-num_present)]
+	
+	# most recent first; present occurrences count as zero
+	def times_since(self,time):
+		num_ended = self.count_ended(time)
+		num_present = self.count_started(time) - num_ended
+		return [0.0]*num_present + [time - x for x in reversed(self.sorted_ends[:num_ended])]
+	
+	# soonest first; present occurrences count as zero
+	def times_until(self,time):
+		num_started = self.count_started(time)
+		num_present = num_started - self.count_ended(time)
+		return [0.0]*num_present + [x - time for x in self.starts[num_started:]]
+	
+	# grid versions of the counts above, for ascending times; each search
+	# starts where the previous one finished, so a whole grid costs one sweep
+	def grid_count_started(self,times):
+		self.finalize()
+		counts = []
+		position = 0
+		for time in times:
+			position = bisect.bisect_right(self.starts,time,position)
+			counts.append(position)
+		return counts
+	
+	# inclusive counts occurrences ending at or before each time
+	def grid_count_ended(self,times,inclusive=False):
+		self.finalize()
+		search = bisect.bisect_left
+		if inclusive:
+			search = bisect.bisect_right
+		counts = []
+		position = 0
+		for time in times:
+			position = search(self.sorted_ends,time,position)
+			counts.append(position)
+		return counts
+	
+	def grid_time_since_last(self,times):
+		return Grid_Counts(self,times).time_since_last()
+	
+	def grid_time_until_next(self,times):
+		return Grid_Counts(self,times).time_until_next()
+	
+	def grid_time_since_kth_last(self,times,k):
+		return Grid_Counts(self,times).time_since_kth_last(k)
+	
+	# PAST events positive, FUTURE events negative, in order of start time
+	def distances(self,time):
+		self.finalize()
+		differences = []
+		for (start_time,end_time) in zip(self.starts,self.ends):
+			if time > end_time:
+				differences.append(time - end_time)
+			elif time < start_time:
+				differences.append(time - start_time)
+			else:
+				differences.append(0.0)
+		return differences
+
+# one timeline holding the occurrences of all the given timelines
+def merge_timelines(timelines):
+	for timeline in timelines:
+		timeline.finalize()
+	occurrences = sorted(itertools.chain.from_iterable(zip(x.starts,x.ends) for x in timelines))
+	merged = Event_Timeline()
+	merged.starts = array.array("d",[x[0] for x in occurrences])
+	merged.ends = array.array("d",[x[1] for x in occurrences])
+	merged.sorted_ends = array.array("d",sorted(itertools.chain.from_iterable(x.sorted_ends for x in timelines)))
+	return merged
+
+# one timeline's counts over an ascending grid of times, each swept on first
+# use and then kept (in self.counts, under a name or a (name,parameter)
+# tuple), so that every feature reading the same events at the same times
+# shares the sweeps; the times since and until occurrences are derived from
+# the started and ended counts
+class Grid_Counts(object):
+	
+	def __init__(self,timeline,times):
+		timeline.finalize()
+		self.timeline = timeline
+		self.times = times
+		self.counts = dict()
+	
+	def counted(self,name,sweep):
+		if name not in self.counts:
+			self.counts[name] = sweep()
+		return self.counts[name]
+	
+	def started(self):
+		return self.counted("started",lambda: self.timeline.grid_count_started(self.times))
+	
+	def ended(self):
+		return self.counted("ended",lambda: self.timeline.grid_count_ended(self.times))
+	
+	# occurrences ending at or before offset time units before each time
+	def ended_by(self,offset):
+		return self.counted(("ended_by",offset),lambda: self.timeline.grid_count_ended([x - offset for x in self.times],inclusive=True))
+	
+	def time_since_last(self):
+		return self.counted("time_since_last",self.sweep_time_since_last)
+	
+	def sweep_time_since_last(self):
+		values = []
+		for (time,num_started,num_ended) in zip(self.times,self.started(),self.ended()):
+			if num_started > num_ended:
+				values.append(0.0)
+			elif num_ended == 0:
+				values.append(float("Inf"))
+			else:
+				values.append(time - self.timeline.sorted_ends[num_ended-1])
+		return values
+	
+	def time_until_next(self):
+		return self.counted("time_until_next",self.sweep_time_until_next)
+	
+	def sweep_time_until_next(self):
+		values = []
+		num_occurrences = len(self.timeline.starts)
+		for (time,num_started,num_ended) in zip(self.times,self.started(),self.ended()):
+			if num_started > num_ended:
+				values.append(0.0)
+			elif num_started == num_occurrences:
+				values.append(float("Inf"))
+			else:
+				values.append(self.timeline.starts[num_started] - time)
+		return values
+	
+	def time_since_kth_last(self,k):
+		return self.counted(("time_since_kth_last",k),lambda: [self.timeline.kth_last_value(time,k,num_started-num_ended,num_ended) for (time,num_started,num_ended) in zip(self.times,self.started(),self.ended())])
+
+# running summary of an event set's occurrences as they arrive in start order,
+# answering the Event_Timeline lookups features use at any time at or after
+# the latest start observed (so that every occurrence observed has started):
+# it keeps the number started and only the ends that can still matter, which
+# are those within horizon of the latest start plus the num_last latest ones
+# value(time) is value_function(self,time), normally a feature's timeline_value
+class Occurrence_Accumulator(object):
+	
+	def __init__(self,value_function,horizon=0.0,num_last=1):
+		self.value_function = value_function
+		self.horizon = horizon
+		self.num_last = num_last
+		self.num_started = 0
+		self.num_dropped = 0 # ends dropped from recent_ends, all long past
+		self.recent_ends = [] # sorted
+		self.last_start = None
+	
+	def __len__(self):
+		return self.num_started
+	
+	def add(self,start_time,end_time):
+		if self.last_start != None and start_time < self.last_start:
+			raise ValueError("events must arrive in time order ({0} after {1})".format(start_time,self.last_start))
+		self.last_start = start_time
+		self.num_started += 1
+		bisect.insort(self.recent_ends,end_time)
+		num_droppable = min(bisect.bisect_left(self.recent_ends,start_time - self.horizon),len(self.recent_ends) - self.num_last)
+		if num_droppable > 0:
+			del self.recent_ends[:num_droppable]
+			self.num_dropped += num_droppable
+	
+	def value(self,time):
+		return self.value_function(self,time)
+	
+	def count_started(self,time):
+		return self.num_started
+	
+	def count_ended(self,time):
+		return self.num_dropped + bisect.bisect_left(self.recent_ends,time)
+	
+	def count_ended_by(self,time):
+		return self.num_dropped + bisect.bisect_right(self.recent_ends,time)
+	
+	def time_since_last(self,time):
+		return self.time_since_kth_last(time,1)
+	
+	# nothing observed starts after time, so only a present occurrence is next
+	def time_until_next(self,time):
+		if self.num_started > self.count_ended(time):
+			return 0.0
+		return float("Inf")
+	
+	# k must be at most num_last
+	def time_since_kth_last(self,time,k):
+		num_ended = self.count_ended(time)
+		if k <= self.num_started - num_ended:
+			return 0.0
+		if k > self.num_started:
+			return float("Inf")
+		return time - self.recent_ends[len(self.recent_ends)-k]
 
 class Example(object):
 
@@ -8,58 +355,182 @@ class Example(object):
 		self.id = id
 		self.static_values = dict()
 		self.events = dict()
+		self.indexes = dict() # derived per-example lookup structures, see cached_index
 
 	def add_event(self,event_name,event_start_time,event_end_time=None):
+		self.indexes.clear()
 		if event_name not in self.events:
-			self.events[event_name] = []
+			self.events[event_name] = Event_Timeline()
 		if event_end_time == None:
 			event_end_time = event_start_time
-		self.events[event_name].append((event_start_time,event_end_time))
+		self.events[event_name].add_occurrence(numeric_time(event_start_time),numeric_time(event_end_time))
+	
+	# sorts any timelines that received events out of order; queries do this
+	# lazily, but calling it once after loading keeps the cost out of training
+	def finalize(self):
+		for timeline in self.events.values():
+			timeline.finalize()
 	
 	def create_example_moment(self,moment):
 		return Example_Moment(self,moment)
+	
+	# returns the index stored under key, building it first if needed; indexes
+	# are dropped whenever an event is added
+	def cached_index(self,key,build_index):
+		if key not in self.indexes:
+			self.indexes[key] = build_index()
+			if instrumentation.recorder != None:
+				instrumentation.recorder.count("index_cache/misses")
+		elif instrumentation.recorder != None:
+			instrumentation.recorder.count("index_cache/hits")
+		return self.indexes[key]
+	
+	def event_timelines(self,event_names):
+		return [self.events[x] for x in event_names if x in self.events]
+	
+	# a single timeline of every occurrence of the given events (a name given
+	# twice counts twice), merged once and then kept with the other indexes;
+	# the sorted starts and ends double as cumulative counts, so counts over
+	# the whole event set are binary searches
+	def merged_timeline(self,event_names):
+		timelines = self.event_timelines(event_names)
+		if len(timelines) == 1:
+			return timelines[0]
+		return self.cached_index(("Merged Timeline",)+tuple(sorted(event_names)),lambda: merge_timelines(timelines))
+	
+	# Grid_Counts over the merged timeline of the events, at ascending times
+	def grid_counts(self,event_names,times):
+		return Grid_Counts(self.merged_timeline(event_names),times)
 
 class Example_Moment(object):
 	
 	def __init__(self,example,moment):
 		self.example = example
 		self.moment = moment
+		self.time = numeric_time(moment)
 	
 	# PAST events positive, FUTURE events negative
 	def temporal_distance_from_occurrence(self,event):
-		
-		if event not in self.example.events:
-			return []
-		
-		differences = []
-		for (start_time,end_time) in self.example.events[event]:
-			# if event is in the past
-			if self.moment > end_time:
-				differences.append(self.moment - end_time)
-			# if event is in the future
-			elif self.moment < start_time:
-				differences.append(self.moment - start_time)
-			# else event is present
-			else:
-				differences.append(self.moment-self.moment) # zero but preserves typing
-		
-		if type(self.moment) == datetime.date:
-			differences = [x.days for x in differences]
-		
-		return [float(x) for x in differences]
+		return self.event_lookup("distances",event,[])
 	
 	def times_since_occurrence(self,event):
-		differences = self.temporal_distance_from_occurrence(event)
-		return [x for x in differences if x >= 0.0]
+		return self.event_lookup("times_since",event,[])
 	
 	def times_until_occurrence(self,event):
-		differences = self.temporal_distance_from_occurrence(event)
-		differences = [-x for x in differences]
-		return [x for x in differences if x >= 0.0]
+		return self.event_lookup("times_until",event,[])
+	
+	def time_since_last_occurrence(self,event):
+		return self.event_lookup("time_since_last",event,float("Inf"))
+	
+	def time_until_next_occurrence(self,event):
+		return self.event_lookup("time_until_next",event,float("Inf"))
+	
+	# calls the named Event_Timeline method at this moment, going through the
+	# query cache when one is enabled; lists that come from the cache are
+	# shared, so callers must not modify them
+	def event_lookup(self,lookup_name,event,default):
+		if event not in self.example.events:
+			return default
+		timeline = self.example.events[event]
+		if query_cache == None:
+			return getattr(timeline,lookup_name)(self.time)
+		return query_cache.lookup((self.example.id,self.moment,lookup_name,event),lambda: getattr(timeline,lookup_name)(self.time))
+	
+	# the same over the merged timeline of several events, so that each lookup
+	# is one search whatever the number of events; extra arguments are passed
+	# on after the time
+	def events_lookup(self,lookup_name,event_names,*arguments):
+		timeline = self.example.merged_timeline(event_names)
+		if query_cache == None:
+			return getattr(timeline,lookup_name)(self.time,*arguments)
+		return query_cache.lookup((self.example.id,self.moment,lookup_name,tuple(event_names))+arguments,lambda: getattr(timeline,lookup_name)(self.time,*arguments))
+	
+	def time_since_last_occurrence_of_any(self,event_names):
+		return self.events_lookup("time_since_last",event_names)
+	
+	def time_until_next_occurrence_of_any(self,event_names):
+		return self.events_lookup("time_until_next",event_names)
+	
+	def time_since_kth_last_occurrence_of_any(self,event_names,k):
+		return self.events_lookup("time_since_kth_last",event_names,k)
 	
 	def compute_label_and_weight(self,classlabel_feature):
 		(self.label,self.weight) = classlabel_feature.query(self)
 
+# opt-in memo of feature values and per-event lookups, keyed on (example id,
+# moment, feature identity, feature) or (example id, moment, lookup, event);
+# features are told apart by identity, since distinct features may share a
+# name and type, and the feature itself stays in the key so that its id is
+# not reused while the entry is cached; holds at most max_size entries,
+# evicting the least recently used
+# examples are identified by id only, so clear the cache (or disable it)
+# whenever events are added to an example that has already been queried
+class Query_Cache(object):
+	
+	def __init__(self,max_size=1000000):
+		self.max_size = max_size
+		self.entries = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+	
+	def lookup(self,key,compute_value):
+		if key in self.entries:
+			value = self.entries.pop(key)
+			self.hits += 1
+			if instrumentation.recorder != None:
+				instrumentation.recorder.count("query_cache/hits")
+		else:
+			value = compute_value()
+			self.misses += 1
+			if instrumentation.recorder != None:
+				instrumentation.recorder.count("query_cache/misses")
+			if len(self.entries) >= self.max_size:
+				self.entries.popitem(last=False)
+		self.entries[key] = value
+		return value
+	
+	def hit_rate(self):
+		if self.hits + self.misses == 0:
+			return 0.0
+		return float(self.hits)/(self.hits + self.misses)
+	
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+
+# the cache consulted by Example_Moment lookups and by queries of features
+# decorated with cached_query; None (the default) disables caching
+query_cache = None
+
+def enable_query_cache(max_size=1000000):
+	global query_cache
+	query_cache = Query_Cache(max_size)
+	return query_cache
+
+def disable_query_cache():
+	global query_cache
+	query_cache = None
+
+def cached_query(query):
+	def query_through_cache(self,example_moment):
+		if query_cache == None:
+			return query(self,example_moment)
+		return query_cache.lookup((example_moment.example.id,example_moment.moment,id(self),self),lambda: query(self,example_moment))
+	return instrumented_query(query_through_cache)
+
+# counts and times query calls per feature class while instrumentation is
+# enabled; cached_query applies it too, so cache hits are counted as calls
+def instrumented_query(query):
+	def query_with_instrumentation(self,example_moment):
+		if instrumentation.recorder == None:
+			return query(self,example_moment)
+		start = instrumentation.clock()
+		value = query(self,example_moment)
+		instrumentation.recorder.add_time("query/" + self.__class__.__name__,instrumentation.clock()-start)
+		return value
+	return query_with_instrumentation
+
 class Feature(object):
 	
 	def __init__(self,feature_name,feature_type):
@@ -77,6 +548,32 @@ class Feature(object):
 	
 	def __hash__(self):
 		return hash(self.feature_name) ^ hash(self.feature_type)
+	
+	# streaming use, for features with create_accumulator(): start from
+	# create_accumulator() and pass each event occurrence through observe() as
+	# it arrives, in start order; accumulator.value(time) is then this feature's
+	# value at time (at or after the latest start observed), given every
+	# occurrence observed so far
+	def observe(self,accumulator,event_name,start_time,end_time=None):
+		if end_time == None:
+			end_time = start_time
+		for x in self.event_names:
+			if x == event_name:
+				accumulator.add(numeric_time(start_time),numeric_time(end_time))
+	
+	# evaluates the feature for one example at each of several moments
+	# features that define grid_values(example,times) answer the whole grid in
+	# one sweep over ascending numeric times; others are queried moment by moment
+	def query_grid(self,example,moments):
+		if not hasattr(self,"grid_values"):
+			return [self.query(example.create_example_moment(x)) for x in moments]
+		times = [numeric_time(x) for x in moments]
+		order = sorted(range(len(times)),key=times.__getitem__)
+		sorted_values = self.grid_values(example,[times[i] for i in order])
+		values = [None]*len(times)
+		for (i,value) in zip(order,sorted_values):
+			values[i] = value
+		return values
 
 class Feature_Static(Feature):
 
@@ -84,6 +581,7 @@ class Feature_Static(Feature):
 		Feature.__init__(self,feature_name,"Static")
 		self.static_name = static_name
 	
+	@instrumented_query
 	def query(self,example_moment):
 		return example_moment.example.static_values[self.static_name]
 
@@ -95,6 +593,7 @@ class Feature_Arbitrary(Feature):
 		for i in range(len(id_moment_pairs)):
 			self.value_mapping[id_moment_pairs[i]] = values[i]
 	
+	@instrumented_query
 	def query(self,example_moment):
 		return self.value_mapping[(example_moment.example.id,example_moment.moment)]
 
@@ -104,12 +603,23 @@ class Feature_LastOccurrence(Feature):
 		Feature.__init__(self,feature_name,"Last Occurrence")
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		result = float("Inf")
-		for event in self.event_names:
-			for time_since in example_moment.times_since_occurrence(event):
-				result = min(result,time_since)
-		return result
+		return example_moment.time_since_last_occurrence_of_any(self.event_names)
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	# the values at a grid of times given their Grid_Counts for the events
+	def count_values(self,grid_counts):
+		return grid_counts.time_since_last()
+	
+	# the value at time given a timeline (or Occurrence_Accumulator) of the events
+	def timeline_value(self,timeline,time):
+		return timeline.time_since_last(time)
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value)
 
 class Feature_NextOccurrence(Feature):
 	
@@ -117,33 +627,162 @@ class Feature_NextOccurrence(Feature):
 		Feature.__init__(self,feature_name,"Next Occurrence")
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		result = float("Inf")
-		for event in self.event_names:
-			for time_until in example_moment.times_until_occurrence(event):
-				result = min(result,time_until)
-		return result
+		return example_moment.time_until_next_occurrence_of_any(self.event_names)
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		return grid_counts.time_until_next()
+	
+	def timeline_value(self,timeline,time):
+		return timeline.time_until_next(time)
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value)
 
-class Feature_2ndLastOccurrence(Feature):
+# time since the k-th most recent occurrence of any of the events (k=1 is the
+# same as Feature_LastOccurrence), selected from the merged timeline
+class Feature_KthLastOccurrence(Feature):
 	
-	def __init__(self,feature_name,*event_names):
-		Feature.__init__(self,feature_name,"2nd Last Occurrence")
+	def __init__(self,feature_name,k,*event_names):
+		Feature.__init__(self,feature_name,"Kth Last Occurrence ({0})".format(k))
+		if k < 1:
+			raise ValueError("k must be at least 1")
+		self.k = k
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		result = float("Inf")
-		all_times_since = []
-		for event in self.event_names:
-			times_since = example_moment.times_since_occurrence(event)
-			all_times_since += times_since
-		if len(all_times_since) >= 2:
-			all_times_since.remove(min(all_times_since))
-			result = min(all_times_since)
-		return result
+		return example_moment.time_since_kth_last_occurrence_of_any(self.event_names,self.k)
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		return grid_counts.time_since_kth_last(self.k)
+	
+	def timeline_value(self,timeline,time):
+		return timeline.time_since_kth_last(time,self.k)
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value,num_last=self.k)
+
+class Feature_2ndLastOccurrence(Feature_KthLastOccurrence):
+	
+	def __init__(self,feature_name,*event_names):
+		Feature_KthLastOccurrence.__init__(self,feature_name,2,*event_names)
+		self.feature_type = "2nd Last Occurrence"
 
 
 # "intensity" here being a measure that combines event frequency and recency via exponential decay
 
+# running intensity over events arriving in time order; each arrival decays
+# the running total by (1 - decay_rate) ** gap once and adds the event's
+# weight, so an update costs constant time however long the history is
+# intensity is held as of last_time and decayed to the query time on demand
+class Intensity_Accumulator(object):
+	
+	def __init__(self,decay_rate):
+		self.decay_rate = decay_rate
+		self.intensity = 0.0
+		self.last_time = None
+	
+	def add(self,time,weight):
+		time = numeric_time(time)
+		if self.last_time != None:
+			if time < self.last_time:
+				raise ValueError("events must arrive in time order ({0} after {1})".format(time,self.last_time))
+			self.intensity *= (1 - self.decay_rate) ** (time - self.last_time)
+		self.intensity += weight
+		self.last_time = time
+	
+	def value(self,time):
+		if self.last_time == None:
+			return 0.0
+		return self.intensity * ((1 - self.decay_rate) ** (numeric_time(time) - self.last_time))
+
+# one example's accumulator state after each ended occurrence of a feature's
+# events (oldest first, heavier first on ties), so the intensity at any moment
+# is one binary search and one decay step; occurrences still in progress at a
+# moment count as happening at that moment and are added undecayed
+# the ordered occurrences are kept with the example's indexes, so intensities
+# over the same events and weights at other decay rates reuse them
+class Intensity_Index(object):
+	
+	def __init__(self,example,decay_rate,event_names,event_weights):
+		self.decay_rate = decay_rate
+		self.timelines = []
+		for i in range(len(event_names)):
+			if event_names[i] in example.events:
+				timeline = example.events[event_names[i]]
+				timeline.finalize()
+				self.timelines.append((event_weights[i],timeline))
+		self.timelines.sort(key=lambda x: x[0],reverse=True)
+		settled = example.cached_index(("Settled Occurrences",tuple(event_names),tuple(event_weights)),lambda: settled_occurrences(example,event_names,event_weights))
+		
+		accumulator = Intensity_Accumulator(decay_rate)
+		self.end_times = array.array("d")
+		self.intensities = array.array("d")
+		for (end_time,negative_weight) in settled:
+			accumulator.add(end_time,-negative_weight)
+			self.end_times.append(end_time)
+			self.intensities.append(accumulator.intensity)
+	
+	def value(self,time,num_settled=None):
+		if num_settled == None:
+			num_settled = bisect.bisect_left(self.end_times,time)
+		intensity = 0.0
+		if num_settled > 0:
+			intensity = self.intensities[num_settled-1] * ((1 - self.decay_rate) ** (time - self.end_times[num_settled-1]))
+		for (event_weight,timeline) in self.timelines:
+			for i in range(timeline.count_started(time) - timeline.count_ended(time)):
+				intensity += event_weight
+		return intensity
+	
+	def grid_values(self,times):
+		values = []
+		num_settled = 0
+		for time in times:
+			num_settled = bisect.bisect_left(self.end_times,time,num_settled)
+			values.append(self.value(time,num_settled))
+		return values
+
+# (end time,-weight) for every occurrence of the events, in settling order
+def settled_occurrences(example,event_names,event_weights):
+	settled = []
+	for i in range(len(event_names)):
+		if event_names[i] in example.events:
+			settled += [(x,-event_weights[i]) for x in example.events[event_names[i]].sorted_ends]
+	settled.sort()
+	return settled
+
+# Intensity_Index's value over occurrences arriving in start order, for
+# streaming: each occurrence is settled into an Intensity_Accumulator once it
+# has ended (oldest first, heavier first on ties), and those still in progress
+# are added undecayed; value() settles as it goes, so its times must not
+# decrease, and occurrences must not start before the last time asked about
+class Intensity_Stream(object):
+	
+	def __init__(self,decay_rate):
+		self.settled = Intensity_Accumulator(decay_rate)
+		self.unsettled = [] # heap of (end time,-weight)
+	
+	def add(self,start_time,end_time,weight):
+		heapq.heappush(self.unsettled,(end_time,-weight))
+	
+	def value(self,time):
+		time = numeric_time(time)
+		while self.unsettled and self.unsettled[0][0] < time:
+			(end_time,negative_weight) = heapq.heappop(self.unsettled)
+			self.settled.add(end_time,-negative_weight)
+		intensity = self.settled.value(time)
+		for weight in sorted([-x[1] for x in self.unsettled],reverse=True):
+			intensity += weight
+		return intensity
+
 class Feature_Intensity(Feature):
 	
 	def __init__(self,feature_name,decay_rate,*event_names_and_weights):
@@ -156,57 +795,62 @@ class Feature_Intensity(Feature):
 			self.event_names.append(event_names_and_weights.pop(0))
 			self.event_weights.append(float(event_names_and_weights.pop(0)))
 	
+	@cached_query
 	def query(self,example_moment):
-		time_weight_pairs = []
-		
+		return self.intensity_index(example_moment.example).value(example_moment.time)
+	
+	def grid_values(self,example,times):
+		return self.intensity_index(example).grid_values(times)
+	
+	def intensity_index(self,example):
+		key = ("Intensity",self.decay_rate,tuple(self.event_names),tuple(self.event_weights))
+		return example.cached_index(key,lambda: Intensity_Index(example,self.decay_rate,self.event_names,self.event_weights))
+	
+	def create_accumulator(self):
+		return Intensity_Stream(self.decay_rate)
+	
+	def observe(self,accumulator,event_name,start_time,end_time=None):
+		if end_time == None:
+			end_time = start_time
 		for i in range(len(self.event_names)):
-			event_name = self.event_names[i]
-			event_weight = self.event_weights[i]
-			for occurrence in example_moment.times_since_occurrence(event_name):
-				time_weight_pairs.append((occurrence,event_weight))
-		
-		sorted_time_weight_pairs = sorted(time_weight_pairs,reverse=True)
-		
-		weights = [x[1] for x in sorted_time_weight_pairs]
-		time_gaps = []
-		i = 1
-		while i < len(sorted_time_weight_pairs):
-			time_gaps.append(sorted_time_weight_pairs[i-1][0] - sorted_time_weight_pairs[i][0])
-			i += 1
-		if len(sorted_time_weight_pairs) > 0:
-			time_gaps.append(sorted_time_weight_pairs[-1][0])
-		
-		intensity = 0.0
-		for i in range(len(weights)):
-			
-			# additive increase
-			intensity += weights[i]
-			
-			# exponential decay
-			multiplicative_factor = (1 - self.decay_rate) ** time_gaps[i]
-			intensity *= multiplicative_factor
-		
-		return intensity
+			if self.event_names[i] == event_name:
+				accumulator.add(numeric_time(start_time),numeric_time(end_time),self.event_weights[i])
 
 class Feature_Frequency(Feature):
 	
 	def __init__(self,feature_name,record_start_time,*event_names):
 		Feature.__init__(self,feature_name,"Frequency")
 		self.record_start_time = record_start_time
+		self.record_start = numeric_time(record_start_time)
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		all_count = 0.0
-		for event in self.event_names:
-			all_count += len(example_moment.times_since_occurrence(event))
+		return self.timeline_value(example_moment.example.merged_timeline(self.event_names),example_moment.time)
+	
+	def timeline_value(self,timeline,time):
+		all_count = float(timeline.count_started(time))
 		
-		time_on_record = example_moment.moment - self.record_start_time
-		if type(time_on_record) == datetime.timedelta:
-			time_on_record = time_on_record.days
+		time_on_record = time - self.record_start
 		if time_on_record == 0.0:
 			time_on_record = sys.float_info.min
 		
 		return all_count/time_on_record
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		values = []
+		for (time,all_count) in zip(grid_counts.times,grid_counts.started()):
+			time_on_record = time - self.record_start
+			if time_on_record == 0.0:
+				time_on_record = sys.float_info.min
+			values.append(float(all_count)/time_on_record)
+		return values
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value)
 
 class Feature_Recent_Frequency(Feature):
 	
@@ -215,14 +859,30 @@ class Feature_Recent_Frequency(Feature):
 		self.window_size = window_size
 		self.event_names = event_names
 	
+	# occurrences within the window are those started by the moment that did
+	# not end at or before (moment - window_size)
+	@cached_query
 	def query(self,example_moment):
+		return self.timeline_value(example_moment.example.merged_timeline(self.event_names),example_moment.time)
+	
+	def timeline_value(self,timeline,time):
 		all_count = 0.0
-		for event in self.event_names:
-			occurrences = example_moment.times_since_occurrence(event)
-			recent_occurrences = [x for x in occurrences if x < self.window_size]
-			all_count += len(recent_occurrences)
+		if self.window_size > 0:
+			all_count = float(timeline.count_started(time) - timeline.count_ended_by(time - self.window_size))
 		
 		return all_count/self.window_size
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		all_counts = [0.0]*len(grid_counts.times)
+		if self.window_size > 0:
+			all_counts = [float(x-y) for (x,y) in zip(grid_counts.started(),grid_counts.ended_by(self.window_size))]
+		return [x/self.window_size for x in all_counts]
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value,horizon=self.window_size)
 
 class Feature_Count(Feature):
 	
@@ -230,15 +890,24 @@ class Feature_Count(Feature):
 		Feature.__init__(self,feature_name,"Count")
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		all_count = 0.0
-		for event in self.event_names:
-			all_count += len(example_moment.times_since_occurrence(event))
-		
-		return all_count
+		return self.timeline_value(example_moment.example.merged_timeline(self.event_names),example_moment.time)
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		return [float(x) for x in grid_counts.started()]
+	
+	def timeline_value(self,timeline,time):
+		return float(timeline.count_started(time))
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value)
 
 # obviously, this feature type should only be used for example-moments with
-# date or datetime moments
+# date or datetime moments, or numeric moments in the current time unit
 class Feature_MonthDay(Feature):
 	
 	# monthday_to_value should be a dict mapping tuples to floats
@@ -246,9 +915,13 @@ class Feature_MonthDay(Feature):
 		Feature.__init__(self,feature_name,"Month/Day")
 		self.monthday_to_value = monthday_to_value
 	
+	@instrumented_query
 	def query(self,example_moment):
-		month = example_moment.moment.month
-		day = example_moment.moment.day
+		moment = example_moment.moment
+		if not isinstance(moment,datetime.date):
+			moment = display_time(example_moment.time)
+		month = moment.month
+		day = moment.day
 		return self.monthday_to_value[(month,day)]
 
 class Feature_Moment(Feature):
@@ -256,6 +929,7 @@ class Feature_Moment(Feature):
 	def __init__(self,feature_name):
 		Feature.__init__(self,feature_name,"Moment")
 	
+	@instrumented_query
 	def query(self,example_moment):
 		return example_moment.moment
 
@@ -266,15 +940,28 @@ class Feature_TemporalWindow(Feature):
 		self.window_size = window_size
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		last_occurrence = float("Inf")
-		for event in self.event_names:
-			for time_since in example_moment.times_since_occurrence(event):
-				last_occurrence = min(last_occurrence,time_since)
+		last_occurrence = example_moment.time_since_last_occurrence_of_any(self.event_names)
 		if last_occurrence <= self.window_size:
 			return 1.0
 		else:
 			return 0.0
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		return [1.0 if x <= self.window_size else 0.0 for x in grid_counts.time_since_last()]
+	
+	def timeline_value(self,timeline,time):
+		if timeline.time_since_last(time) <= self.window_size:
+			return 1.0
+		else:
+			return 0.0
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value)
 
 class Feature_TwoSidedTemporalWindow(Feature):
 
@@ -284,26 +971,61 @@ class Feature_TwoSidedTemporalWindow(Feature):
 		self.window_max = window_max
 		self.event_names = event_names
 	
+	# present occurrences are zero time units ago; past ones fall in the window
+	# when they ended in (moment - window_max, moment - window_min]
+	@cached_query
 	def query(self,example_moment):
-		event_present = False
-		for event in self.event_names:
-			for time_since in example_moment.times_since_occurrence(event):
-				if time_since >= self.window_min and time_since < self.window_max:
-					event_present = True
-		if event_present:
+		return self.timeline_value(example_moment.example.merged_timeline(self.event_names),example_moment.time)
+	
+	def timeline_value(self,timeline,time):
+		num_ended = timeline.count_ended(time)
+		in_window_count = 0
+		if self.window_min <= 0.0 and 0.0 < self.window_max:
+			in_window_count += timeline.count_started(time) - num_ended
+		upper_count = num_ended
+		if self.window_min > 0.0:
+			upper_count = timeline.count_ended_by(time - self.window_min)
+		in_window_count += max(0,upper_count - timeline.count_ended_by(time - self.window_max))
+		if in_window_count > 0:
 			return 1.0
 		else:
 			return 0.0
+	
+	def grid_values(self,example,times):
+		return self.count_values(example.grid_counts(self.event_names,times))
+	
+	def count_values(self,grid_counts):
+		present_in_window = self.window_min <= 0.0 and 0.0 < self.window_max
+		if self.window_min > 0.0:
+			upper_counts = grid_counts.ended_by(self.window_min)
+		else:
+			upper_counts = grid_counts.ended()
+		lower_counts = grid_counts.ended_by(self.window_max)
+		in_window_counts = [max(0,x-y) for (x,y) in zip(upper_counts,lower_counts)]
+		if present_in_window:
+			num_present = [x-y for (x,y) in zip(grid_counts.started(),grid_counts.ended())]
+			in_window_counts = [x+y for (x,y) in zip(in_window_counts,num_present)]
+		return [1.0 if x > 0 else 0.0 for x in in_window_counts]
+	
+	def create_accumulator(self):
+		return Occurrence_Accumulator(self.timeline_value,horizon=max(self.window_min,self.window_max))
 
 class FeatureWrapper_Normalize_MaxSignalZero(Feature):
 
 	def __init__(self,inner_feature,median):
 		Feature.__init__(self,inner_feature.feature_name + " (normalized)","Normalized Feature (Max Signal=0.0) - " + inner_feature.feature_type)
 		self.inner_feature = inner_feature
+		self.median = median
 		self.alpha = 1.0/median
 	
+	@cached_query
 	def query(self,example_moment):
-		inner_value = self.inner_feature.query(example_moment)
+		return self.transform(self.inner_feature.query(example_moment))
+	
+	def query_grid(self,example,moments):
+		return [self.transform(x) for x in self.inner_feature.query_grid(example,moments)]
+	
+	def transform(self,inner_value):
 		if inner_value == 0.0:
 			return 1.0
 		elif inner_value == float("Inf"):
@@ -316,10 +1038,17 @@ class FeatureWrapper_Normalize_MaxSignalInf(Feature):
 	def __init__(self,inner_feature,median):
 		Feature.__init__(self,inner_feature.feature_name + " (normalized)","Normalized Feature (Max Signal=+Inf) - " + inner_feature.feature_type)
 		self.inner_feature = inner_feature
+		self.median = median
 		self.alpha = float(median)
 	
+	@cached_query
 	def query(self,example_moment):
-		inner_value = self.inner_feature.query(example_moment)
+		return self.transform(self.inner_feature.query(example_moment))
+	
+	def query_grid(self,example,moments):
+		return [self.transform(x) for x in self.inner_feature.query_grid(example,moments)]
+	
+	def transform(self,inner_value):
 		if inner_value == 0.0:
 			return 0.0
 		elif inner_value == float("Inf"):
@@ -333,12 +1062,25 @@ class FeatureWrapper_Inverse(Feature):
 		Feature.__init__(self,feature_name,inner_feature.feature_type + " (inverted)")
 		self.inner_feature = inner_feature
 	
+	@cached_query
 	def query(self,example_moment):
-		inner_value = self.inner_feature.query(example_moment)
+		return self.transform(self.inner_feature.query(example_moment))
+	
+	def query_grid(self,example,moments):
+		return [self.transform(x) for x in self.inner_feature.query_grid(example,moments)]
+	
+	def transform(self,inner_value):
 		return 1.0-inner_value
 
 # querying a ClassLabel Feature returns a (label,weight) pair, label in {+,-}, weight 0.0+
 # ClassLabel features are unweighted (all weights 1.0) unless otherwise specified
+# the event-based ones also label many moments at once (see build_label_matrix):
+# distance_feature() is the Feature giving the time until (or since) the
+# events that the label depends on, and label_arrays(distances) turns a list
+# of those times into compact labels (1 for +, 0 for -) and weights
+
+def distance_feature_name(event_names):
+	return ",".join(sorted(event_names))
 
 class Feature_ClassLabel_ImpendingEvent(Feature):
 
@@ -347,15 +1089,20 @@ class Feature_ClassLabel_ImpendingEvent(Feature):
 		self.future_threshold = future_threshold
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		next_occurrence = float("Inf")
-		for event in self.event_names:
-			for time_until in example_moment.times_until_occurrence(event):
-				next_occurrence = min(next_occurrence,time_until)
+		next_occurrence = example_moment.time_until_next_occurrence_of_any(self.event_names)
 		if next_occurrence <= self.future_threshold:
 			return ("+",1.0)
 		else:
 			return ("-",1.0)
+	
+	def distance_feature(self):
+		return Feature_NextOccurrence(distance_feature_name(self.event_names),*self.event_names)
+	
+	def label_arrays(self,next_occurrences):
+		labels = array.array("b",[x <= self.future_threshold for x in next_occurrences])
+		return (labels,array.array("d",[1.0])*len(labels))
 
 class Feature_ClassLabel_ImpendingEvent_LinearWeight(Feature):
 
@@ -364,11 +1111,9 @@ class Feature_ClassLabel_ImpendingEvent_LinearWeight(Feature):
 		self.zero_weight_threshold = zero_weight_threshold
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		next_occurrence = float("Inf")
-		for event in self.event_names:
-			for time_until in example_moment.times_until_occurrence(event):
-				next_occurrence = min(next_occurrence,time_until)
+		next_occurrence = example_moment.time_until_next_occurrence_of_any(self.event_names)
 		if next_occurrence >= self.zero_weight_threshold * 2:
 			return ("-",1.0)
 		elif next_occurrence >= self.zero_weight_threshold:
@@ -377,7 +1122,13 @@ class Feature_ClassLabel_ImpendingEvent_LinearWeight(Feature):
 		else:
 			weight = (self.zero_weight_threshold-next_occurrence)/(self.zero_weight_threshold)
 			return ("+",weight)
-		
+	
+	def distance_feature(self):
+		return Feature_NextOccurrence(distance_feature_name(self.event_names),*self.event_names)
+	
+	def label_arrays(self,next_occurrences):
+		return linear_weight_label_arrays(next_occurrences,self.zero_weight_threshold)
+
 class Feature_ClassLabel_RecentEvent(Feature):
 	
 	def __init__(self,feature_name,past_threshold,*event_names):
@@ -385,15 +1136,20 @@ class Feature_ClassLabel_RecentEvent(Feature):
 		self.past_threshold = past_threshold
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		last_occurrence = float("Inf")
-		for event in self.event_names:
-			for time_since in example_moment.times_since_occurrence(event):
-				last_occurrence = min(last_occurrence,time_since)
+		last_occurrence = example_moment.time_since_last_occurrence_of_any(self.event_names)
 		if last_occurrence <= self.past_threshold:
 			return ("+",1.0)
 		else:
 			return ("-",1.0)
+	
+	def distance_feature(self):
+		return Feature_LastOccurrence(distance_feature_name(self.event_names),*self.event_names)
+	
+	def label_arrays(self,last_occurrences):
+		labels = array.array("b",[x <= self.past_threshold for x in last_occurrences])
+		return (labels,array.array("d",[1.0])*len(labels))
 
 class Feature_ClassLabel_RecentEvent_LinearWeight(Feature):
 
@@ -402,11 +1158,9 @@ class Feature_ClassLabel_RecentEvent_LinearWeight(Feature):
 		self.zero_weight_threshold = zero_weight_threshold
 		self.event_names = event_names
 	
+	@cached_query
 	def query(self,example_moment):
-		last_occurrence = float("Inf")
-		for event in self.event_names:
-			for time_since in example_moment.times_since_occurrence(event):
-				last_occurrence = min(last_occurrence,time_since)
+		last_occurrence = example_moment.time_since_last_occurrence_of_any(self.event_names)
 		if last_occurrence >= self.zero_weight_threshold * 2:
 			return ("-",1.0)
 		elif last_occurrence >= self.zero_weight_threshold:
@@ -415,6 +1169,20 @@ class Feature_ClassLabel_RecentEvent_LinearWeight(Feature):
 		else:
 			weight = (self.zero_weight_threshold-last_occurrence)/(self.zero_weight_threshold)
 			return ("+",weight)
+	
+	def distance_feature(self):
+		return Feature_LastOccurrence(distance_feature_name(self.event_names),*self.event_names)
+	
+	def label_arrays(self,last_occurrences):
+		return linear_weight_label_arrays(last_occurrences,self.zero_weight_threshold)
+
+# the LinearWeight labels' rule over many distances: + with weight falling from
+# 1 to 0 up to zero_weight_threshold, then - with weight rising back to 1 at
+# twice zero_weight_threshold
+def linear_weight_label_arrays(distances,zero_weight_threshold):
+	labels = array.array("b",[x < zero_weight_threshold for x in distances])
+	weights = array.array("d",[1.0 if x >= zero_weight_threshold * 2 else abs(x-zero_weight_threshold)/zero_weight_threshold for x in distances])
+	return (labels,weights)
 
 class Feature_ClassLabel_Arbitrary(Feature):
 
@@ -425,5 +1193,6 @@ class Feature_ClassLabel_Arbitrary(Feature):
 			id_moment_pair = id_moment_pairs[i]
 			self.label_mapping[id_moment_pair] = (labels[i],weights[i])
 	
+	@instrumented_query
 	def query(self,example_moment):
 		return self.label_mapping[(example_moment.example.id,example_moment.moment)]
\ No newline at end of file
@@ -0,0 +1,18 @@
+import os
+import tempfile
+from benchmark import *
+
+config = {"entities":20,"events_per_entity":30,"moments_per_entity":10,"features":14,"tree_sizes":[200],"tree_depths":[2,-1],"logreg_epochs":2,"repeats":1}
+results = run_benchmarks(config)
+print [x["name"] for x in results["results"]]
+
+results_path = os.path.join(tempfile.mkdtemp(),"benchmark.json")
+save_results(results,results_path)
+saved_results = load_results(results_path)
+print "Saved {0} results".format(len(saved_results["results"]))
+
+slower_results = load_results(results_path)
+slower_results["results"][0]["seconds"] *= 2.0
+print [x[0] for x in compare_results(saved_results,slower_results)]
+
+os.remove(results_path)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+from temporal_ml import *
+from event_store import *
+
+'''
+0123456789
+A   A A A
+ B  BB  B
+  C  CC C
+'''
+
+csv_path = os.path.join(tempfile.mkdtemp(),"events.csv")
+with open(csv_path,"w") as csv_file:
+	csv_file.write("id,event,start,end\n")
+	for (event,ticks) in [("C",[2,5,6,8]),("A",[8,0,4,6]),("B",[1,4,5,8])]:
+		for tick in ticks:
+			csv_file.write("test_example,{0},{1},\n".format(event,tick))
+	csv_file.write("other_example,A,3,7\n")
+
+store = load_event_csv(csv_path)
+store.add_static_value("test_example","Age",42.0)
+print "{0} entities, {1} events".format(len(store),store.num_events())
+
+example = Example("test_example")
+for tick in [0,4,6,8]:
+	example.add_event("A",tick)
+for tick in [1,4,5,8]:
+	example.add_event("B",tick)
+for tick in [2,5,6,8]:
+	example.add_event("C",tick)
+
+stored_example = store.example("test_example")
+for event_name in sorted(stored_example.events):
+	print event_name, list(stored_example.events[event_name])
+print stored_example.static_values
+
+features = [
+	Feature_LastOccurrence("Last A","A"),
+	Feature_NextOccurrence("Next B","B"),
+	Feature_2ndLastOccurrence("2nd Last A/C","A","C"),
+	Feature_Count("Count C","C"),
+	Feature_Frequency("Freq A",2,"A"),
+	Feature_Intensity("Intensity A/B",.1,"A",1.0,"B",0.5),
+	Feature_Static("Age","Age")
+]
+
+matches = True
+for tick in range(10):
+	for feature in features[:-1]:
+		if feature.query(example.create_example_moment(tick)) != feature.query(stored_example.create_example_moment(tick)):
+			matches = False
+print "Matches Example: {0}".format(matches)
+
+other_example = store.example("other_example")
+print [features[0].query(other_example.create_example_moment(x)) for x in range(10)]
+print features[-1].query(stored_example.create_example_moment(0))
+
+round_trip = store_examples([example])
+print [list(round_trip.example("test_example").events[x]) == list(example.events[x]) for x in "ABC"]
+
+store_path = os.path.join(os.path.dirname(csv_path),"events.bin")
+save_event_store(store,store_path)
+mapped_store = Mapped_Event_Store(store_path)
+mapped_example = mapped_store.example("test_example")
+print "{0} mapped entities, {1} mapped events".format(len(mapped_store),mapped_store.num_events())
+print [list(mapped_example.events[x]) == list(example.events[x]) for x in "ABC"], mapped_example.static_values
+print [features[0].query(mapped_store.example("other_example").create_example_moment(x)) for x in range(10)]
+
+# entities with only static values, added before and after the events
+store.add_static_value("static_only_example","Age",7.0)
+static_only_store = Event_Store()
+static_only_store.add_static_value("early_example","Age",3.0)
+static_only_store.add_event("test_example","A",1)
+print store.example("static_only_example").static_values, static_only_store.example("early_example").static_values, list(static_only_store.example("test_example").events["A"])
+save_event_store(store,store_path)
+print Mapped_Event_Store(store_path).example("static_only_example").static_values
+
+# unicode ids come back as unicode from a mapped store
+unicode_store = Event_Store()
+unicode_store.add_event(u"\xe9t\xe9","A",1)
+unicode_store.add_event("plain","A",2)
+save_event_store(unicode_store,store_path)
+mapped_unicode_store = Mapped_Event_Store(store_path)
+print [mapped_unicode_store.example(x).id == x for x in unicode_store.entity_ids], [type(x.id).__name__ for x in mapped_unicode_store.examples()]
+
+os.remove(csv_path)
+os.remove(store_path)
@@ -0,0 +1,94 @@
+import cPickle
+from temporal_ml import *
+from feature_matrix import *
+from tree_learning import build_classification_tree
+
+'''
+0123456789
+A   A A A
+ B  BB  B
+  C  CC C
+'''
+
+example = Example("test_example")
+for tick in [0,4,6,8]:
+	example.add_event("A",tick)
+for tick in [1,4,5,8]:
+	example.add_event("B",tick)
+for tick in [2,5,6,8]:
+	example.add_event("C",tick)
+
+last_a = Feature_LastOccurrence("Last A","A")
+normalized_last_a = FeatureWrapper_Normalize_MaxSignalZero(last_a,2.0)
+inverted_normalized_last_a = FeatureWrapper_Inverse(normalized_last_a,"Inverted Normalized Last A")
+next_b = Feature_NextOccurrence("Next B","B")
+count_c = Feature_Count("Count C","C")
+intensity_ab = Feature_Intensity("Intensity A/B",.1,"A",1.0,"B",0.5)
+moment = Feature_Moment("Moment")
+
+features = [last_a,normalized_last_a,inverted_normalized_last_a,next_b,count_c,intensity_ab,moment]
+impending_c = Feature_ClassLabel_ImpendingEvent("Impending C",2,"C")
+
+example_moments = [example.create_example_moment(x) for x in range(10)]
+
+feature_matrix = build_feature_matrix(example_moments,features,impending_c)
+
+for row_index in range(len(feature_matrix)):
+	print feature_matrix.row(row_index), feature_matrix.labels[row_index], feature_matrix.weights[row_index]
+
+matches = True
+for row_index in range(len(example_moments)):
+	for feature_index in range(len(features)):
+		if feature_matrix.value(row_index,feature_index) != features[feature_index].query(example_moments[row_index]):
+			matches = False
+print "Matches per-cell query: {0}".format(matches)
+
+horizon_labels = [Feature_ClassLabel_ImpendingEvent("Impending C ({0})".format(x),x,"C") for x in [1,2,4]]
+horizon_labels += [Feature_ClassLabel_RecentEvent_LinearWeight("Recent A/B ({0})".format(x),x,"A","B") for x in [1,3]]
+label_matrix = build_label_matrix(example_moments,horizon_labels)
+
+for classlabel_feature in horizon_labels:
+	print classlabel_feature.feature_name, list(label_matrix.labels_for(classlabel_feature)), list(label_matrix.weights_for(classlabel_feature))
+
+label_matches = True
+for classlabel_feature in horizon_labels:
+	for row_index in range(len(example_moments)):
+		(label,weight) = classlabel_feature.query(example_moments[row_index])
+		if label_matrix.labels_for(classlabel_feature)[row_index] != encode_label(label) or label_matrix.weights_for(classlabel_feature)[row_index] != weight:
+			label_matches = False
+print "Label matrix matches per-moment labels: {0}".format(label_matches)
+print "Relabeled matrix matches: {0}".format(list(label_matrix.labeled_matrix(feature_matrix,horizon_labels[1]).labels) == list(feature_matrix.labels))
+
+# horizons sharing one name (so equal) still get their own labels
+same_name_labels = [Feature_ClassLabel_ImpendingEvent("Impending C",x,"C") for x in [1,2,4]]
+same_name_matrix = build_label_matrix(example_moments,same_name_labels)
+print "Same-name horizons keep their own labels: {0}".format(all(list(same_name_matrix.labels_for(x)) == [encode_label(x.query(y)[0]) for y in example_moments] for x in same_name_labels))
+
+window_features = [last_a,Feature_Count("Count A","A"),Feature_KthLastOccurrence("2nd Last A/B",2,"B","A")]
+for window in [1,3]:
+	window_features += [Feature_Recent_Frequency("Recent A ({0})".format(window),window,"A"),Feature_TwoSidedTemporalWindow("Window A/B (1-{0})".format(window),1,window,"A","B")]
+window_features += [Feature_Intensity("Intensity A/B ({0})".format(x),x,"A",1.0,"B",0.5) for x in [.1,.5]]
+feature_plan = Feature_Plan(window_features + [normalized_last_a,moment])
+plan_values = dict()
+feature_plan.evaluate(example_moments,group_by_example(example_moments),plan_values)
+for line in feature_plan.describe():
+	print line
+plan_matches = True
+for feature in window_features:
+	if plan_values[id(feature)] != [feature.query(x) for x in example_moments]:
+		plan_matches = False
+print "Planned values match per-cell query: {0}".format(plan_matches)
+
+# window sizes too close to tell apart when printed still get their own sweeps
+close_windows = [Feature_Recent_Frequency("Recent A ({0})".format(x),x,"A") for x in [2.0,2.0000000000001]]
+close_matrix = build_feature_matrix([example.create_example_moment(x) for x in [6.0000000000001,8]],close_windows)
+print "Close window sizes match per-cell query: {0}".format(all(list(close_matrix.columns[i]) == [close_windows[i].query(example.create_example_moment(y)) for y in [6.0000000000001,8]] for i in range(2)))
+
+# wrappers differing only in median share a name and type (so are equal) but
+# keep their own columns, also after pickling and in trees split on them
+medians = [FeatureWrapper_Normalize_MaxSignalZero(last_a,1.0),FeatureWrapper_Normalize_MaxSignalZero(last_a,50.0)]
+median_matrix = build_feature_matrix(example_moments,medians,impending_c)
+pickled_median_matrix = cPickle.loads(cPickle.dumps(median_matrix,2))
+print "Equal features keep their own columns: {0}".format(all(list(median_matrix.column(x)) == [x.query(y) for y in example_moments] for x in medians) and [list(pickled_median_matrix.column(x)) for x in pickled_median_matrix.features] == [list(x) for x in median_matrix.columns])
+median_tree = build_classification_tree(medians[:1],None,feature_matrix=median_matrix)
+print "Tree rows match per-moment queries: {0}".format([median_tree.query(x) for x in example_moments] == [median_tree.query_row(median_matrix,x) for x in range(len(example_moments))] == median_tree.compile().predict(median_matrix))
@@ -0,0 +1,42 @@
+import random
+from temporal_ml import *
+from moment_stream import *
+
+# the small data set several test scripts share: Examples with events A, B
+# and C, a few features over them, labels for C happening within 5 time units
+# and moments every 5 time units over [0,100)
+
+last_a = Feature_LastOccurrence("Last A","A")
+basic_features = [
+	FeatureWrapper_Normalize_MaxSignalZero(last_a,5.0),
+	Feature_Intensity("Intensity B",.1,"B",1.0),
+	Feature_Recent_Frequency("Recent Freq A/B",10,"A","B"),
+	Feature_TemporalWindow("Window C (3)",3,"C"),
+]
+impending_c = Feature_ClassLabel_ImpendingEvent("Impending C",5,"C")
+weighted_impending_c = Feature_ClassLabel_ImpendingEvent_LinearWeight("Impending C",5,"C")
+
+# num_examples Examples with up to 20 occurrences each of A, B and C at
+# whole-number times in [0,100], drawn from generator (by default the random
+# module, seeded by the script); with durations every example has an "Age"
+# static value and a third of occurrences last 3
+def generate_test_examples(num_examples=40,durations=False,generator=random):
+	examples = []
+	for i in range(num_examples):
+		example = Example("example_{0}".format(i))
+		if durations:
+			example.static_values["Age"] = float(generator.randint(20,80))
+		for event in ["A","B","C"]:
+			for j in range(generator.randint(0,20)):
+				start_time = generator.randint(0,100)
+				if durations:
+					example.add_event(event,start_time,start_time + generator.choice([0,0,3]))
+				else:
+					example.add_event(event,start_time)
+		examples.append(example)
+	return examples
+
+# Example_Moments every 5 time units over [0,100) for each example, labeled
+# with classlabel_feature
+def grid_moments(examples,classlabel_feature):
+	return list(stream_moments(examples,Grid_Sampler(5,0,100),classlabel_feature))
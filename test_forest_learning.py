@@ -0,0 +1,51 @@
+from forest_learning import *
+import random
+
+class Simple_Example(object):
+
+	def __init__(self,label,weight=1.0):
+		self.label = label
+		self.weight = weight
+		self.features = dict()
+
+class Simple_Feature(object):
+
+	def __init__(self,name):
+		self.feature_name = name
+	
+	def query(self,simple_example):
+		return simple_example.features[self.feature_name]
+	
+	def __repr__(self):
+		return self.feature_name
+
+examples = []
+for i in range(100):
+	examples.append(Simple_Example("+"))
+for i in range(100):
+	examples.append(Simple_Example("-"))
+
+
+features = []
+for i in range(1,21):
+	correlation = float(i) / 100.0
+	feature_name = "Correlation_{0}%".format(int(correlation*100))
+	features.append(Simple_Feature(feature_name))
+	for example in examples:
+		random_value = random.random()
+		feature_value = correlation + ((1.0-correlation)*random_value)
+		if example.label == "-":
+			feature_value = 1.0-feature_value
+		example.features[feature_name] = feature_value
+
+forest = Random_Forest(features,num_trees=20,max_depth=5,random_seed=1)
+forest.train(examples,verbosity=1)
+print "Serial out-of-bag error: {0}".format(forest.out_of_bag_error)
+
+parallel_forest = Random_Forest(features,num_trees=20,max_depth=5,random_seed=1)
+parallel_forest.train(examples,n_jobs=2)
+print "Parallel out-of-bag error: {0}".format(parallel_forest.out_of_bag_error)
+
+feature_matrix = build_feature_matrix(examples,features)
+print forest.predict(feature_matrix)[:10]
+print [forest.query(x) for x in examples[:10]]
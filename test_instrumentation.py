@@ -0,0 +1,37 @@
+import os
+import tempfile
+from instrumentation import *
+from tree_learning import *
+from logreg_learning import *
+import random
+from test_fixtures import *
+
+random.seed(1)
+
+examples = generate_test_examples()
+
+features = [last_a] + basic_features
+example_moments = grid_moments(examples,impending_c)
+
+recorder = enable_instrumentation()
+enable_query_cache()
+[last_a.query(x) for x in example_moments]
+[last_a.query(x) for x in example_moments]
+disable_query_cache()
+feature_matrix = build_feature_matrix(example_moments,features)
+tree = build_classification_tree(features,None,max_depth=3,random_seed=7,feature_matrix=feature_matrix)
+model = LogReg_Model(features)
+model.train_batch(feature_matrix,feature_matrix,max_iterations=3)
+disable_instrumentation()
+
+for total in sorted(recorder.totals(),key=lambda x: x["name"]):
+	print total["name"], total["calls"]
+print "Query cache hit rate: {0}".format(recorder.hit_rate("query_cache"))
+print "Index cache hit rate: {0}".format(recorder.hit_rate("index_cache"))
+print [(x["path"],x["instances"],x["leaf"]) for x in recorder.records if x["kind"] == "tree_node"]
+print [(x["method"],x["iteration"]) for x in recorder.records if x["kind"] == "logreg_epoch"]
+
+records_path = os.path.join(tempfile.mkdtemp(),"records.jsonl")
+recorder.write(records_path)
+print "Wrote {0} lines".format(len(open(records_path).readlines()))
+os.remove(records_path)
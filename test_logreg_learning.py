@@ -0,0 +1,21 @@
+from logreg_learning import *
+import random
+from test_fixtures import *
+
+random.seed(1)
+
+examples = generate_test_examples()
+
+features = list(basic_features)
+example_moments = grid_moments(examples,weighted_impending_c)
+random.shuffle(example_moments)
+training_moments = example_moments[:600]
+tuning_moments = example_moments[600:]
+
+model = LogReg_Model(features)
+model.train_batch(training_moments,tuning_moments,learning_rate=1.0,max_iterations=200,verbosity=1)
+print [(x.feature_name,model.feature_weights[x.feature_name][-1]) for x in features]
+
+sparse_model = LogReg_Model(features)
+sparse_model.train_batch(training_moments,tuning_moments,learning_rate=1.0,batch_size=50,l1_penalty=0.01)
+print [(x.feature_name,sparse_model.feature_weights[x.feature_name][-1]) for x in features]
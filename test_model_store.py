@@ -0,0 +1,58 @@
+import cPickle
+import os
+import random
+import tempfile
+import time
+from model_store import *
+from moment_stream import *
+from test_fixtures import *
+
+random.seed(1)
+
+examples = generate_test_examples(durations=True)
+
+features = [
+	FeatureWrapper_Normalize_MaxSignalZero(Feature_LastOccurrence("Last A","A"),5.0),
+	FeatureWrapper_Inverse(FeatureWrapper_Normalize_MaxSignalInf(Feature_Count("Count C","C"),2.0),"Few C"),
+	Feature_Intensity("Intensity B",.1,"B",1.0,"C",.5),
+	Feature_Frequency("Frequency A",0,"A"),
+	Feature_Recent_Frequency("Recent Freq A/B",10,"A","B"),
+	Feature_TemporalWindow("Window C (3)",3,"C"),
+	Feature_TwoSidedTemporalWindow("Window A (2-8)",2,8,"A"),
+	Feature_KthLastOccurrence("3rd Last B/C",3,"B","C"),
+	Feature_2ndLastOccurrence("2nd Last A","A"),
+	Feature_Moment("Moment"),
+	Feature_Static("Age","Age"),
+]
+moments = grid_moments(examples,impending_c)
+features.append(Feature_Arbitrary("Arbitrary",[(x.example.id,x.moment) for x in moments],[random.random() for x in moments]))
+feature_matrix = build_feature_matrix(moments,features)
+
+tree = build_classification_tree(features,None,max_depth=6,random_seed=1,feature_matrix=feature_matrix)
+inf_tree = build_classification_tree(features,None,max_depth=6,random_seed=1,feature_matrix=feature_matrix,missing_values="inf")
+logreg_model = LogReg_Model(features[:7])
+logreg_model.train_batch(feature_matrix.select_rows(range(0,len(feature_matrix),2)),feature_matrix.select_rows(range(1,len(feature_matrix),2)),max_iterations=10)
+
+path = os.path.join(tempfile.mkdtemp(),"model")
+holiday = Feature_MonthDay("Holiday",{(1,1):1.0,(12,25):1.0})
+tables = feature_tables()
+tuple_ids = Feature_Arbitrary("Tuple Ids",[((1,2),5)],[1.0])
+bool_ids = Feature_Arbitrary("Bool Ids",[(True,5),(False,5)],[1.0,0.0])
+round_trip = [spec_feature(feature_spec(x,tables),tables) for x in features + [holiday,tuple_ids,bool_ids]]
+print "Specs round-trip: {0}".format(round_trip == features + [holiday,tuple_ids,bool_ids])
+print "Arbitrary values round-trip: {0}".format(round_trip[11].value_mapping == features[11].value_mapping and round_trip[13].value_mapping == tuple_ids.value_mapping and round_trip[14].value_mapping == bool_ids.value_mapping)
+for model in [tree,tree.compile(),inf_tree,inf_tree.compile(),logreg_model]:
+	save_model(model,path)
+	start = time.time()
+	loaded_model = load_model(path)
+	load_time = time.time()-start
+	print "{0}: {1} bytes (pickled: {2}), loaded in {3:.1f} ms".format(model.__class__.__name__,os.path.getsize(path),len(cPickle.dumps(model,2)),1000*load_time)
+	print "Smaller than pickled: {0}".format(os.path.getsize(path) < len(cPickle.dumps(model,2)))
+	print "Same predictions: {0}".format(all(loaded_model.query(x) == model.query(x) for x in moments))
+
+with open(path,"wb") as model_file:
+	model_file.write("not a model")
+try:
+	load_model(path)
+except ValueError:
+	print "Bad file rejected"
@@ -0,0 +1,39 @@
+import os
+import random
+import tempfile
+from moment_stream import *
+from logreg_learning import *
+from test_fixtures import *
+
+random.seed(1)
+
+examples = generate_test_examples()
+
+print Grid_Sampler(10).moments(examples[0])
+print Grid_Sampler(25,0,100).moments(examples[0])
+print ["{0:.2f}".format(x) for x in Random_Sampler(5,random_seed=3).moments(examples[0])]
+print Event_Sampler(["C"],(-2,0)).moments(examples[1])
+print Grid_Sampler(10).moments(Example("empty"))
+
+features = list(basic_features)
+impending_c = weighted_impending_c
+
+sampler = Grid_Sampler(5,0,100)
+chunk_sizes = [len(x) for x in stream_feature_matrices(examples,sampler,features,impending_c,chunk_size=300)]
+print chunk_sizes
+
+whole_matrix = build_feature_matrix(list(stream_moments(examples,sampler,impending_c)),features)
+matrix_path = os.path.join(tempfile.mkdtemp(),"matrix.csv")
+write_feature_matrices(stream_feature_matrices(examples,sampler,features,impending_c,chunk_size=300),matrix_path)
+read_rows = []
+for feature_matrix in read_feature_matrices(matrix_path,features,chunk_size=250):
+	read_rows += [(feature_matrix.row(i),feature_matrix.labels[i],feature_matrix.weights[i]) for i in range(len(feature_matrix))]
+print "Read back {0} rows, matching: {1}".format(len(read_rows),read_rows == [(whole_matrix.row(i),whole_matrix.labels[i],whole_matrix.weights[i]) for i in range(len(whole_matrix))])
+
+model = LogReg_Model(features)
+for i in range(20):
+	model.train_stream(read_feature_matrices(matrix_path,features,chunk_size=250),learning_rate=1.0,batch_size=50)
+print [(x.feature_name,model.feature_weights[x.feature_name][-1]) for x in features]
+print "Average error: {0}".format(model.compute_average_error(whole_matrix))
+
+os.remove(matrix_path)
@@ -0,0 +1,46 @@
+import random
+from online_scoring import *
+from moment_stream import *
+from test_fixtures import *
+
+random.seed(1)
+
+examples = generate_test_examples(durations=True)
+
+features = basic_features + [
+	Feature_TwoSidedTemporalWindow("Window A (2-8)",2,8,"A"),
+	Feature_KthLastOccurrence("3rd Last B/C",3,"B","C"),
+	Feature_Count("Count C","C"),
+	Feature_Static("Age","Age"),
+]
+feature_matrix = build_feature_matrix(grid_moments(examples,impending_c),features)
+
+tree = build_classification_tree(features,None,max_depth=4,random_seed=1,feature_matrix=feature_matrix)
+logreg_model = LogReg_Model(features[:4])
+logreg_model.train_batch(feature_matrix.select_rows(range(0,len(feature_matrix),2)),feature_matrix.select_rows(range(1,len(feature_matrix),2)),max_iterations=10)
+
+# events are replayed in start order, scoring after every fifth one and
+# comparing against querying the model on an Example of the events so far
+for model in [tree,logreg_model]:
+	scorer = Online_Scorer(model)
+	print "{0}: {1}".format(model.__class__.__name__,[x.feature_name for x in scorer.features])
+	matches = True
+	for example in examples[:10]:
+		scorer.add_static_value(example.id,"Age",example.static_values["Age"])
+		replayed_example = Example(example.id)
+		replayed_example.static_values = example.static_values
+		occurrences = sorted((start_time,end_time,event) for event in example.events for (start_time,end_time) in example.events[event])
+		for i in range(len(occurrences)):
+			(start_time,end_time,event) = occurrences[i]
+			scorer.add_event(example.id,event,start_time,end_time)
+			replayed_example.add_event(event,start_time,end_time)
+			if i % 5 == 4:
+				if scorer.score(example.id,start_time) != model.query(replayed_example.create_example_moment(start_time)):
+					matches = False
+	print "Matches model query: {0}".format(matches)
+	print ["{0:.4f}".format(scorer.score(x.id,100)) for x in examples[:5]]
+
+try:
+	scorer.add_event(examples[0].id,"A",50)
+except ValueError:
+	print "Out-of-order event rejected"
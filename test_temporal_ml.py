@@ -1,4 +1,5 @@
 
+import datetime
 from temporal_ml import *
 
 '''
@@ -75,3 +76,63 @@ tick_6 = example.create_example_moment(6)
 tick_7 = example.create_example_moment(7)
 tick_8 = example.create_example_moment(8)
 tick_9 = example.create_example_moment(9)
+
+# same A timeline added out of order, plus a B occurrence spanning ticks 2-5
+unsorted_example = Example("unsorted_example")
+for tick in [8,0,6,4]:
+	unsorted_example.add_event("A",tick)
+unsorted_example.add_event("B",2,5)
+unsorted_example.finalize()
+
+unsorted_tick_3 = unsorted_example.create_example_moment(3)
+unsorted_tick_7 = unsorted_example.create_example_moment(7)
+
+# whole-grid evaluation, one sweep per feature
+grid_last_a = last_a.query_grid(example,range(10))
+grid_intensity_b = salience_b.query_grid(example,range(10))
+grid_recent_freq_a = recent_freq_a.query_grid(example,range(10))
+grid_two_sided_window_a = two_sided_window_a.query_grid(example,range(10))
+
+# streaming intensity, fed the B events one at a time
+streaming_intensity_b = salience_b.create_accumulator()
+for tick in [1,4,5,8]:
+	salience_b.observe(streaming_intensity_b,"B",tick)
+streaming_intensity_b_at_9 = streaming_intensity_b.value(9)
+
+# queries through the opt-in cache; the normalized and inverted wrappers reuse
+# the cached Last A values
+cache = enable_query_cache(1000)
+for example_moment in [tick_0,tick_1,tick_2,tick_3,tick_4,tick_5,tick_6,tick_7,tick_8,tick_9]:
+	last_a.query(example_moment)
+	inverted_normalized_last_a.query(example_moment)
+cache_hit_rate = cache.hit_rate()
+# wrappers differing only in median share a name and type but not values
+normalized_last_a_2 = FeatureWrapper_Normalize_MaxSignalZero(last_a,2.0)
+normalized_last_a_8 = FeatureWrapper_Normalize_MaxSignalZero(last_a,8.0)
+cached_normalized_last_a_at_5 = (normalized_last_a_2.query(tick_5),normalized_last_a_8.query(tick_5)) # (1/(1+.5), 1/(1+.125))
+disable_query_cache()
+
+# dates and datetimes are converted to the current time unit as they arrive
+dated_example = Example("dated_example")
+dated_example.add_event("A",datetime.datetime(2020,1,1,6))
+dated_example.add_event("A",datetime.date(2020,1,3))
+dated_moment = dated_example.create_example_moment(datetime.datetime(2020,1,2,18))
+dated_last_a = last_a.query(dated_moment) # 1.5 days
+dated_freq_a = Feature_Frequency("Dated Freq A",datetime.date(2020,1,1),"A").query(dated_moment)
+dated_moment_display = display_time(dated_moment.time)
+
+set_time_unit(SECONDS)
+timed_example = Example("timed_example")
+timed_example.add_event("A",datetime.datetime(2020,1,1,6))
+timed_last_a = last_a.query(timed_example.create_example_moment(datetime.datetime(2020,1,1,7,0,30))) # 3630 seconds
+set_time_unit(DAYS)
+
+# counts over several events come from one merged timeline per event set
+merged_ab = example.merged_timeline(["A","B"])
+merged_ab_started_by_4 = merged_ab.count_started(4) # 4
+recent_freq_ab_at_5 = Feature_Recent_Frequency("Recent Freq A/B",2,"A","B").query(tick_5) # 3 occurrences in (3,5], over 2
+
+# k-th last occurrence over an event group, selected from the merged timeline
+third_last_ab = Feature_KthLastOccurrence("3rd Last A/B",3,"A","B")
+third_last_ab_at_6 = third_last_ab.query(tick_6) # A/B at 4,4,5,6: 3rd most recent is 4, 2 ago
+grid_third_last_ab = third_last_ab.query_grid(example,range(10))
@@ -39,4 +39,66 @@ for i in range(1,21):
 			feature_value = 1.0-feature_value
 		example.features[feature_name] = feature_value
 
-print build_classification_tree(features,examples,verbosity=1).tree_summary(max_depth=5)
\ No newline at end of file
+print build_classification_tree(features,examples,verbosity=1).tree_summary(max_depth=5)
+print build_classification_tree(features,examples,presort=True).tree_summary(max_depth=5)
+
+print build_classification_tree(features,examples,histogram_bins=16).tree_summary(max_depth=5)
+
+print build_classification_tree(features,examples,split_candidates=8,exact_split_instances=50).tree_summary(max_depth=5)
+
+print build_classification_tree(features,examples,random_seed=1,n_jobs=2).tree_summary(max_depth=5)
+
+print build_classification_tree(features,examples,random_seed=1,growth="depth_first").tree_summary(max_depth=5)
+print build_classification_tree(features,examples,random_seed=1,growth="best_first",max_leaves=6).tree_summary(max_depth=5)
+
+tree = build_classification_tree(features,examples,max_depth=5,random_seed=1)
+compiled_tree = tree.compile()
+feature_matrix = build_feature_matrix(examples,features)
+print "Compiled tree: {0} nodes, matches Tree_Node.query: {1}".format(compiled_tree.num_nodes(),compiled_tree.predict(feature_matrix) == [tree.query(x) for x in examples])
+
+# missing values (NaN) mostly on positives, and infinite values on negatives
+missing_features = [Simple_Feature("Mostly_Missing_If_Positive"),Simple_Feature("Infinite_If_Negative")]
+for example in examples:
+	if random.random() < (.8 if example.label == "+" else .1):
+		example.features["Mostly_Missing_If_Positive"] = float("nan")
+	else:
+		example.features["Mostly_Missing_If_Positive"] = random.random()
+	if example.label == "-" and random.random() < .7:
+		example.features["Infinite_If_Negative"] = float("inf")
+	else:
+		example.features["Infinite_If_Negative"] = random.random()
+missing_matrix = build_feature_matrix(examples,missing_features)
+for options in [dict(),dict(presort=True),dict(histogram_bins=16),dict(split_candidates=8,exact_split_instances=50)]:
+	tree = build_classification_tree(missing_features,None,max_depth=3,candidate_feature_proportion=1.0,feature_matrix=missing_matrix,**options)
+	compiled_tree = tree.compile()
+	print options
+	print tree.tree_summary()
+	print "Compiled tree matches Tree_Node.query: {0}".format(compiled_tree.predict(missing_matrix) == [tree.query(x) for x in examples] == [tree.query_row(missing_matrix,x) for x in range(len(examples))])
+
+# sketched splits do not depend on the order presort leaves instances in
+sketch_features = [Simple_Feature("Noisy_Signal"),Simple_Feature("Noise")]
+sketch_examples = []
+for i in range(2000):
+	sketch_example = Simple_Example(random.choice("+-"))
+	sketch_example.features["Noisy_Signal"] = random.gauss(1.0 if sketch_example.label == "+" else 0.0,1.0)
+	sketch_example.features["Noise"] = random.random()
+	sketch_examples.append(sketch_example)
+sketch_matrix = build_feature_matrix(sketch_examples,sketch_features)
+sketch_trees = [build_classification_tree(sketch_features,None,max_depth=4,candidate_feature_proportion=1.0,feature_matrix=sketch_matrix,split_candidates=4,exact_split_instances=100,presort=x) for x in [False,True]]
+print "Sketched trees match with and without presort: {0}".format(sketch_trees[0].tree_summary() == sketch_trees[1].tree_summary())
+
+# with +Inf counted as missing, "never happened" gets a learned direction
+inf_tree = build_classification_tree(missing_features,None,max_depth=3,candidate_feature_proportion=1.0,feature_matrix=missing_matrix,missing_values="inf")
+print inf_tree.tree_summary()
+print "Compiled tree matches Tree_Node.query: {0}".format(inf_tree.compile().predict(missing_matrix) == [inf_tree.query(x) for x in examples] == [inf_tree.query_row(missing_matrix,x) for x in range(len(examples))])
+print "Matrix left unchanged: {0}".format(float("inf") in missing_matrix.column(missing_features[1]))
+
+# a split at inf (present values left, missing right) survives pickling
+import cPickle
+inf_split_tree = Tree_Node()
+(inf_split_left,inf_split_right) = inf_split_tree.process_nonleaf(missing_features[1],float("inf"),False)
+inf_split_left.process_leaf(1.0,0.0)
+inf_split_right.process_leaf(0.0,1.0)
+infinite_example = Simple_Example("+")
+infinite_example.features["Infinite_If_Negative"] = float("inf")
+print "Inf split after pickling: {0}".format(cPickle.loads(cPickle.dumps(inf_split_tree,2)).query(infinite_example) == inf_split_tree.query(infinite_example) == 1.0)
@@ -1,11 +1,35 @@
 
+import array
+import bisect
+import collections
+import heapq
+import itertools
 import random
 import math
+import multiprocessing
+import multiprocessing.sharedctypes
+import sys
+import instrumentation
+from feature_matrix import *
 
 # epsilon value prevents splitting when splitting would only reduce entropy by
 # an amount explainable by rounding error
 ENTROPY_EPSILON = 0.001
 
+# nodes with at most this many instances search every threshold even when
+# build_classification_tree is given split_candidates
+EXACT_SPLIT_INSTANCES = 2000
+
+# instances sampled into a weighted quantile sketch per candidate threshold
+SKETCH_SAMPLES_PER_CANDIDATE = 16
+
+# rows are sampled into a sketch by multiplicative hashing of their indexes
+SKETCH_HASH_MULTIPLIER = 2654435761
+SKETCH_HASH_RANGE = 2**32
+
+INFINITY = float("inf")
+NAN = float("nan")
+
 class Tree_Node(object):
 
 	def __init__(self,path="X"):
@@ -19,10 +43,12 @@ class Tree_Node(object):
 		self.pos_weight = pos_weight
 		self.neg_weight = neg_weight
 	
-	def process_nonleaf(self,split_feature,split_value):
+	def process_nonleaf(self,split_feature,split_value,missing_left=False,inf_missing=False):
 		self.leaf = False
 		self.split_feature = split_feature
 		self.split_value = split_value
+		self.missing_left = missing_left
+		self.inf_missing = inf_missing
 		self.left_child = Tree_Node(self.path+"L")
 		self.right_child = Tree_Node(self.path+"R")
 		return (self.left_child,self.right_child)
@@ -42,30 +68,55 @@ class Tree_Node(object):
 		(pos_weight,neg_weight) = self.subtree_weight()
 		return pos_weight/(pos_weight+neg_weight)
 	
+	# values at or below the split value go left, and missing values (NaN, and
+	# +Inf if the tree was built with missing_values="inf") go the way chosen
+	# for them in training
+	def goes_left(self,value):
+		return value <= self.split_value or (self.missing_left and (value != value or (self.inf_missing and value == INFINITY)))
+	
+	# each split feature on the path is queried once
 	def query(self,query_instance,verbosity=0):
 		if self.leaf:
 			if verbosity >= 1:
 				print "{0}: {1}".format(self.path,self.prediction())
 			return self.prediction()
 		else:
-			if self.split_value == float("inf"):
-				if self.split_feature.query(query_instance) < float("inf"):
-					if verbosity >= 2:
-						print "{0} - {1}: Query {2} < {3}, LEFT".format(self.path,self.split_feature.feature_name,self.split_feature.query(query_instance),self.split_value)
-					return self.left_child.query(query_instance,verbosity)
-				else:
-					if verbosity >= 2:
-						print "{0} - {1}: Query {2} < {3}, RIGHT".format(self.path,self.split_feature.feature_name,self.split_feature.query(query_instance),self.split_value)
-					return self.right_child.query(query_instance,verbosity)
+			value = self.split_feature.query(query_instance)
+			if self.goes_left(value):
+				if verbosity >= 2:
+					print "{0} - {1}: Query {2} <= {3}, LEFT".format(self.path,self.split_feature.feature_name,value,self.split_value)
+				return self.left_child.query(query_instance,verbosity)
 			else:
-				if self.split_feature.query(query_instance) <= self.split_value:
-					if verbosity >= 2:
-						print "{0} - {1}: Query {2} <= {3}, LEFT".format(self.path,self.split_feature.feature_name,self.split_feature.query(query_instance),self.split_value)
-					return self.left_child.query(query_instance,verbosity)
-				else:
-					if verbosity >= 2:
-						print "{0} - {1}: Query {2} <= {3}, RIGHT".format(self.path,self.split_feature.feature_name,self.split_feature.query(query_instance),self.split_value)
-					return self.right_child.query(query_instance,verbosity)
+				if verbosity >= 2:
+					print "{0} - {1}: Query {2} <= {3}, RIGHT".format(self.path,self.split_feature.feature_name,value,self.split_value)
+				return self.right_child.query(query_instance,verbosity)
+	
+	# as query, but reading feature values from row row_index of feature_matrix
+	def query_row(self,feature_matrix,row_index):
+		node = self
+		while not node.leaf:
+			if node.goes_left(feature_matrix.column(node.split_feature)[row_index]):
+				node = node.left_child
+			else:
+				node = node.right_child
+		return node.prediction()
+	
+	# trees pickled before missing values were handled (those without
+	# missing_left) split "< inf" with a split value of inf, which is "<=" the
+	# largest finite float, and sent NaN right; newer trees can split at inf
+	# itself, sending every present value left and only missing values right
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		if state.get("leaf") == False:
+			if "missing_left" not in state:
+				if self.split_value == float("inf"):
+					self.split_value = sys.float_info.max
+				self.missing_left = False
+			if "inf_missing" not in state:
+				self.inf_missing = False
+	
+	def compile(self):
+		return Compiled_Tree(self)
 	
 	def tree_summary(self,max_depth=10):
 		if self.leaf:
@@ -74,135 +125,834 @@ class Tree_Node(object):
 			if self.depth() >= max_depth:
 				tree_text = "{0} | ...\n".format(self.path)
 				return tree_text
-			split_function_string = "<="
-			if self.split_value == float("inf"):
-				split_function_string = "<"
-			tree_text = "{0} | {1} {2} {3}\n".format(self.path,self.split_feature,split_function_string,self.split_value)
+			# the largest finite float splits off infinite values
+			split_text = "<= {0}".format(self.split_value)
+			if self.split_value == sys.float_info.max:
+				split_text = "< inf"
+			if self.missing_left and self.inf_missing:
+				split_text += " (missing or inf go left)"
+			elif self.missing_left:
+				split_text += " (missing go left)"
+			tree_text = "{0} | {1} {2}\n".format(self.path,self.split_feature,split_text)
 			tree_text += self.left_child.tree_summary(max_depth)
 			tree_text += self.right_child.tree_summary(max_depth)
 			return tree_text
 
+# a trained tree flattened into parallel arrays for fast inference, nodes
+# numbered depth-first from the root at 0; split_features holds the position
+# of each node's split feature in self.features (-1 at leaves), thresholds its
+# split value, left_children/right_children its children and leaf_values each
+# leaf's prediction; missing_left is 1 at nodes sending missing values (NaN)
+# left, and inf_missing 1 at nodes counting +Inf as missing
+# with tree None the arrays are left empty, to be filled in (see load_model)
+class Compiled_Tree(object):
+
+	def __init__(self,tree):
+		self.features = []
+		feature_positions = dict()
+		self.split_features = array.array("i")
+		self.thresholds = array.array("d")
+		self.left_children = array.array("i")
+		self.right_children = array.array("i")
+		self.leaf_values = array.array("d")
+		self.missing_left = array.array("b")
+		self.inf_missing = array.array("b")
+		if tree == None:
+			return
+		
+		nodes = []
+		node_indexes = dict()
+		worklist = [tree]
+		while worklist:
+			node = worklist.pop()
+			node_indexes[id(node)] = len(nodes)
+			nodes.append(node)
+			if not node.leaf:
+				worklist.append(node.right_child)
+				worklist.append(node.left_child)
+		
+		for node in nodes:
+			if node.leaf:
+				self.split_features.append(-1)
+				self.thresholds.append(0.0)
+				self.left_children.append(-1)
+				self.right_children.append(-1)
+				self.leaf_values.append(node.prediction())
+				self.missing_left.append(0)
+				self.inf_missing.append(0)
+			else:
+				if id(node.split_feature) not in feature_positions:
+					feature_positions[id(node.split_feature)] = len(self.features)
+					self.features.append(node.split_feature)
+				self.split_features.append(feature_positions[id(node.split_feature)])
+				self.thresholds.append(node.split_value)
+				self.left_children.append(node_indexes[id(node.left_child)])
+				self.right_children.append(node_indexes[id(node.right_child)])
+				self.leaf_values.append(0.0)
+				self.missing_left.append(int(node.missing_left))
+				self.inf_missing.append(int(node.inf_missing))
+	
+	def num_nodes(self):
+		return len(self.split_features)
+	
+	# values holds the values of self.features, in order
+	def query_values(self,values):
+		node = 0
+		while self.split_features[node] >= 0:
+			value = values[self.split_features[node]]
+			if value <= self.thresholds[node] or (self.missing_left[node] and (value != value or (self.inf_missing[node] and value == INFINITY))):
+				node = self.left_children[node]
+			else:
+				node = self.right_children[node]
+		return self.leaf_values[node]
+	
+	# each feature on the path is queried once
+	def query(self,query_instance):
+		node = 0
+		while self.split_features[node] >= 0:
+			value = self.features[self.split_features[node]].query(query_instance)
+			if value <= self.thresholds[node] or (self.missing_left[node] and (value != value or (self.inf_missing[node] and value == INFINITY))):
+				node = self.left_children[node]
+			else:
+				node = self.right_children[node]
+		return self.leaf_values[node]
+	
+	def query_row(self,feature_matrix,row_index):
+		node = 0
+		while self.split_features[node] >= 0:
+			value = feature_matrix.column(self.features[self.split_features[node]])[row_index]
+			if value <= self.thresholds[node] or (self.missing_left[node] and (value != value or (self.inf_missing[node] and value == INFINITY))):
+				node = self.left_children[node]
+			else:
+				node = self.right_children[node]
+		return self.leaf_values[node]
+	
+	# predictions for every row of feature_matrix; rows are pushed down the tree
+	# together, each node dividing its rows between its children in one pass
+	def predict(self,feature_matrix):
+		columns = [feature_matrix.column(x) for x in self.features]
+		predictions = [0.0]*len(feature_matrix)
+		worklist = [(0,range(len(feature_matrix)))]
+		while worklist:
+			(node,rows) = worklist.pop()
+			if self.split_features[node] < 0:
+				leaf_value = self.leaf_values[node]
+				for row in rows:
+					predictions[row] = leaf_value
+				continue
+			column = columns[self.split_features[node]]
+			threshold = self.thresholds[node]
+			if self.missing_left[node] and self.inf_missing[node]:
+				left_rows = [x for x in rows if column[x] <= threshold or column[x] != column[x] or column[x] == INFINITY]
+				right_rows = [x for x in rows if threshold < column[x] < INFINITY]
+			elif self.missing_left[node]:
+				left_rows = [x for x in rows if column[x] <= threshold or column[x] != column[x]]
+				right_rows = [x for x in rows if column[x] > threshold]
+			else:
+				left_rows = [x for x in rows if column[x] <= threshold]
+				right_rows = [x for x in rows if not column[x] <= threshold]
+			if left_rows:
+				worklist.append((self.left_children[node],left_rows))
+			if right_rows:
+				worklist.append((self.right_children[node],right_rows))
+		return predictions
+
 # verbosity levels:
 # 	1: print depth levels as they are reached
 # 	2: print node paths and weight amounts when they are constructed
 # 	3: print features as they are considered for splits
-def build_classification_tree(features,instances,max_depth=-1,candidate_feature_proportion=.2,minimum_node_weight=0.0,verbosity=0,random_seed=None):
+# feature values, labels and weights are read from feature_matrix, which is
+# built from the instances and features if not supplied (instances may then
+# be None)
+# split search modes:
+# 	default: each node sorts its instances by each candidate feature
+# 	presort: each feature's instances are sorted once up front, and every split
+# 	         partitions those sorted lists between the children, so no node sorts
+# 	histogram_bins: each feature is quantized into at most this many bins up
+# 	         front, and a node only totals its instances per bin and scans the
+# 	         bins; with no more distinct values than bins it considers the
+# 	         same thresholds as sorting
+# 	split_candidates: nodes with more than exact_split_instances instances only
+# 	         consider at most this many thresholds per feature, taken from a
+# 	         weighted quantile sketch of the node's instances (see
+# 	         best_sketched_split); smaller nodes search exactly, sorted or
+# 	         presorted as above (ignored with histogram_bins)
+# n_jobs > 1 scores each node's candidate features in that many worker
+# processes (see Split_Scorer); the tree is the same as with n_jobs=1
+# growth orders:
+# 	breadth_first: nodes are split level by level
+# 	depth_first: each node's left subtree is finished before its right one
+# 	best_first: the pending split that most reduces total weighted entropy is
+# 	         made next, so with max_leaves the tree keeps its most useful splits
+# max_leaves stops splitting once the tree has that many leaves
+# nodes do not hold their own instance lists: each node's instances are a range
+# of one shared array of instance indexes (and with presort, the same range of
+# each feature's sorted array), rearranged in place as nodes split, so memory
+# stays proportional to the number of instances whatever the tree's shape
+# every node is scored as soon as it is created, which for breadth_first draws
+# random numbers in the same order as processing nodes level by level
+# missing feature values (NaN) sort after all others; every candidate split
+# tries sending a node's missing values left and right and keeps the better,
+# and the node sends missing values that way at query time (see Tree_Node);
+# missing values:
+# 	nan: infinite values are ordinary values, so features that are Inf when an
+# 	     event never happened split them off with a finite threshold
+# 	inf: +Inf is missing too, so "never happened" gets its own learned
+# 	     direction at every split rather than always going right
+def build_classification_tree(features,instances,max_depth=-1,candidate_feature_proportion=.2,minimum_node_weight=0.0,verbosity=0,random_seed=None,feature_matrix=None,presort=False,histogram_bins=None,n_jobs=1,split_candidates=None,exact_split_instances=EXACT_SPLIT_INSTANCES,growth="breadth_first",max_leaves=None,missing_values="nan"):
+	
+	if growth not in ("breadth_first","depth_first","best_first"):
+		raise ValueError("unknown growth order {0}".format(growth))
+	if missing_values not in ("nan","inf"):
+		raise ValueError("unknown missing values {0}".format(missing_values))
 	
 	if random_seed != None:
 		random.seed(random_seed)
-		
 	
-	root_node = Tree_Node()
-	worklist = [(root_node,instances)]
+	if feature_matrix == None:
+		feature_matrix = build_feature_matrix(instances,features)
+	inf_missing = missing_values == "inf"
+	if inf_missing:
+		feature_matrix = Feature_Matrix(feature_matrix.features,[inf_as_nan(x) for x in feature_matrix.columns],feature_matrix.labels,feature_matrix.weights)
+	labels = feature_matrix.labels
+	weights = feature_matrix.weights
+	num_rows = len(feature_matrix)
 	
-	max_depth_reached = 0
+	histograms = None
+	if histogram_bins != None:
+		histograms = dict()
+		for feature in features:
+			histograms[id(feature)] = Feature_Histogram(feature_matrix.column(feature),histogram_bins)
 	
-	while worklist:
-		
-		(current_node, current_instances) = worklist.pop(0)
-				
-		if verbosity >= 1 and current_node.depth() > max_depth_reached:
-			max_depth_reached = current_node.depth()
-			print "Building depth {0}...".format(current_node.depth())
+	missing_features = set([id(x) for x in features if has_missing_values(feature_matrix.column(x))])
+	
+	instance_order = array.array("i",range(num_rows))
+	presorted_instances = None
+	in_left_child = None
+	if presort and histograms == None:
+		presorted_instances = dict()
+		for feature in features:
+			presorted_instances[id(feature)] = array.array("i",sorted_by_value(range(num_rows),feature_matrix.column(feature),id(feature) in missing_features))
+		in_left_child = bytearray(num_rows)
+	
+	num_candidate_features = min(len(features),int(1+candidate_feature_proportion*len(features)))
+	if histograms != None:
+		split_candidates = None
+	split_scorer = Split_Scorer(features,feature_matrix,histograms,n_jobs,num_candidate_features,split_candidates,exact_split_instances,missing_features)
+	
+	# makes the node whose instances are instance_order[start:end] a leaf if it
+	# cannot or should not split, returning None; otherwise rearranges its range
+	# (and presorted ranges) for its best split, returned as (split feature,split
+	# value,whether missing values go left,end of the left child's range,entropy
+	# reduction,pos_weight,neg_weight,left weight,right weight,node timings)
+	def find_split(current_node,start,end,can_split):
 		
+		current_instances = instance_order[start:end]
 		pos_weight = 0.0
 		neg_weight = 0.0
-		for instance in current_instances:
-			if instance.label == "+":
-				pos_weight += instance.weight
+		for row in current_instances:
+			if labels[row] == POSITIVE:
+				pos_weight += weights[row]
 			else:
-				neg_weight += instance.weight
+				neg_weight += weights[row]
 		
 		if verbosity >= 2:
 			print "Building node {0}, +{1}, -{2}...".format(current_node.path,pos_weight,neg_weight)
 		
-		# leaf because max depth? process and continue
-		if current_node.depth() == max_depth:
+		# leaf because max depth or max leaves? process and return
+		if current_node.depth() == max_depth or not can_split:
 			if verbosity >= 2:
-				print "{0}: Leaf node, max depth reached".format(current_node.path)
+				if current_node.depth() == max_depth:
+					print "{0}: Leaf node, max depth reached".format(current_node.path)
+				else:
+					print "{0}: Leaf node, max leaves reached".format(current_node.path)
 			current_node.process_leaf(pos_weight,neg_weight)
-			continue
+			return None
 		
-		num_candidate_features = min(len(features),int(1+candidate_feature_proportion*len(features)))
 		candidate_features = random.sample(features,num_candidate_features)
 		
-		best_split_entropy = entropy(pos_weight,neg_weight) - ENTROPY_EPSILON
+		node_entropy = entropy(pos_weight,neg_weight)
+		best_split_entropy = node_entropy - ENTROPY_EPSILON
 		best_split_feature = None
 		
+		if verbosity >= 3:
+			for candidate_feature_index in range(len(candidate_features)):
+				print "{0}: Evaluating feature {1}/{2}: {3}".format(current_node.path,candidate_feature_index+1,len(candidate_features),candidate_features[candidate_feature_index])
+		
+		current_presorted_instances = None
+		if presorted_instances != None:
+			current_presorted_instances = dict()
+			for feature in candidate_features:
+				current_presorted_instances[id(feature)] = presorted_instances[id(feature)][start:end]
+		
+		recorder = instrumentation.recorder
+		node_timings = None
+		if recorder != None:
+			(sort_seconds,scan_seconds,score_start) = (recorder.seconds.get("tree/sort",0.0),recorder.seconds.get("tree/scan",0.0),instrumentation.clock())
+		candidate_splits = split_scorer.score(candidate_features,current_instances,current_presorted_instances,pos_weight,neg_weight)
+		if recorder != None:
+			node_timings = {"score_seconds":instrumentation.clock()-score_start,"sort_seconds":recorder.seconds.get("tree/sort",0.0)-sort_seconds,"scan_seconds":recorder.seconds.get("tree/scan",0.0)-scan_seconds}
 		for candidate_feature_index in range(len(candidate_features)):
+			split = candidate_splits[candidate_feature_index]
+			if split != None and split[0] < best_split_entropy:
+				(best_split_entropy,best_split_value,best_split_position,best_split_missing_left) = split
+				best_split_feature = candidate_features[candidate_feature_index]
 		
-			candidate_feature = candidate_features[candidate_feature_index]
-			
-			if verbosity >= 3:
-				print "{0}: Evaluating feature {1}/{2}: {3}".format(current_node.path,candidate_feature_index+1,len(candidate_features),candidate_feature)
-			
-			pos_left_weight = 0.0
-			neg_left_weight = 0.0
-			pos_right_weight = pos_weight
-			neg_right_weight = neg_weight
-			
-			sorted_instances = sorted(current_instances,key=lambda x: candidate_feature.query(x))
-			si_index = 0
-			while si_index < len(sorted_instances):
-			
-				next_value = candidate_feature.query(sorted_instances[si_index])
-				if sorted_instances[si_index].label == "+":
-					pos_right_weight -= sorted_instances[si_index].weight
-					pos_left_weight += sorted_instances[si_index].weight
-				else:
-					neg_right_weight -= sorted_instances[si_index].weight
-					neg_left_weight += sorted_instances[si_index].weight
-				si_index += 1
-				
-				# include any additional batch elements
-				while si_index < len(sorted_instances) and candidate_feature.query(sorted_instances[si_index]) == next_value:
-					if sorted_instances[si_index].label == "+":
-						pos_right_weight -= sorted_instances[si_index].weight
-						pos_left_weight += sorted_instances[si_index].weight
-					else:
-						neg_right_weight -= sorted_instances[si_index].weight
-						neg_left_weight += sorted_instances[si_index].weight
-					si_index += 1
-				
-				# check to make sure we haven't put everything in left
-				if si_index < len(sorted_instances):
-					new_entropy = weighted_entropy(pos_left_weight,neg_left_weight,pos_right_weight,neg_right_weight)
-					if new_entropy < best_split_entropy:
-						best_split_entropy = new_entropy
-						best_split_feature = candidate_feature
-						# BUG HERE!!!!!!!!!
-						# IF THE RIGHT-HAND VALUE IS INFINITE THIS IS HOSED
-						best_split_value = mean([next_value,candidate_feature.query(sorted_instances[si_index])])
-						best_split_left_instances = sorted_instances[:si_index]
-						best_split_right_instances = sorted_instances[si_index:]
-		
-		
-		# leaf because no split? process and continue
+		# leaf because no split? process and return
 		if best_split_feature == None:
 			if verbosity >= 2:
 				print "{0}: Leaf node, no split reduces entropy".format(current_node.path)
 			current_node.process_leaf(pos_weight,neg_weight)
-			continue
+			if recorder != None:
+				record_tree_node(recorder,current_node,end-start,node_timings)
+			return None
+		
+		if recorder != None:
+			partition_start = instrumentation.clock()
+		split_end = split_scorer.partition(best_split_feature,best_split_position,best_split_missing_left,instance_order,start,end,current_presorted_instances)
 		
-		# leaf because split creates small children? process and continue
-		best_split_left_weight = sum([x.weight for x in best_split_left_instances])
-		best_split_right_weight = sum([x.weight for x in best_split_right_instances])
+		# leaf because split creates small children? process and return
+		best_split_left_weight = sum([weights[x] for x in instance_order[start:split_end]])
+		best_split_right_weight = sum([weights[x] for x in instance_order[split_end:end]])
 		if best_split_left_weight < minimum_node_weight or best_split_right_weight < minimum_node_weight:
 			if verbosity >= 2:
 				print "{0}: Leaf node, best split creates overly light child nodes".format(current_node.path)
 			current_node.process_leaf(pos_weight,neg_weight)
-			continue
+			if recorder != None:
+				node_timings["partition_seconds"] = instrumentation.clock()-partition_start
+				record_tree_node(recorder,current_node,end-start,node_timings)
+			return None
 		
-		# otherwise nonleaf
-		if verbosity >= 2:
-			print "{0}: Split {1}|{2}, feature {3} <= {4}".format(current_node.path,best_split_left_weight,best_split_right_weight,best_split_feature.feature_name,best_split_value)
-		current_node.process_nonleaf(best_split_feature,best_split_value)
+		if presorted_instances != None:
+			partition_presorted(presorted_instances,start,end,instance_order[start:split_end],in_left_child)
+		if recorder != None:
+			node_timings["partition_seconds"] = instrumentation.clock()-partition_start
+		
+		split_gain = (pos_weight+neg_weight)*(node_entropy-best_split_entropy)
+		return (best_split_feature,best_split_value,best_split_missing_left,split_end,split_gain,pos_weight,neg_weight,best_split_left_weight,best_split_right_weight,node_timings)
+	
+	# scored nodes waiting to split, as (node,start,end,split): a queue for
+	# breadth_first, a stack for depth_first and a heap on entropy reduction
+	# (ties broken by creation order) for best_first
+	if growth == "best_first":
+		pending_nodes = []
+	else:
+		pending_nodes = collections.deque()
+	node_sequence = itertools.count()
+	def add_pending_node(node,start,end,split):
+		if growth == "best_first":
+			heapq.heappush(pending_nodes,(-split[4],next(node_sequence),node,start,end,split))
+		else:
+			pending_nodes.append((node,start,end,split))
+	
+	root_node = Tree_Node()
+	num_leaves = 1
+	max_depth_reached = 0
+	
+	try:
+		root_split = find_split(root_node,0,num_rows,max_leaves == None or max_leaves > 1)
+		if root_split != None:
+			add_pending_node(root_node,0,num_rows,root_split)
 		
-		worklist.append((current_node.left_child,best_split_left_instances))
-		worklist.append((current_node.right_child,best_split_right_instances))
+		while pending_nodes:
+			
+			if growth == "breadth_first":
+				(current_node,start,end,split) = pending_nodes.popleft()
+			elif growth == "depth_first":
+				(current_node,start,end,split) = pending_nodes.pop()
+			else:
+				(current_node,start,end,split) = heapq.heappop(pending_nodes)[2:]
+			(split_feature,split_value,missing_left,split_end,split_gain,pos_weight,neg_weight,left_weight,right_weight,node_timings) = split
+			
+			recorder = instrumentation.recorder
+			
+			# leaf because the tree has max leaves? process and continue
+			if max_leaves != None and num_leaves >= max_leaves:
+				if verbosity >= 2:
+					print "{0}: Leaf node, max leaves reached".format(current_node.path)
+				current_node.process_leaf(pos_weight,neg_weight)
+				if recorder != None and node_timings != None:
+					record_tree_node(recorder,current_node,end-start,node_timings)
+				continue
+			
+			# otherwise nonleaf
+			if verbosity >= 2:
+				print "{0}: Split {1}|{2}, feature {3} <= {4}".format(current_node.path,left_weight,right_weight,split_feature.feature_name,split_value)
+			current_node.process_nonleaf(split_feature,split_value,missing_left,inf_missing)
+			num_leaves += 1
+			if recorder != None and node_timings != None:
+				record_tree_node(recorder,current_node,end-start,node_timings)
+			
+			if verbosity >= 1 and current_node.depth()+1 > max_depth_reached:
+				max_depth_reached = current_node.depth()+1
+				print "Building depth {0}...".format(max_depth_reached)
+			
+			can_split = max_leaves == None or num_leaves < max_leaves
+			children = [(current_node.left_child,start,split_end),(current_node.right_child,split_end,end)]
+			child_splits = [find_split(child,child_start,child_end,can_split) for (child,child_start,child_end) in children]
+			# the left child goes on top of a depth_first stack
+			if growth == "depth_first":
+				children.reverse()
+				child_splits.reverse()
+			for ((child,child_start,child_end),child_split) in zip(children,child_splits):
+				if child_split != None:
+					add_pending_node(child,child_start,child_end,child_split)
+	finally:
+		split_scorer.close()
 
 	return root_node
 
+# one "tree_node" record per node whose splits were scored: score_seconds is
+# the whole scoring step, of which sort_seconds and scan_seconds were spent
+# sorting instances and scanning them for splits in this process (so neither
+# is counted when workers do the scoring), and partition_seconds is the time
+# spent dividing the instances between the children
+def record_tree_node(recorder,node,num_instances,node_timings):
+	recorder.add_time("tree/score",node_timings["score_seconds"])
+	if "partition_seconds" in node_timings:
+		recorder.add_time("tree/partition",node_timings["partition_seconds"])
+	recorder.add_record("tree_node",path=node.path,depth=node.depth(),instances=num_instances,leaf=node.leaf,**node_timings)
+
+# nodes with fewer instances than this are scored in-process even when
+# n_jobs > 1, since handing them to workers costs more than it saves
+PARALLEL_MIN_INSTANCES = 5000
+
+# finds each candidate feature's best split for a node; returns one
+# (entropy,split value,split position,whether missing values go left) tuple or
+# None per candidate, where split position is the number of sorted instances
+# with values going left, or for histograms the last bin going left
+# missing_features holds the ids of the features with missing values (NaN)
+# anywhere; histograms and presorted instances are also keyed by feature id,
+# as features that differ only in parameters can be equal (see Feature_Matrix)
+# nodes with more than exact_split_instances instances are scored with
+# best_sketched_split when split_candidates is given
+# with n_jobs > 1, large nodes are scored by a pool of worker processes that
+# read feature values, labels, weights and the node's instances from shared
+# memory set up once here, so each task sends only a few numbers each way;
+# workers draw no random numbers, so results do not depend on n_jobs
+class Split_Scorer(object):
+
+	def __init__(self,features,feature_matrix,histograms=None,n_jobs=1,num_candidate_features=1,split_candidates=None,exact_split_instances=EXACT_SPLIT_INSTANCES,missing_features=frozenset()):
+		self.feature_matrix = feature_matrix
+		self.histograms = histograms
+		self.missing_features = missing_features
+		self.split_candidates = split_candidates
+		self.exact_split_instances = exact_split_instances
+		self.pool = None
+		if n_jobs <= 1:
+			return
+		
+		self.feature_positions = dict()
+		for i in range(len(features)):
+			self.feature_positions[id(features[i])] = i
+		columns = [multiprocessing.sharedctypes.RawArray("d",feature_matrix.column(x)) for x in features]
+		labels = multiprocessing.sharedctypes.RawArray("b",feature_matrix.labels)
+		weights = multiprocessing.sharedctypes.RawArray("d",feature_matrix.weights)
+		shared_histograms = None
+		if histograms != None:
+			shared_histograms = []
+			for feature in features:
+				histograms[id(feature)].bins = multiprocessing.sharedctypes.RawArray("i",histograms[id(feature)].bins)
+				shared_histograms.append(histograms[id(feature)])
+		# one region of num_rows instance indexes per candidate feature, so that
+		# presorted lists for every candidate can be handed over at once
+		self.num_rows = len(feature_matrix)
+		self.rows = multiprocessing.sharedctypes.RawArray("i",self.num_rows*num_candidate_features)
+		self.pool = multiprocessing.Pool(n_jobs,init_split_worker,(columns,labels,weights,shared_histograms,self.rows))
+	
+	def score(self,candidate_features,instances,presorted_instances,pos_weight,neg_weight):
+		split_candidates = None
+		if len(instances) > self.exact_split_instances:
+			split_candidates = self.split_candidates
+		if self.pool == None or len(instances) < PARALLEL_MIN_INSTANCES:
+			candidate_splits = []
+			for feature in candidate_features:
+				histogram = None
+				if self.histograms != None:
+					histogram = self.histograms[id(feature)]
+				feature_instances = instances
+				if presorted_instances != None:
+					feature_instances = presorted_instances[id(feature)]
+				candidate_splits.append(score_candidate(self.feature_matrix.column(feature),histogram,feature_instances,presorted_instances != None,self.feature_matrix.labels,self.feature_matrix.weights,pos_weight,neg_weight,split_candidates,id(feature) in self.missing_features))
+			return candidate_splits
+		
+		tasks = []
+		if presorted_instances != None:
+			for i in range(len(candidate_features)):
+				offset = i*self.num_rows
+				self.rows[offset:offset+len(instances)] = presorted_instances[id(candidate_features[i])]
+				tasks.append((self.feature_positions[id(candidate_features[i])],offset,len(instances),True,pos_weight,neg_weight,split_candidates,id(candidate_features[i]) in self.missing_features))
+		else:
+			self.rows[0:len(instances)] = instances
+			for feature in candidate_features:
+				tasks.append((self.feature_positions[id(feature)],0,len(instances),False,pos_weight,neg_weight,split_candidates,id(feature) in self.missing_features))
+		return self.pool.map(score_shared_candidate,tasks,1)
+	
+	# rearranges instance_order[start:end] so that the instances going left for
+	# a split found by score come first, returning where they end; sketched
+	# splits give the number of instances going left, so they are divided as
+	# exact ones are; instances with missing values, which sort last, are moved
+	# up behind the others going left when the split sends them left
+	def partition(self,feature,split_position,missing_left,instance_order,start,end,presorted_instances):
+		if self.histograms != None:
+			bins = self.histograms[id(feature)].bins
+			missing_bin = self.histograms[id(feature)].missing_bin
+			instances = instance_order[start:end]
+			if missing_left:
+				left_instances = [x for x in instances if bins[x] <= split_position or bins[x] == missing_bin]
+				right_instances = [x for x in instances if split_position < bins[x] < missing_bin]
+			else:
+				left_instances = [x for x in instances if bins[x] <= split_position]
+				right_instances = [x for x in instances if bins[x] > split_position]
+			instance_order[start:end] = array.array("i",left_instances + right_instances)
+			return start + len(left_instances)
+		column = self.feature_matrix.column(feature)
+		if presorted_instances != None:
+			sorted_instances = presorted_instances[id(feature)]
+		else:
+			sorted_instances = array.array("i",sorted_by_value(instance_order[start:end],column,id(feature) in self.missing_features))
+		if missing_left:
+			num_present = len(sorted_instances) - count_missing_tail(sorted_instances,column)
+			sorted_instances = sorted_instances[:split_position] + sorted_instances[num_present:] + sorted_instances[split_position:num_present]
+			split_position += len(sorted_instances) - num_present
+		instance_order[start:end] = sorted_instances
+		return start + split_position
+	
+	def close(self):
+		if self.pool != None:
+			self.pool.terminate()
+			self.pool.join()
+			self.pool = None
+
+# with instrumentation enabled, sorting and scanning times are added to the
+# "tree/sort" and "tree/scan" totals
+def score_candidate(column,histogram,instances,is_sorted,labels,weights,pos_weight,neg_weight,split_candidates=None,has_missing=False):
+	recorder = instrumentation.recorder
+	if recorder != None:
+		start = instrumentation.clock()
+	if histogram != None:
+		split = histogram.best_split(instances,labels,weights,pos_weight,neg_weight)
+	elif split_candidates != None:
+		split = best_sketched_split(instances,column,labels,weights,pos_weight,neg_weight,split_candidates)
+	else:
+		if not is_sorted:
+			instances = sorted_by_value(instances,column,has_missing)
+			if recorder != None:
+				sorted_time = instrumentation.clock()
+				recorder.add_time("tree/sort",sorted_time-start)
+				start = sorted_time
+		split = best_sorted_split(instances,column,labels,weights,pos_weight,neg_weight)
+	if recorder != None:
+		recorder.add_time("tree/scan",instrumentation.clock()-start)
+	return split
+
+# shared data for Split_Scorer's worker processes, set when each worker starts
+split_worker_data = None
+
+def init_split_worker(columns,labels,weights,histograms,rows):
+	global split_worker_data
+	split_worker_data = (columns,labels,weights,histograms,rows)
+
+def score_shared_candidate(task):
+	(feature_position,offset,length,is_sorted,pos_weight,neg_weight,split_candidates,has_missing) = task
+	(columns,labels,weights,histograms,rows) = split_worker_data
+	histogram = None
+	if histograms != None:
+		histogram = histograms[feature_position]
+	return score_candidate(columns[feature_position],histogram,rows[offset:offset+length],is_sorted,labels,weights,pos_weight,neg_weight,split_candidates,has_missing)
+
+# scans instances in ascending order of column value, returning the lowest
+# weighted entropy split as (entropy,split value,number of instances going
+# left,whether missing values go left), or None if every instance has the
+# same value; instances with missing values come last (see sorted_by_value)
+# and are totalled first, so that each threshold can try them on either side,
+# and sending every other instance left and only them right is a split too
+def best_sorted_split(sorted_instances,column,labels,weights,pos_weight,neg_weight):
+	
+	best_split = None
+	
+	num_present = len(sorted_instances) - count_missing_tail(sorted_instances,column)
+	pos_missing_weight = 0.0
+	neg_missing_weight = 0.0
+	for row in sorted_instances[num_present:]:
+		if labels[row] == POSITIVE:
+			pos_missing_weight += weights[row]
+		else:
+			neg_missing_weight += weights[row]
+	
+	pos_left_weight = 0.0
+	neg_left_weight = 0.0
+	pos_right_weight = pos_weight
+	neg_right_weight = neg_weight
+	
+	si_index = 0
+	while si_index < num_present:
+	
+		next_value = column[sorted_instances[si_index]]
+		if labels[sorted_instances[si_index]] == POSITIVE:
+			pos_right_weight -= weights[sorted_instances[si_index]]
+			pos_left_weight += weights[sorted_instances[si_index]]
+		else:
+			neg_right_weight -= weights[sorted_instances[si_index]]
+			neg_left_weight += weights[sorted_instances[si_index]]
+		si_index += 1
+		
+		# include any additional batch elements
+		while si_index < num_present and column[sorted_instances[si_index]] == next_value:
+			if labels[sorted_instances[si_index]] == POSITIVE:
+				pos_right_weight -= weights[sorted_instances[si_index]]
+				pos_left_weight += weights[sorted_instances[si_index]]
+			else:
+				neg_right_weight -= weights[sorted_instances[si_index]]
+				neg_left_weight += weights[sorted_instances[si_index]]
+			si_index += 1
+		
+		# check to make sure we haven't put everything in left
+		if si_index < len(sorted_instances):
+			new_entropy = weighted_entropy(pos_left_weight,neg_left_weight,pos_right_weight,neg_right_weight)
+			missing_left = False
+			if num_present < len(sorted_instances) and si_index < num_present:
+				missing_left_entropy = weighted_entropy(pos_left_weight+pos_missing_weight,neg_left_weight+neg_missing_weight,pos_right_weight-pos_missing_weight,neg_right_weight-neg_missing_weight)
+				if missing_left_entropy < new_entropy:
+					(new_entropy,missing_left) = (missing_left_entropy,True)
+			if best_split == None or new_entropy < best_split[0]:
+				if si_index < num_present:
+					split_value = split_threshold(next_value,column[sorted_instances[si_index]])
+				else:
+					split_value = next_value
+				best_split = (new_entropy,split_value,si_index,missing_left)
+	
+	return best_split
+
+# as best_sorted_split, but only thresholds between the buckets cut by
+# weighted_quantile_sketch are considered, so a node needs no sort and computes
+# at most num_candidates entropies per feature however many distinct values
+# it has; instances (in any order) are totalled per bucket, and a split still
+# falls midway between the largest value going left and the smallest going
+# right, with the number of instances going left as its position; missing
+# values are totalled apart and tried on either side, as in best_sorted_split
+def best_sketched_split(instances,column,labels,weights,pos_weight,neg_weight,num_candidates):
+	
+	cut_values = weighted_quantile_sketch(instances,column,weights,num_candidates)
+	num_buckets = len(cut_values)+1
+	bucket_counts = [0]*num_buckets
+	bucket_pos_weights = [0.0]*num_buckets
+	bucket_neg_weights = [0.0]*num_buckets
+	bucket_min = [float("inf")]*num_buckets
+	bucket_max = [float("-inf")]*num_buckets
+	num_missing = 0
+	pos_missing_weight = 0.0
+	neg_missing_weight = 0.0
+	for row in instances:
+		value = column[row]
+		if value != value:
+			num_missing += 1
+			if labels[row] == POSITIVE:
+				pos_missing_weight += weights[row]
+			else:
+				neg_missing_weight += weights[row]
+			continue
+		bucket = bisect.bisect_left(cut_values,value)
+		bucket_counts[bucket] += 1
+		if labels[row] == POSITIVE:
+			bucket_pos_weights[bucket] += weights[row]
+		else:
+			bucket_neg_weights[bucket] += weights[row]
+		if value < bucket_min[bucket]:
+			bucket_min[bucket] = value
+		if value > bucket_max[bucket]:
+			bucket_max[bucket] = value
+	
+	occupied_buckets = [x for x in range(num_buckets) if bucket_counts[x] > 0]
+	
+	best_split = None
+	pos_left_weight = 0.0
+	neg_left_weight = 0.0
+	pos_right_weight = pos_weight
+	neg_right_weight = neg_weight
+	left_count = 0
+	num_splits = len(occupied_buckets)-1
+	if num_missing > 0:
+		num_splits += 1
+	for i in range(num_splits):
+		bucket = occupied_buckets[i]
+		pos_right_weight -= bucket_pos_weights[bucket]
+		pos_left_weight += bucket_pos_weights[bucket]
+		neg_right_weight -= bucket_neg_weights[bucket]
+		neg_left_weight += bucket_neg_weights[bucket]
+		left_count += bucket_counts[bucket]
+		new_entropy = weighted_entropy(pos_left_weight,neg_left_weight,pos_right_weight,neg_right_weight)
+		missing_left = False
+		if num_missing > 0 and i < len(occupied_buckets)-1:
+			missing_left_entropy = weighted_entropy(pos_left_weight+pos_missing_weight,neg_left_weight+neg_missing_weight,pos_right_weight-pos_missing_weight,neg_right_weight-neg_missing_weight)
+			if missing_left_entropy < new_entropy:
+				(new_entropy,missing_left) = (missing_left_entropy,True)
+		if best_split == None or new_entropy < best_split[0]:
+			if i < len(occupied_buckets)-1:
+				split_value = split_threshold(bucket_max[bucket],bucket_min[occupied_buckets[i+1]])
+			else:
+				split_value = bucket_max[bucket]
+			best_split = (new_entropy,split_value,left_count,missing_left)
+	return best_split
+
+# up to max_cuts ascending values cutting instances into buckets of roughly
+# equal instance weight (a bucket holds the values above the previous cut, up
+# to and including its own), estimated from a sample of about
+# SKETCH_SAMPLES_PER_CANDIDATE per cut; instances with no weight at all are
+# counted equally, and missing values are left out
+# the sample is chosen by hashing row indexes, not by position, so the cuts
+# depend only on which instances a node has and not on their order (which
+# differs with presort)
+def weighted_quantile_sketch(instances,column,weights,max_cuts):
+	stride = max(1,len(instances)//(SKETCH_SAMPLES_PER_CANDIDATE*max_cuts))
+	sample_limit = SKETCH_HASH_RANGE//stride
+	sample = sorted((column[x],weights[x]) for x in instances if x*SKETCH_HASH_MULTIPLIER % SKETCH_HASH_RANGE < sample_limit and column[x] == column[x])
+	total_weight = sum(x[1] for x in sample)
+	if total_weight <= 0.0:
+		sample = [(x[0],1.0) for x in sample]
+		total_weight = float(len(sample))
+	
+	cut_values = []
+	cumulative_weight = 0.0
+	next_cut = 1
+	for (value,weight) in sample:
+		cumulative_weight += weight
+		if next_cut <= max_cuts and cumulative_weight >= next_cut*total_weight/(max_cuts+1):
+			if len(cut_values) == 0 or value > cut_values[-1]:
+				cut_values.append(value)
+			while next_cut <= max_cuts and cumulative_weight >= next_cut*total_weight/(max_cuts+1):
+				next_cut += 1
+	return cut_values
+
+# divides the range [start,end) of each feature's sorted instance array into
+# the node's left_instances followed by the rest, each keeping its sort order;
+# in_left_child is scratch space, all zeros between calls
+def partition_presorted(presorted_instances,start,end,left_instances,in_left_child):
+	for row in left_instances:
+		in_left_child[row] = 1
+	for sorted_instances in presorted_instances.values():
+		node_instances = sorted_instances[start:end]
+		sorted_instances[start:end] = array.array("i",filter(in_left_child.__getitem__,node_instances) + list(itertools.ifilterfalse(in_left_child.__getitem__,node_instances)))
+	for row in left_instances:
+		in_left_child[row] = 0
+
+# one feature's values quantized into at most max_bins bins of roughly equal
+# instance counts; bin_max and bin_min hold the largest and smallest value
+# falling in each bin, so a split between bins still thresholds raw values
+# missing values (NaN) fall in an extra bin, missing_bin, after the others
+class Feature_Histogram(object):
+
+	def __init__(self,column,max_bins):
+		present_values = column
+		if has_missing_values(column):
+			present_values = [x for x in column if x == x]
+		distinct_values = sorted(set(present_values))
+		if len(distinct_values) <= max_bins:
+			self.bin_max = distinct_values
+		else:
+			sorted_values = sorted(present_values)
+			quantile_values = [sorted_values[(i*len(sorted_values))//max_bins - 1] for i in range(1,max_bins+1)]
+			self.bin_max = sorted(set(quantile_values))
+		self.bin_min = []
+		for i in range(len(self.bin_max)):
+			if i == 0:
+				self.bin_min.append(distinct_values[0])
+			else:
+				self.bin_min.append(distinct_values[bisect.bisect_right(distinct_values,self.bin_max[i-1])])
+		self.missing_bin = len(self.bin_max)
+		self.bins = array.array("i",[bisect.bisect_left(self.bin_max,x) if x == x else self.missing_bin for x in column])
+	
+	def num_bins(self):
+		return len(self.bin_max)
+	
+	# as best_sorted_split, but instances are totalled per bin rather than
+	# sorted; returns (entropy,split value,last bin going left,whether missing
+	# values go left) or None
+	def best_split(self,instances,labels,weights,pos_weight,neg_weight):
+		bin_counts = [0]*(self.num_bins()+1)
+		bin_pos_weights = [0.0]*(self.num_bins()+1)
+		bin_neg_weights = [0.0]*(self.num_bins()+1)
+		for row in instances:
+			instance_bin = self.bins[row]
+			bin_counts[instance_bin] += 1
+			if labels[row] == POSITIVE:
+				bin_pos_weights[instance_bin] += weights[row]
+			else:
+				bin_neg_weights[instance_bin] += weights[row]
+		
+		occupied_bins = [x for x in range(self.num_bins()) if bin_counts[x] > 0]
+		
+		best_split = None
+		pos_left_weight = 0.0
+		neg_left_weight = 0.0
+		pos_right_weight = pos_weight
+		neg_right_weight = neg_weight
+		num_missing = bin_counts[self.missing_bin]
+		pos_missing_weight = bin_pos_weights[self.missing_bin]
+		neg_missing_weight = bin_neg_weights[self.missing_bin]
+		num_splits = len(occupied_bins)-1
+		if num_missing > 0:
+			num_splits += 1
+		for i in range(num_splits):
+			instance_bin = occupied_bins[i]
+			pos_right_weight -= bin_pos_weights[instance_bin]
+			pos_left_weight += bin_pos_weights[instance_bin]
+			neg_right_weight -= bin_neg_weights[instance_bin]
+			neg_left_weight += bin_neg_weights[instance_bin]
+			new_entropy = weighted_entropy(pos_left_weight,neg_left_weight,pos_right_weight,neg_right_weight)
+			missing_left = False
+			if num_missing > 0 and i < len(occupied_bins)-1:
+				missing_left_entropy = weighted_entropy(pos_left_weight+pos_missing_weight,neg_left_weight+neg_missing_weight,pos_right_weight-pos_missing_weight,neg_right_weight-neg_missing_weight)
+				if missing_left_entropy < new_entropy:
+					(new_entropy,missing_left) = (missing_left_entropy,True)
+			if best_split == None or new_entropy < best_split[0]:
+				if i < len(occupied_bins)-1:
+					split_value = split_threshold(self.bin_max[instance_bin],self.bin_min[occupied_bins[i+1]])
+				else:
+					split_value = self.bin_max[instance_bin]
+				best_split = (new_entropy,split_value,instance_bin,missing_left)
+		return best_split
+
+# the threshold midway between the largest value going left and the smallest
+# going right; when that is infinite (the right value is, or the sum of two
+# huge values overflows) it stays finite, at the largest finite float or the
+# exact midpoint, so every value below right_value still goes left
+def split_threshold(left_value,right_value):
+	if right_value == float("inf"):
+		return sys.float_info.max
+	threshold = mean([left_value,right_value])
+	if threshold == float("inf"):
+		return left_value + (right_value-left_value)/2.0
+	return threshold
+
+# column with +Inf replaced by NaN, for learning with +Inf as missing; the
+# column itself if it has no +Inf
+def inf_as_nan(column):
+	if INFINITY not in column:
+		return column
+	return compact_column([NAN if x == INFINITY else x for x in column])
+
+# missing values are NaN, the only value not equal to itself
+def has_missing_values(column):
+	for value in column:
+		if value != value:
+			return True
+	return False
+
+# instances in ascending order of column value, followed by those with missing
+# values, which do not compare with anything and so cannot be sorted in place
+def sorted_by_value(instances,column,has_missing=True):
+	if not has_missing:
+		return sorted(instances,key=column.__getitem__)
+	return sorted([x for x in instances if column[x] == column[x]],key=column.__getitem__) + [x for x in instances if column[x] != column[x]]
+
+# the number of instances at the end of sorted_instances with missing values
+def count_missing_tail(sorted_instances,column):
+	num_missing = 0
+	while num_missing < len(sorted_instances) and column[sorted_instances[-1-num_missing]] != column[sorted_instances[-1-num_missing]]:
+		num_missing += 1
+	return num_missing
+
 def mean(values):
 	return float(sum(values))/len(values)
 